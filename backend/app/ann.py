@@ -0,0 +1,172 @@
+import os
+from typing import Optional
+
+import numpy as np
+
+from app.config import VECTOR_INDEX, IVF_NLIST, IVF_NPROBE, IVF_TRAIN_MIN
+
+_BLOCK_ROWS = 65536
+
+
+def _atomic_save(path: str, array: np.ndarray):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(array.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class IVFIndex:
+    """
+    Inverted-file ANN index over the NumPy vector store.
+
+    Rows are bucketed by their nearest centroid (spherical k-means on unit vectors).
+    A query scores only the rows in the `nprobe` closest buckets, so recall/latency is
+    tuned with nprobe. Until `train_min` rows exist the index stays untrained and the
+    store falls back to exact search. New rows are assigned to a bucket as they are added.
+
+    On disk: ivf-<gen>.centroids (float32, nlist x dim) and ivf-<gen>.assign (int32, one
+    bucket id per row, appended alongside the vector matrix).
+    """
+
+    def __init__(self, nlist: int = 1024, nprobe: int = 16, train_min: int = 20000, seed: int = 0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_min = train_min
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        self.assign = np.empty(0, dtype=np.int32)
+        self.trained_rows = 0
+        self._lists = None
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    @property
+    def nbytes(self) -> int:
+        size = self.assign.nbytes + (self.centroids.nbytes if self.centroids is not None else 0)
+        if self._lists is not None:
+            size += sum(part.nbytes for part in self._lists)
+        return size
+
+    # --- Training / assignment -------------------------------------------
+
+    def _nearest(self, vectors: np.ndarray) -> np.ndarray:
+        out = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), _BLOCK_ROWS):
+            block = np.asarray(vectors[start:start + _BLOCK_ROWS], dtype=np.float32)
+            out[start:start + len(block)] = np.argmax(block @ self.centroids.T, axis=1)
+        return out
+
+    def train(self, matrix: np.ndarray, iterations: int = 10):
+        rows = len(matrix)
+        nlist = min(self.nlist, rows)
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(rows, nlist * 256)
+        sample = np.asarray(matrix[np.sort(rng.choice(rows, sample_size, replace=False))], dtype=np.float32)
+
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=nlist)
+            empty = counts == 0
+            # Re-seed empty buckets with random sample points
+            sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+
+        self.centroids = centroids
+        self.assign = self._nearest(matrix)
+        self.trained_rows = rows
+        self._lists = None
+
+    def add(self, vectors: np.ndarray):
+        if not self.trained:
+            return
+        self.assign = np.concatenate([self.assign, self._nearest(vectors)])
+        self._lists = None
+
+    def needs_training(self, rows: int) -> bool:
+        # Train once enough rows exist; retrain when the corpus has grown 4x since
+        if not self.trained:
+            return rows >= self.train_min
+        return rows >= 4 * self.trained_rows
+
+    # --- Search ----------------------------------------------------------
+
+    def _build_lists(self):
+        order = np.argsort(self.assign, kind="stable").astype(np.int64)
+        bounds = np.concatenate([[0], np.cumsum(np.bincount(self.assign, minlength=len(self.centroids)))])
+        return order, bounds
+
+    def candidates(self, q: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Returns the row ids in the nprobe closest buckets, or None for "scan everything".
+        """
+        if not self.trained:
+            return None
+        lists = self._lists
+        if lists is None:
+            lists = self._lists = self._build_lists()
+        order, bounds = lists
+
+        nprobe = min(self.nprobe, len(self.centroids))
+        probes = np.argpartition(-(self.centroids @ q), nprobe - 1)[:nprobe]
+        return np.concatenate([order[bounds[c]:bounds[c + 1]] for c in probes])
+
+    # --- Persistence -----------------------------------------------------
+
+    def load(self, root: str, meta: dict, rows: int, matrix=None):
+        if not meta.get("ivf_centroids"):
+            return
+        dim = meta["dim"]
+        self.centroids = np.fromfile(os.path.join(root, meta["ivf_centroids"]), dtype=np.float32).reshape(-1, dim)
+        committed = meta.get("ivf_rows", 0)
+        self.assign = np.fromfile(os.path.join(root, meta["ivf_assign"]), dtype=np.int32, count=committed)
+        self.trained_rows = meta.get("ivf_trained_rows", committed)
+        if committed < rows and matrix is not None:
+            self.assign = np.concatenate([self.assign, self._nearest(matrix[committed:rows])])
+        self._lists = None
+
+    def save(self, root: str, generation: int) -> dict:
+        """
+        Writes a freshly trained index under a new generation. Returns the manifest fields.
+        """
+        centroids_file = f"ivf-{generation:06d}.centroids"
+        assign_file = f"ivf-{generation:06d}.assign"
+        _atomic_save(os.path.join(root, centroids_file), self.centroids)
+        _atomic_save(os.path.join(root, assign_file), self.assign)
+        return {
+            "ivf_centroids": centroids_file,
+            "ivf_assign": assign_file,
+            "ivf_rows": len(self.assign),
+            "ivf_trained_rows": self.trained_rows,
+        }
+
+    def append(self, root: str, meta: dict) -> dict:
+        """
+        Appends assignments for rows added since the last commit. Returns the manifest fields.
+        """
+        committed = meta.get("ivf_rows", 0)
+        with open(os.path.join(root, meta["ivf_assign"]), "ab") as f:
+            f.truncate(committed * 4)
+            f.write(self.assign[committed:].tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        return {"ivf_rows": len(self.assign)}
+
+
+def create_ann_index():
+    """
+    Builds the ANN index selected by VECTOR_INDEX in app/config.py ("exact" disables it).
+    """
+    if VECTOR_INDEX == "ivf":
+        return IVFIndex(nlist=IVF_NLIST, nprobe=IVF_NPROBE, train_min=IVF_TRAIN_MIN)
+    if VECTOR_INDEX != "exact":
+        print(f"Warning: Unknown VECTOR_INDEX '{VECTOR_INDEX}', using exact search.")
+    return None
@@ -0,0 +1,162 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from app.citations import query_citation_keys
+from app.hashing import normalize_text
+
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+
+def normalize_query(query: str) -> str:
+    """
+    Case, whitespace and trailing punctuation are ignored when matching repeated questions.
+    """
+    return normalize_text(query).rstrip(" ?.!।")
+
+
+def query_anchors(query: str) -> frozenset:
+    """
+    The cited provisions and numbers of a question. Embeddings barely tell "Section 6" from
+    "Section 7", so a semantic hit requires these to match exactly.
+    """
+    return frozenset(query_citation_keys(query)) | frozenset(_NUMBER.findall(query))
+
+
+class AnswerCache:
+    """
+    In-memory cache of query answers, consulted before retrieval and generation.
+
+    A query hits when its normalised text matches a cached one exactly, or when its embedding's
+    cosine similarity to a cached query is at least similarity_threshold and both cite the same
+    provisions and numbers (see query_anchors). Every entry belongs to
+    an index version; once the index changes (upload, deletion) the whole cache is dropped.
+    Bounded by max_entries (least recently used evicted first) and ttl_seconds.
+    Answers to scoped queries (see app/filters.py) are only shared between queries with the same scope.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 86400, similarity_threshold: float = 0.95):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries = OrderedDict()  # (scope, normalised query) -> entry dict
+        self._version = None
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def _sync_version(self, index_version):
+        if index_version != self._version:
+            self._entries.clear()
+            self._version = index_version
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl_seconds
+        for key in [key for key, entry in self._entries.items() if entry["created"] < cutoff]:
+            del self._entries[key]
+
+    def get(self, query: str, index_version, scope: str = ""):
+        """
+        Exact lookup by normalised text. Returns the cached answer or None.
+        """
+        key = (scope, normalize_query(query))
+        with self._lock:
+            self._sync_version(index_version)
+            self._expire()
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            self.exact_hits += 1
+            self.saved_seconds += entry["seconds"]
+            return entry["answer"]
+
+    def get_similar(self, query: str, embedding, index_version, scope: str = ""):
+        """
+        Semantic lookup: the answer of the most similar cached query above the threshold, among
+        those with the same anchors as query, or None.
+        embedding is the query's embedding, or a function embedding a query text. A function is
+        only called when there is a cached query to compare with, for query and for cached
+        queries stored without an embedding.
+        """
+        anchors = query_anchors(query)
+        with self._lock:
+            self._sync_version(index_version)
+            candidates = [
+                (key, entry) for key, entry in self._entries.items()
+                if key[0] == scope and entry["anchors"] == anchors
+            ]
+            if not candidates:
+                self.misses += 1
+                return None
+        # Embedding calls the model: not under the lock
+        if callable(embedding):
+            vector = _unit(embedding(query))
+            for _, entry in candidates:
+                if entry["embedding"] is None:
+                    entry["embedding"] = _unit(embedding(entry["query"]))
+        else:
+            vector = _unit(embedding)
+            candidates = [(key, entry) for key, entry in candidates if entry["embedding"] is not None]
+        with self._lock:
+            if candidates and index_version == self._version:
+                matrix = np.stack([entry["embedding"] for _, entry in candidates])
+                scores = matrix @ vector
+                best = int(np.argmax(scores))
+                key, entry = candidates[best]
+                if scores[best] >= self.similarity_threshold and self._entries.get(key) is entry:
+                    self._entries.move_to_end(key)
+                    self.semantic_hits += 1
+                    self.saved_seconds += entry["seconds"]
+                    return entry["answer"]
+            self.misses += 1
+            return None
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def put(self, query: str, answer, index_version, seconds: float, embedding=None, scope: str = ""):
+        """
+        Stores an answer computed against index_version; seconds is what it took to produce.
+        """
+        key = (scope, normalize_query(query))
+        with self._lock:
+            if index_version != self._version:
+                # The index changed while this answer was being generated
+                return
+            self._entries[key] = {
+                "query": query,
+                "answer": answer,
+                "embedding": _unit(embedding) if embedding is not None else None,
+                "anchors": query_anchors(query),
+                "seconds": seconds,
+                "created": time.time(),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            lookups = hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "saved_seconds": round(self.saved_seconds, 3),
+            }
+
+
+def _unit(embedding):
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
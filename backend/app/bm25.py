@@ -0,0 +1,225 @@
+import math
+import re
+import threading
+from array import array
+
+import numpy as np
+
+from app.segment_store import SegmentStore
+
+# Citations stay single tokens: "2(j)", "14(1)(a)" and "302A(2)" never match "2j" or "141a".
+# Indexed text also gets the bare section number ("2", "14", "302a"), so "Section 2" still
+# finds "Section 2(j)" while a query for "2(j)" only matches 2(j).
+_CITATION = r"\d+[a-z]?(?:\([0-9a-z]{1,4}\))+"
+# Letters/digits plus the combining vowel signs of Indic scripts and Arabic diacritics (Urdu)
+_WORD = r"(?:[^\W_]|[\u0900-\u0DFF\u064B-\u065F])+"
+_TOKEN = re.compile(f"{_CITATION}|{_WORD}")
+_CITATION_BASE = re.compile(r"^(\d+[a-z]?)\(")
+
+# Rough heap cost of one term's dict entry and array headers, and of one chunk's id entries
+_TERM_OVERHEAD_BYTES = 250
+_DOC_OVERHEAD_BYTES = 200
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were what "
+    "which who will with does do how under".split()
+)
+
+
+def tokenize(text: str, expand_citations: bool = True):
+    """
+    Lower-cased terms for BM25, citation-aware (see _CITATION).
+    expand_citations adds the bare section number after each citation (used for indexed text).
+    """
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        base = _CITATION_BASE.match(token) if expand_citations else None
+        if base:
+            tokens.append(base.group(1))
+    return tokens
+
+
+class BM25Index:
+    """
+    Inverted index with BM25 scoring, kept next to the vector store.
+
+    Postings live in memory as compact int arrays (term -> doc numbers, term frequencies).
+    On disk, each persisted batch of chunks is one SegmentStore segment holding per-chunk
+    term frequencies, so loading never re-tokenizes the corpus. Deleting a document
+    (by ref_doc_id) tombstones its chunks; compact() rewrites the journal without them.
+    """
+
+    def __init__(self, root: str, k1: float = 1.2, b: float = 0.75, compact_segments: int = 32):
+        self.root = root
+        self.k1 = k1
+        self.b = b
+        self.compact_segments = compact_segments
+        self._segments = SegmentStore(root)
+        self._lock = threading.RLock()
+        self._load()
+
+    def _reset(self):
+        self._doc_ids = []
+        self._doc_numbers = {}
+        self._doc_len = array("I")
+        self._ref_docs = {}
+        self._dead = set()
+        self._postings = {}
+        self._total_len = 0
+        self._pending = []
+
+    def _load(self):
+        self._reset()
+        for record in self._segments.iter_records():
+            self._apply(record)
+
+    def _apply(self, record):
+        if "delete" in record:
+            self._dead.update(self._ref_docs.pop(record["delete"], []))
+            return
+        doc = len(self._doc_ids)
+        self._doc_ids.append(record["id"])
+        self._doc_numbers[record["id"]] = doc
+        length = sum(record["tf"].values())
+        self._doc_len.append(length)
+        self._total_len += length
+        if record.get("ref") is not None:
+            self._ref_docs.setdefault(record["ref"], []).append(doc)
+        for term, tf in record["tf"].items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = (array("i"), array("i"))
+            postings[0].append(doc)
+            postings[1].append(tf)
+
+    @property
+    def doc_count(self) -> int:
+        return len(self._doc_ids) - len(self._dead)
+
+    @property
+    def dead_ratio(self) -> float:
+        return len(self._dead) / len(self._doc_ids) if self._doc_ids else 0.0
+
+    def stats(self) -> dict:
+        return {"chunks": self.doc_count, "terms": len(self._postings), "dead_ratio": self.dead_ratio}
+
+    def memory_bytes(self) -> int:
+        """
+        Estimated heap held by the index: posting arrays plus per-term and per-chunk bookkeeping.
+        """
+        with self._lock:
+            postings = sum(docs.itemsize * len(docs) + tfs.itemsize * len(tfs) for docs, tfs in self._postings.values())
+            return (
+                postings
+                + _TERM_OVERHEAD_BYTES * len(self._postings)
+                + _DOC_OVERHEAD_BYTES * len(self._doc_ids)
+                + self._doc_len.itemsize * len(self._doc_len)
+            )
+
+    def add(self, items):
+        """
+        Indexes (node_id, ref_doc_id, text) triples. Call persist() to make them durable.
+        """
+        with self._lock:
+            for node_id, ref_doc_id, text in items:
+                tf = {}
+                for token in tokenize(text):
+                    tf[token] = tf.get(token, 0) + 1
+                record = {"id": node_id, "ref": ref_doc_id, "tf": tf}
+                self._apply(record)
+                self._pending.append(record)
+
+    def node_ids(self):
+        """
+        Ids of the live (not deleted) chunks.
+        """
+        with self._lock:
+            return {node_id for doc, node_id in enumerate(self._doc_ids) if doc not in self._dead}
+
+    def rebuild(self, items):
+        """
+        Replaces the whole index with (node_id, ref_doc_id, text) triples, written as one segment.
+        """
+        with self._lock:
+            self._reset()
+            self.add(items)
+            records, self._pending = self._pending, []
+            self._segments.compact(records)
+
+    def delete(self, ref_doc_id: str):
+        with self._lock:
+            if ref_doc_id not in self._ref_docs:
+                return
+            self.persist()
+            record = {"delete": ref_doc_id}
+            self._segments.append([record])
+            self._apply(record)
+
+    def persist(self):
+        with self._lock:
+            if not self._pending:
+                return
+            self._segments.append(self._pending)
+            self._pending = []
+            if self._segments.segment_count >= self.compact_segments:
+                self.compact()
+
+    def compact(self):
+        """
+        Merges the journal into one segment, dropping deleted chunks.
+        """
+        with self._lock:
+            self.persist()
+            live, by_ref = {}, {}
+            for record in self._segments.iter_records():
+                if "delete" in record:
+                    for node_id in by_ref.pop(record["delete"], []):
+                        live.pop(node_id, None)
+                else:
+                    live[record["id"]] = record
+                    by_ref.setdefault(record.get("ref"), []).append(record["id"])
+            print(f"Compacting BM25 index: {len(live)} chunks, {len(self._dead)} deleted dropped...")
+            self._segments.compact(list(live.values()))
+            self._reset()
+            for record in live.values():
+                self._apply(record)
+
+    def _score_term(self, postings, live, norm, scores):
+        # Zero-copy views of the posting arrays; they must not outlive the lock (arrays cannot grow while viewed)
+        docs = np.frombuffer(postings[0], dtype=np.int32)
+        tfs = np.frombuffer(postings[1], dtype=np.int32).astype(np.float32)
+        idf = math.log(1 + (live - len(docs) + 0.5) / (len(docs) + 0.5))
+        scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norm[docs])
+
+    def search(self, query: str, top_k: int = 10, node_ids=None):
+        """
+        Returns [(node_id, score)] for the best-scoring live chunks, best first.
+        node_ids, if given, restricts the results to those chunks (a scoped query).
+        """
+        terms = set(tokenize(query, expand_citations=False))
+        with self._lock:
+            n = len(self._doc_ids)
+            if not n or not terms:
+                return []
+            doc_len = np.frombuffer(self._doc_len, dtype=np.uint32)[:n].astype(np.float32)
+            avgdl = self._total_len / n
+            norm = self.k1 * (1 - self.b + self.b * doc_len / avgdl)
+            scores = np.zeros(n, dtype=np.float32)
+            live = n - len(self._dead)
+            for term in terms:
+                postings = self._postings.get(term)
+                if postings is not None:
+                    self._score_term(postings, live, norm, scores)
+            if self._dead:
+                scores[list(self._dead)] = 0.0
+            if node_ids is not None:
+                allowed = np.zeros(n, dtype=bool)
+                allowed[[self._doc_numbers[node_id] for node_id in node_ids if node_id in self._doc_numbers]] = True
+                scores[~allowed] = 0.0
+            k = min(top_k, n)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self._doc_ids[i], float(scores[i])) for i in top if scores[i] > 0]
@@ -0,0 +1,54 @@
+import re
+
+# "Section 6", "Sec. 2(j)", "s. 302A", "Article 14(1)(a)", "Rule 3", "Order 7", "Clause 4(b)"
+_CITATION = re.compile(
+    r"\b(?P<kind>sections?|secs?\.?|s\.|articles?|arts?\.|rules?|orders?|clauses?)\s*"
+    r"(?P<number>\d+[a-z]?(?:\s?\([0-9a-z]{1,4}\))*)",
+    re.IGNORECASE,
+)
+# "... of the Hindu Succession Act, 1956" right after a citation
+_ACT = re.compile(r"\s*,?\s*of\s+(?:the\s+)?(?P<act>(?:[a-z.()&'-]+\s+){1,6}?act)\b", re.IGNORECASE)
+
+_KINDS = {
+    "section": "section", "sections": "section", "sec": "section", "secs": "section", "s": "section",
+    "article": "article", "articles": "article", "art": "article", "arts": "article",
+    "rule": "rule", "rules": "rule", "order": "order", "orders": "order", "clause": "clause", "clauses": "clause",
+}
+
+
+def extract_citations(text: str):
+    """
+    Canonical citation keys found in the text, e.g. "section:2(j)", "article:14(1)(a)".
+    A citation followed by "of the <...> Act" also yields an act-qualified key,
+    e.g. "section:6@hindu succession act".
+    """
+    keys = set()
+    for match in _CITATION.finditer(text):
+        kind = _KINDS[match.group("kind").lower().rstrip(".")]
+        number = re.sub(r"\s+", "", match.group("number")).lower()
+        key = f"{kind}:{number}"
+        keys.add(key)
+        act = _ACT.match(text, match.end())
+        if act:
+            keys.add(f"{key}@{' '.join(act.group('act').lower().split())}")
+    return keys
+
+
+def query_citation_keys(query: str):
+    """
+    The most specific keys to look up for a question: act-qualified keys where the question
+    names the act, plain keys otherwise.
+    """
+    keys = extract_citations(query)
+    qualified = {key for key in keys if "@" in key}
+    covered = {key.split("@")[0] for key in qualified}
+    return qualified | {key for key in keys if "@" not in key and key not in covered}
+
+
+def cited_acts(citations, key: str):
+    """
+    The acts a chunk's citation keys (see extract_citations) name for the plain key,
+    e.g. {"hindu succession act"} for "section:6".
+    """
+    prefix = f"{key}@"
+    return {citation[len(prefix):] for citation in citations if citation.startswith(prefix)}
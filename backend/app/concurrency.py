@@ -0,0 +1,18 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from app.config import BLOCKING_WORKERS
+
+# Dedicated, sized pool for blocking work (Gemini SDK calls, embedding, index search/insert,
+# file parsing). Async handlers await it instead of calling blocking code on the event loop,
+# so one slow request no longer stalls /health, login or other queries on the same worker.
+BLOCKING_POOL = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="blocking")
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Runs a synchronous callable on the blocking pool and awaits its result.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(BLOCKING_POOL, partial(func, *args, **kwargs))
@@ -7,6 +7,74 @@ GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 DATA_DIR = os.getenv("DATA_DIR", "../data")
 CHROMA_PATH = os.getenv("CHROMA_PATH", "../chroma_db")
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Uploads are rejected as soon as they exceed this size
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", 500)) * 1024 * 1024
+
+# Index persistence: new chunks are journaled as segments, merged once this many accumulate
+INDEX_COMPACT_SEGMENTS = int(os.getenv("INDEX_COMPACT_SEGMENTS", 32))
+# Deleted documents are tombstoned; the index is rewritten once this fraction of chunks is dead
+INDEX_COMPACT_DEAD_RATIO = float(os.getenv("INDEX_COMPACT_DEAD_RATIO", 0.2))
+
+# Persistent embedding cache keyed by (model, chunk text hash)
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "../embedding_cache.db")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 500000))
+# In-process LRU of question embeddings
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", 2048))
+
+# Embedding API batching: batch size shrinks on rate limits and grows back on success
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 100))  # texts per request (Gemini batch limit is 100)
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", 4))  # requests in flight
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", 8))
+
+# Vector search: "exact" (brute force) or "ivf" (approximate, for large corpora)
+VECTOR_INDEX = os.getenv("VECTOR_INDEX", "exact")
+IVF_NLIST = int(os.getenv("IVF_NLIST", 1024))  # number of buckets
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", 16))  # buckets scanned per query (higher = better recall, slower)
+IVF_TRAIN_MIN = int(os.getenv("IVF_TRAIN_MIN", 20000))  # exact search until this many chunks exist
+
+# Scanned PDF pages are OCR'd in page ranges, several ranges at a time
+OCR_PAGES_PER_REQUEST = int(os.getenv("OCR_PAGES_PER_REQUEST", 10))
+OCR_CONCURRENCY = int(os.getenv("OCR_CONCURRENCY", 4))
+OCR_MAX_ATTEMPTS = int(os.getenv("OCR_MAX_ATTEMPTS", 3))  # per page range
+OCR_RETRY_DELAY = float(os.getenv("OCR_RETRY_DELAY", 2))  # seconds, doubled per attempt
+# OCR output cached per (file sha256, page, model, prompt version); manage with manage_ocr_cache.py
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", "../ocr_cache")
+
+# Files are ingested as a stream: PDF pages are read (and OCR'd) this many at a time, and chunks
+# are embedded and inserted in batches of INGEST_BATCH_CHUNKS, so memory does not grow with file size
+INGEST_PAGE_WINDOW = int(os.getenv("INGEST_PAGE_WINDOW", OCR_PAGES_PER_REQUEST * OCR_CONCURRENCY))
+INGEST_BATCH_CHUNKS = int(os.getenv("INGEST_BATCH_CHUNKS", 1000))
+# "legal": chunks follow headings, sections, sub-sections and clauses (app/legal_chunker.py), with
+# section_path metadata; "sentence": fixed-size SentenceSplitter windows. Re-run reingest.py to re-chunk.
+CHUNKER = os.getenv("CHUNKER", "legal")
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 512))  # tokens, metadata included
+
+# Answer cache for repeated / near-duplicate questions (cleared whenever the index changes)
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 1000))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", 24 * 3600))  # seconds
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", 0.95))  # cosine similarity for a semantic hit
+
+# Retrieval: "hybrid" fuses vector and BM25 keyword results (reciprocal rank fusion); "vector" is dense only
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", 30))  # results taken from each retriever before fusion
+# Questions citing an exact provision ("Section 2(j)") are served from the citation index, skipping the vector scan
+CITATION_LOOKUP = os.getenv("CITATION_LOOKUP", "true").lower() == "true"
+
+# "user": every uploader gets an index shard of their own and queries read only their shard
+# (admins fan out over all shards); "none": one index for everyone. Re-run reingest.py after changing it.
+INDEX_SHARD_MODE = os.getenv("INDEX_SHARD_MODE", "none")
+# Estimated memory the loaded shards may hold (payloads, keyword postings, mapped matrices);
+# beyond it the least recently used shards are dropped and reopened from disk on their next query
+SHARD_MEMORY_BUDGET_MB = int(os.getenv("SHARD_MEMORY_BUDGET_MB", 2048))
+
+# Threads for blocking SDK/index calls made from async handlers
+BLOCKING_WORKERS = int(os.getenv("BLOCKING_WORKERS", 16))
+
+# Background ingestion queue
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 2))  # max files ingested concurrently
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", 3))
+INGEST_RETRY_DELAY = float(os.getenv("INGEST_RETRY_DELAY", 10))  # seconds, doubled per attempt
+INGEST_POLL_SECONDS = float(os.getenv("INGEST_POLL_SECONDS", 5))
 
 SMTP_SERVER = os.getenv("SMTP_SERVER")
 SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
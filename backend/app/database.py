@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Boolean
+from sqlalchemy import create_engine, Column, Integer, String, Boolean, Float
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -73,6 +73,28 @@ class Document(Base):
     filename = Column(String, index=True)
     upload_date = Column(String)
     user_id = Column(Integer, index=True)
+    content_hash = Column(String, nullable=True, index=True)  # sha256 of the uploaded bytes
+    file_path = Column(String, nullable=True)  # content-addressed location under DATA_DIR/objects
+    # Set when the content was already indexed under another document's id (a duplicate is not re-indexed)
+    index_document_id = Column(Integer, nullable=True, index=True)
+
+class IngestionJob(Base):
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    document_id = Column(Integer, index=True)
+    user_id = Column(Integer, index=True)
+    filename = Column(String)
+    file_path = Column(String)
+    file_hash = Column(String, nullable=True)  # sha256 computed at upload, so ingestion need not re-read the file
+    status = Column(String, default="queued", index=True)  # queued, running, done, failed
+    stage = Column(String, nullable=True)  # extracting, chunking, embedding, indexing
+    attempts = Column(Integer, default=0)
+    chunks = Column(Integer, nullable=True)
+    error = Column(String, nullable=True)
+    run_after = Column(Float, default=0.0)  # epoch seconds; used for retry backoff
+    created_at = Column(String)
+    updated_at = Column(String)
 
 def get_db():
     db = SessionLocal()
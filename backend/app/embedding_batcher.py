@@ -0,0 +1,146 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """
+    Recognises quota/rate-limit failures from the Gemini SDK (ResourceExhausted / HTTP 429)
+    and from plain HTTP clients.
+    """
+    for attr in ("code", "status_code", "status"):
+        value = getattr(error, attr, None)
+        if value == 429 or (callable(value) and getattr(value(), "value", None) == 429):
+            return True
+    if type(error).__name__ in ("ResourceExhausted", "TooManyRequests", "RateLimitError"):
+        return True
+    message = str(error).lower()
+    return "429" in message or "quota" in message or "rate limit" in message
+
+
+class AdaptiveEmbeddingBatcher:
+    """
+    Embeds a list of texts with an embed_fn(texts) -> embeddings callable.
+
+    Texts are packed into batches of up to max_batch_size, and up to `concurrency` batches
+    are in flight at once. Batch size adapts additively/multiplicatively: it grows by one
+    after each successful batch and halves on a rate-limit error. A rate-limit error also
+    pauses every worker for an exponentially growing, jittered delay before the failed
+    batch is retried. Other errors are retried with the same backoff up to max_retries.
+    """
+
+    def __init__(self, embed_fn, max_batch_size=100, min_batch_size=1, concurrency=4,
+                 max_retries=8, base_delay=1.0, max_delay=60.0):
+        self.embed_fn = embed_fn
+        self.max_batch_size = max_batch_size
+        self.min_batch_size = min_batch_size
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.batch_size = max_batch_size
+        self.last_stats = {}
+        self._lock = threading.Lock()
+        self._cooldown_until = 0.0
+
+    def _wait_for_cooldown(self):
+        while True:
+            with self._lock:
+                remaining = self._cooldown_until - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def _backoff(self, attempt):
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        delay *= random.uniform(0.5, 1.0)
+        with self._lock:
+            self._cooldown_until = max(self._cooldown_until, time.monotonic() + delay)
+
+    def embed(self, texts):
+        results = [None] * len(texts)
+        if not texts:
+            return results
+
+        state = {"cursor": 0, "in_flight": 0, "batches": 0, "rate_limited": 0, "error": None}
+        retries = deque()  # (indices, attempt) of failed batches
+
+        def next_batch():
+            """Returns (indices, attempt), "wait" while a failing batch may still be requeued, or None when done."""
+            with self._lock:
+                if state["error"] is not None:
+                    return None
+                if retries:
+                    item = retries.popleft()
+                elif state["cursor"] < len(texts):
+                    start = state["cursor"]
+                    end = min(len(texts), start + self.batch_size)
+                    state["cursor"] = end
+                    item = (list(range(start, end)), 0)
+                elif state["in_flight"]:
+                    return "wait"
+                else:
+                    return None
+                state["in_flight"] += 1
+                return item
+
+        def worker():
+            while True:
+                item = next_batch()
+                if item is None:
+                    return
+                if item == "wait":
+                    time.sleep(0.01)
+                    continue
+                indices, attempt = item
+                self._wait_for_cooldown()
+                try:
+                    embeddings = self.embed_fn([texts[i] for i in indices])
+                except Exception as e:
+                    rate_limited = is_rate_limit_error(e)
+                    with self._lock:
+                        state["in_flight"] -= 1
+                        if attempt + 1 > self.max_retries:
+                            state["error"] = e
+                            return
+                        if rate_limited:
+                            state["rate_limited"] += 1
+                            # Concurrent requests tend to fail together; shrink once per backoff window
+                            if time.monotonic() >= self._cooldown_until:
+                                self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+                        # Retry in pieces no larger than the (possibly reduced) batch size
+                        for start in range(0, len(indices), self.batch_size):
+                            retries.append((indices[start:start + self.batch_size], attempt + 1))
+                    self._backoff(attempt)
+                    continue
+
+                for i, embedding in zip(indices, embeddings):
+                    results[i] = embedding
+                with self._lock:
+                    state["in_flight"] -= 1
+                    state["batches"] += 1
+                    self.batch_size = min(self.max_batch_size, self.batch_size + 1)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for future in [pool.submit(worker) for _ in range(self.concurrency)]:
+                future.result()
+        if state["error"] is not None:
+            raise state["error"]
+
+        elapsed = time.perf_counter() - started
+        self.last_stats = {
+            "chunks": len(texts),
+            "batches": state["batches"],
+            "rate_limited": state["rate_limited"],
+            "batch_size": self.batch_size,
+            "seconds": elapsed,
+            "chunks_per_second": len(texts) / elapsed if elapsed > 0 else 0.0,
+        }
+        print(
+            f"Embedded {len(texts)} chunks in {state['batches']} batches "
+            f"({self.last_stats['chunks_per_second']:.1f} chunks/s, {state['rate_limited']} rate-limited)"
+        )
+        return results
@@ -0,0 +1,218 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List
+
+import numpy as np
+from pydantic import PrivateAttr
+from llama_index.core.base.embeddings.base import BaseEmbedding
+
+from app.hashing import text_sha256
+
+# Evict down to this fraction of max_entries so eviction does not run on every insert
+_EVICT_TO = 0.9
+
+
+class EmbeddingCache:
+    """
+    Disk-backed embedding cache (SQLite) keyed by (model name, sha256 of the embedded text).
+    Bounded to max_entries; the least recently used entries are evicted first.
+    """
+
+    def __init__(self, path: str, max_entries: int = 500000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL,"
+            " text_hash TEXT NOT NULL,"
+            " embedding BLOB NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+
+    def get_many(self, model: str, text_hashes: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self._lock:
+            for start in range(0, len(text_hashes), 500):
+                batch = text_hashes[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, embedding FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch],
+                ).fetchall()
+                for text_hash, blob in rows:
+                    found[text_hash] = np.frombuffer(blob, dtype=np.float32).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, text_hash) for text_hash in found],
+                )
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(text_hashes) - len(found)
+        return found
+
+    def put_many(self, model: str, items: Dict[str, List[float]]):
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, embedding, last_used) VALUES (?, ?, ?, ?)",
+                [
+                    (model, text_hash, np.asarray(embedding, dtype=np.float32).tobytes(), now)
+                    for text_hash, embedding in items.items()
+                ],
+            )
+            self._conn.commit()
+            self._evict()
+
+    def _evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        excess = count - int(self.max_entries * _EVICT_TO)
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+            (excess,),
+        )
+        self._conn.commit()
+        self.evictions += excess
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    Wraps an embedding model so every text embedding call consults the EmbeddingCache
+    first and only sends cache misses to the underlying model.
+    If a batcher (AdaptiveEmbeddingBatcher) is given, misses are sent through it instead of
+    the model's own batching.
+    Query embeddings are kept in a small in-process LRU (query_cache_size entries), so a
+    repeated question is embedded once.
+    """
+
+    _inner: Any = PrivateAttr()
+    _cache: Any = PrivateAttr()
+    _batcher: Any = PrivateAttr()
+    _query_cache: Any = PrivateAttr()
+    _query_cache_size: int = PrivateAttr()
+    _query_lock: Any = PrivateAttr()
+    _query_hits: int = PrivateAttr(default=0)
+    _query_misses: int = PrivateAttr(default=0)
+
+    def __init__(self, inner: BaseEmbedding, cache: EmbeddingCache, batcher: Any = None,
+                 query_cache_size: int = 1024, **kwargs: Any):
+        # With a batcher, hand it whole documents' worth of chunks and let it do the request sizing
+        kwargs.setdefault("embed_batch_size", 2048 if batcher is not None else inner.embed_batch_size)
+        super().__init__(model_name=inner.model_name, **kwargs)
+        self._inner = inner
+        self._cache = cache
+        self._batcher = batcher
+        self._query_cache = OrderedDict()
+        self._query_cache_size = query_cache_size
+        self._query_lock = threading.Lock()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def cache(self) -> EmbeddingCache:
+        return self._cache
+
+    @property
+    def batcher(self):
+        return self._batcher
+
+    def query_cache_stats(self) -> dict:
+        with self._query_lock:
+            lookups = self._query_hits + self._query_misses
+            return {
+                "entries": len(self._query_cache),
+                "hits": self._query_hits,
+                "misses": self._query_misses,
+                "hit_rate": self._query_hits / lookups if lookups else 0.0,
+            }
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        hashes = [text_sha256(text) for text in texts]
+        found = self._cache.get_many(self.model_name, list(set(hashes)))
+
+        missing = {}
+        for text, text_hash in zip(texts, hashes):
+            if text_hash not in found and text_hash not in missing:
+                missing[text_hash] = text
+        if missing:
+            if self._batcher is not None:
+                embeddings = self._batcher.embed(list(missing.values()))
+            else:
+                embeddings = self._inner.get_text_embedding_batch(list(missing.values()))
+            new_items = dict(zip(missing.keys(), embeddings))
+            self._cache.put_many(self.model_name, new_items)
+            found.update(new_items)
+
+        return [found[text_hash] for text_hash in hashes]
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embedding(text)
+
+    def _cached_query_embedding(self, query: str):
+        with self._query_lock:
+            embedding = self._query_cache.get(query)
+            if embedding is None:
+                self._query_misses += 1
+                return None
+            self._query_cache.move_to_end(query)
+            self._query_hits += 1
+            return embedding
+
+    def _remember_query_embedding(self, query: str, embedding: List[float]):
+        with self._query_lock:
+            self._query_cache[query] = embedding
+            self._query_cache.move_to_end(query)
+            while len(self._query_cache) > self._query_cache_size:
+                self._query_cache.popitem(last=False)
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        embedding = self._cached_query_embedding(query)
+        if embedding is None:
+            embedding = self._inner.get_query_embedding(query)
+            self._remember_query_embedding(query, embedding)
+        return embedding
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        embedding = self._cached_query_embedding(query)
+        if embedding is None:
+            embedding = await self._inner.aget_query_embedding(query)
+            self._remember_query_embedding(query, embedding)
+        return embedding
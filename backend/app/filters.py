@@ -0,0 +1,63 @@
+import json
+
+from llama_index.core.vector_stores.types import FilterCondition, FilterOperator, MetadataFilter, MetadataFilters
+
+_COMPARE = {
+    FilterOperator.EQ: lambda value, wanted: value == wanted,
+    FilterOperator.NE: lambda value, wanted: value != wanted,
+    FilterOperator.GT: lambda value, wanted: value is not None and value > wanted,
+    FilterOperator.GTE: lambda value, wanted: value is not None and value >= wanted,
+    FilterOperator.LT: lambda value, wanted: value is not None and value < wanted,
+    FilterOperator.LTE: lambda value, wanted: value is not None and value <= wanted,
+    FilterOperator.IN: lambda value, wanted: value in wanted,
+    FilterOperator.NIN: lambda value, wanted: value not in wanted,
+}
+
+
+def build_filters(document_ids=None, user_ids=None, languages=None, uploaded_after=None, uploaded_before=None):
+    """
+    Chunk metadata filters for a scoped query (all given conditions must hold), or None.
+    Upload dates are ISO strings: uploaded_after is inclusive, uploaded_before exclusive.
+    """
+    filters = []
+    if document_ids:
+        filters.append(MetadataFilter(key="document_id", value=list(document_ids), operator=FilterOperator.IN))
+    if user_ids:
+        filters.append(MetadataFilter(key="user_id", value=list(user_ids), operator=FilterOperator.IN))
+    if languages:
+        filters.append(MetadataFilter(key="language", value=list(languages), operator=FilterOperator.IN))
+    if uploaded_after:
+        filters.append(MetadataFilter(key="upload_date", value=uploaded_after, operator=FilterOperator.GTE))
+    if uploaded_before:
+        filters.append(MetadataFilter(key="upload_date", value=uploaded_before, operator=FilterOperator.LT))
+    return MetadataFilters(filters=filters) if filters else None
+
+
+def metadata_matches(metadata: dict, filters: MetadataFilters) -> bool:
+    """
+    Evaluates filters (EQ/NE/GT/GTE/LT/LTE/IN/NIN, AND/OR, nested) against a chunk's metadata.
+    """
+    results = []
+    for item in filters.filters:
+        if isinstance(item, MetadataFilters):
+            results.append(metadata_matches(metadata, item))
+            continue
+        compare = _COMPARE.get(item.operator)
+        if compare is None:
+            raise ValueError(f"Unsupported filter operator: {item.operator}")
+        try:
+            results.append(compare(metadata.get(item.key), item.value))
+        except TypeError:
+            results.append(False)  # e.g. comparing a missing date with a string
+    if filters.condition == FilterCondition.OR:
+        return any(results)
+    return all(results)
+
+
+def filters_key(filters) -> str:
+    """
+    Stable text form of filters, used to keep cached answers of differently scoped queries apart.
+    """
+    if filters is None:
+        return ""
+    return json.dumps(filters.model_dump(mode="json"), sort_keys=True)
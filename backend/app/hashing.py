@@ -0,0 +1,49 @@
+import hashlib
+import re
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def file_sha256(path: str) -> str:
+    """
+    Hashes a file's raw bytes in 1 MB blocks.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def normalize_text(text: str) -> str:
+    """
+    Canonical form used to detect the same content extracted from different files
+    (e.g. a judgment uploaded as both .pdf and .docx): case and whitespace are ignored.
+    """
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def text_sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class NormalizedTextHash:
+    """
+    Incremental text_sha256(normalize_text(...)) over texts joined by newlines, fed one at a time
+    (e.g. page by page), so a document's text never has to be held in memory at once.
+    """
+
+    def __init__(self):
+        self._digest = hashlib.sha256()
+        self._empty = True
+
+    def update(self, text: str):
+        # Whitespace runs collapse to one space, and the newline joining two texts is one such run
+        words = text.lower().split()
+        if not words:
+            return
+        self._digest.update((" ".join(words) if self._empty else " " + " ".join(words)).encode("utf-8"))
+        self._empty = False
+
+    def hexdigest(self) -> str:
+        return self._digest.hexdigest()
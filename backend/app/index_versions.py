@@ -0,0 +1,141 @@
+import json
+import os
+import shutil
+import time
+import uuid
+
+# Blue/green index layout:
+#   CHROMA_PATH/CURRENT           pointer: {"version": ..., "previous": ..., "activated_at": ...}
+#   CHROMA_PATH/versions/<id>/    one complete index (vector store + bm25) per version
+#   CHROMA_PATH/INGEST_PAUSED     present while a rebuild catches up and flips CURRENT (see pause_ingestion)
+# Without a CURRENT file the index lives directly in CHROMA_PATH (the layout before versioning);
+# it is addressed as version "legacy", so it can still be rolled back to.
+LEGACY_VERSION = "legacy"
+
+
+class IndexVersions:
+    """
+    Versioned index directories under one root with an atomically replaced CURRENT pointer.
+    A new version is built next to the live one, then activate() flips the pointer in a single
+    rename; rollback() flips it back to the previous version. Readers call current_version()
+    on every lookup, which costs one stat() unless the pointer changed.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self._pointer_path = os.path.join(root, "CURRENT")
+        self._pause_path = os.path.join(root, "INGEST_PAUSED")
+        self._versions_dir = os.path.join(root, "versions")
+        self._cached_stat = None
+        self._cached_pointer = {}
+
+    def _read_pointer(self) -> dict:
+        try:
+            stat = os.stat(self._pointer_path)
+        except FileNotFoundError:
+            self._cached_stat, self._cached_pointer = None, {}
+            return {}
+        key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if key != self._cached_stat:
+            with open(self._pointer_path, encoding="utf-8") as f:
+                self._cached_pointer = json.load(f)
+            self._cached_stat = key
+        return self._cached_pointer
+
+    def _write_pointer(self, pointer: dict):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = f"{self._pointer_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(pointer, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._pointer_path)
+
+    def current_version(self) -> str:
+        return self._read_pointer().get("version", LEGACY_VERSION)
+
+    def previous_version(self):
+        return self._read_pointer().get("previous")
+
+    def path(self, version: str) -> str:
+        if version == LEGACY_VERSION:
+            return self.root
+        return os.path.join(self._versions_dir, version)
+
+    def current_path(self) -> str:
+        return self.path(self.current_version())
+
+    def exists(self, version: str) -> bool:
+        if version == LEGACY_VERSION:
+            return os.path.exists(os.path.join(self.root, "manifest.json")) or os.path.exists(
+                os.path.join(self.root, "docstore.json")
+            )
+        return os.path.isdir(self.path(version))
+
+    def versions(self):
+        """
+        Every stored version, oldest first (version ids sort by creation time).
+        """
+        found = [LEGACY_VERSION] if self.exists(LEGACY_VERSION) else []
+        if os.path.isdir(self._versions_dir):
+            found.extend(sorted(name for name in os.listdir(self._versions_dir) if self.exists(name)))
+        return found
+
+    def create(self) -> str:
+        """
+        Allocates an empty directory for a new version and returns its id.
+        """
+        version = time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:6]
+        os.makedirs(self.path(version))
+        return version
+
+    def activate(self, version: str):
+        """
+        Makes `version` the live index. The pointer is replaced atomically; readers switch on their next lookup.
+        Only flips the pointer: uploads made since the version was built are not in it
+        (manage_index.py activate catches it up first, see reingest.catch_up_version).
+        """
+        if not self.exists(version):
+            raise ValueError(f"Index version {version} does not exist")
+        current = self.current_version()
+        if version == current:
+            return
+        self._write_pointer({"version": version, "previous": current, "activated_at": time.time()})
+
+    def rollback(self) -> str:
+        """
+        Re-activates the previous version and returns its id. Like activate, only flips the pointer.
+        """
+        previous = self.previous_version()
+        if previous is None or not self.exists(previous):
+            raise ValueError("No previous index version to roll back to")
+        self.activate(previous)
+        return previous
+
+    def remove(self, version: str):
+        """
+        Deletes a stored version. The live and previous versions (the rollback target) are kept.
+        """
+        if version in (self.current_version(), self.previous_version()):
+            raise ValueError(f"Index version {version} is live or the rollback target")
+        if version == LEGACY_VERSION:
+            raise ValueError("The legacy index shares its directory with the version root; delete it by hand")
+        shutil.rmtree(self.path(version))
+
+    def pause_ingestion(self):
+        """
+        Asks the API's ingestion workers (every process sharing this root) to stop starting jobs,
+        so nothing is written to the live version while a rebuild catches up and replaces it.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        with open(self._pause_path, "w", encoding="utf-8") as f:
+            json.dump({"pid": os.getpid(), "since": time.time()}, f)
+
+    def resume_ingestion(self):
+        try:
+            os.remove(self._pause_path)
+        except FileNotFoundError:
+            pass
+
+    def ingestion_paused(self) -> bool:
+        return os.path.exists(self._pause_path)
@@ -1,145 +1,991 @@
+import asyncio
 import os
+import tempfile
+import threading
+import time
 from llama_index.core import VectorStoreIndex, SimpleDirectoryReader, StorageContext, load_index_from_storage, Settings
 from llama_index.llms.gemini import Gemini
 from llama_index.embeddings.gemini import GeminiEmbedding
-from app.config import GOOGLE_API_KEY, CHROMA_PATH
+from app.config import GOOGLE_API_KEY, CHROMA_PATH, INDEX_COMPACT_SEGMENTS, INDEX_COMPACT_DEAD_RATIO
+from app.config import EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES, QUERY_EMBEDDING_CACHE_SIZE
+from app.config import EMBED_BATCH_SIZE, EMBED_CONCURRENCY, EMBED_MAX_RETRIES
+from app.config import OCR_PAGES_PER_REQUEST, OCR_CONCURRENCY, OCR_MAX_ATTEMPTS, OCR_RETRY_DELAY, OCR_CACHE_DIR
+from app.config import INGEST_PAGE_WINDOW, INGEST_BATCH_CHUNKS, CHUNKER, CHUNK_SIZE
+from app.config import ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL, ANSWER_CACHE_SIMILARITY
+from app.config import RETRIEVAL_MODE, HYBRID_CANDIDATES, CITATION_LOOKUP
+from app.config import INDEX_SHARD_MODE, SHARD_MEMORY_BUDGET_MB
+from app.vector_store import NumpyVectorStore
+from app.ann import create_ann_index
+from app.concurrency import run_blocking
+from app.hashing import file_sha256, normalize_text, text_sha256, NormalizedTextHash
+from app.embedding_cache import EmbeddingCache, CachedEmbedding
+from app.embedding_batcher import AdaptiveEmbeddingBatcher
+from app.pdf_pages import pdf_page_count, triage_pdf, write_page_subset, split_marked_pages
+from app.ocr_cache import OCRCache
+from app.answer_cache import AnswerCache
+from app.bm25 import BM25Index
+from app.retrieval import HybridRetriever, CitationRetriever, FanOutRetriever
+from app.citations import extract_citations
+from app.legal_chunker import LegalStructureSplitter
+from app.language import detect_language
+from app.filters import filters_key
+from app.index_versions import IndexVersions
+from app.shards import Shard, ShardManager
 
 import google.generativeai as genai
 
+# Process-wide resident index and query engine.
+# Loaded once at startup (see warm_up_index) and hot-swapped under the lock after ingestion,
+# so /query never has to re-parse the persisted index from disk.
+_index = None
+_query_engine = None
+_streaming_engine = None
+_bm25 = None  # keyword index kept in step with the vector store (see app/bm25.py)
+_index_lock = threading.RLock()
+_settings_ready = False
+_embedding_cache = None
+_embedding_batcher = None
+_ocr_cache = OCRCache(OCR_CACHE_DIR)
+# Bumped whenever the indexed content changes; cached answers from older versions are dropped
+_index_version = 0
+_loaded_version = None  # index_versions version id of the resident index
+_shards = None  # per-tenant shards of the live version (INDEX_SHARD_MODE="user"), see app/shards.py
+SHARED_SHARD = "shared"  # documents without an uploader
+ROOT_SHARD = "root"  # the version's unsharded index, as a shard key (never a directory under shards/)
+index_versions = IndexVersions(CHROMA_PATH)
+_answer_cache = AnswerCache(ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL, ANSWER_CACHE_SIMILARITY)
+
 # Configure Global Settings
 def init_settings():
+    global _settings_ready, _embedding_cache, _embedding_batcher
+    if _settings_ready:
+        return
     if GOOGLE_API_KEY:
-        from llama_index.core.node_parser import SentenceSplitter
         Settings.llm = Gemini(api_key=GOOGLE_API_KEY, model="models/gemini-flash-latest")
-        Settings.embed_model = GeminiEmbedding(api_key=GOOGLE_API_KEY, model="models/text-embedding-004")
-        # Optimization: Use SentenceSplitter with substantial overlap for legal context preservation
-        Settings.node_parser = SentenceSplitter(chunk_size=512, chunk_overlap=150)
+        # Every embedding call consults the on-disk cache first, so rebuilding an unchanged corpus is free
+        _embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES)
+        embed_model = GeminiEmbedding(api_key=GOOGLE_API_KEY, model="models/text-embedding-004")
+        _embedding_batcher = AdaptiveEmbeddingBatcher(
+            _gemini_batch_embed_fn(embed_model),
+            max_batch_size=EMBED_BATCH_SIZE,
+            concurrency=EMBED_CONCURRENCY,
+            max_retries=EMBED_MAX_RETRIES,
+        )
+        Settings.embed_model = CachedEmbedding(
+            embed_model, _embedding_cache, batcher=_embedding_batcher, query_cache_size=QUERY_EMBEDDING_CACHE_SIZE
+        )
+        # No Settings.node_parser: every ingestion path chunks with create_node_parser() (CHUNKER/CHUNK_SIZE)
         genai.configure(api_key=GOOGLE_API_KEY)
+        _settings_ready = True
+
+def _gemini_batch_embed_fn(embed_model: GeminiEmbedding):
+    """
+    GeminiEmbedding sends one request per text; this embeds a whole list in one
+    batchEmbedContents request, with the same model/task settings so vectors stay comparable.
+    """
+    def embed(texts):
+        result = genai.embed_content(
+            model=embed_model.model_name,
+            content=texts,
+            title=embed_model.title,
+            task_type=embed_model.task_type,
+        )
+        return result["embedding"]
+    return embed
+
+OCR_MODEL = "gemini-flash-latest"
+OCR_PROMPT = (
+    "Transcribe all text from this document accurately. "
+    "Keep the formatting as close to the original as possible. "
+    "Pay extreme attention to legal numbering and citations (e.g., Section 2(j) vs Section 2j). "
+    "If the document is in an Indian language (Hindi, Tamil, Malayalam, Telugu, Kannada, Sanskrit, or Urdu), "
+    "ensure the transcription is perfect in that script. "
+    "Output ONLY the transcribed text. Do not provide a summary or description."
+)
+# Part of every OCR cache key: editing the prompt invalidates previously cached transcriptions
+OCR_PROMPT_VERSION = text_sha256(OCR_PROMPT)[:12]
 
-async def process_with_gemini_ocr(file_path: str):
+async def process_with_gemini_ocr(file_path: str, page_count: int = None):
     """
     Uses Gemini 1.5 Flash to extract text from images or PDFs via multimodal perception.
     Supports English + 8 Indian languages: Hindi, Tamil, Malayalam, Telugu, Kannada, Sanskrit, and Urdu.
+    If page_count is given (a multi-page PDF), each page's text is preceded by a "=== PAGE n ===" marker.
     """
-    model = genai.GenerativeModel("gemini-flash-latest")
+    model = genai.GenerativeModel(OCR_MODEL)
     
     # 1. Upload file to Gemini API (supports PDF, PNG, JPEG etc.)
     # Note: Using the file API is more reliable for multi-page documents
     print(f"Uploading {file_path} to Gemini for OCR...")
-    file_metadata = genai.upload_file(path=file_path)
+    file_metadata = await run_blocking(genai.upload_file, path=file_path)
     
-    prompt = (
-        "Transcribe all text from this document accurately. "
-        "Keep the formatting as close to the original as possible. "
-        "Pay extreme attention to legal numbering and citations (e.g., Section 2(j) vs Section 2j). "
-        "If the document is in an Indian language (Hindi, Tamil, Malayalam, Telugu, Kannada, Sanskrit, or Urdu), "
-        "ensure the transcription is perfect in that script. "
-        "Output ONLY the transcribed text. Do not provide a summary or description."
-    )
+    prompt = OCR_PROMPT
+    if page_count:
+        prompt += (
+            f" The document has {page_count} pages. Before the text of each page, write a line "
+            "'=== PAGE n ===' where n is the page number (1 for the first page)."
+        )
     
-    response = model.generate_content([prompt, file_metadata])
+    response = await run_blocking(model.generate_content, [prompt, file_metadata])
     
     # Cleanup: Delete the reference to the file in Gemini's system
-    genai.delete_file(file_metadata.name)
+    await run_blocking(genai.delete_file, file_metadata.name)
     
     return response.text
 
-async def ingest_file(file_path: str):
+def _ocr_cache_key(file_hash: str, page) -> str:
+    return OCRCache.make_key(file_hash, page, OCR_MODEL, OCR_PROMPT_VERSION)
+
+def _ocr_cache_put(file_hash: str, page, text: str):
+    _ocr_cache.put(
+        _ocr_cache_key(file_hash, page), text,
+        file_hash=file_hash, page=page, model=OCR_MODEL, prompt_version=OCR_PROMPT_VERSION,
+    )
+
+async def _ocr_image(file_path: str, file_hash: str):
+    cache_key = _ocr_cache_key(file_hash, "image")
+    text = await run_blocking(_ocr_cache.get, cache_key)
+    if text is None:
+        text = await process_with_gemini_ocr(file_path)
+        await run_blocking(_ocr_cache_put, file_hash, "image", text or "")
+    else:
+        print(f"Using cached OCR for {file_path}.")
+    return text
+
+async def _iter_pdf_documents(file_path: str, file_hash: str, ocr: bool = True):
+    """
+    Page-level triage: text is taken from the PDF's own text layer, and only pages without
+    usable text (scans) are sent to Gemini OCR. Yields one Document per page, in page order,
+    with page_label metadata. OCR output is cached per page (see OCRCache); with ocr=False
+    scanned pages use only what is cached and otherwise keep their text-layer text.
+    Pages are read INGEST_PAGE_WINDOW at a time, so only one window is ever held in memory.
+    """
+    from llama_index.core import Document
+
+    file_name = os.path.basename(file_path)
+    page_count = await run_blocking(pdf_page_count, file_path)
+    scanned_count = cached_count = 0
+    for start in range(0, page_count, INGEST_PAGE_WINDOW):
+        pages = await run_blocking(triage_pdf, file_path, start=start, stop=start + INGEST_PAGE_WINDOW)
+        scanned = [page for page in pages if page["needs_ocr"]]
+        scanned_count += len(scanned)
+
+        uncached = []
+        for page in scanned:
+            # The ocr=False pass re-reads what the OCR pass already looked up: not counted twice
+            text = await run_blocking(_ocr_cache.get, _ocr_cache_key(file_hash, page["page_number"]), count=ocr)
+            if text is None:
+                uncached.append(page)
+            elif text:
+                page["text"] = text
+                page["extraction"] = "ocr"
+        cached_count += len(scanned) - len(uncached)
+        if uncached and ocr:
+            await _ocr_pages(file_path, file_hash, uncached)
+
+        for page in pages:
+            if page["text"].strip():
+                yield Document(
+                    text=page["text"],
+                    metadata={"file_name": file_name, "page_label": page["page_label"], "extraction": page["extraction"]},
+                )
+    if ocr:
+        print(f"{file_path}: {page_count - scanned_count} page(s) with a text layer, {scanned_count} page(s) need OCR"
+              f" ({cached_count} cached).")
+
+async def _ocr_pages(file_path: str, file_hash: str, scanned):
+    """
+    OCRs the scanned pages in ranges of OCR_PAGES_PER_REQUEST, at most OCR_CONCURRENCY at a time.
+    Each range is retried on its own; a range that keeps failing keeps its text-layer text
+    instead of failing the whole file.
+    """
+    semaphore = asyncio.Semaphore(OCR_CONCURRENCY)
+    ranges = [scanned[i:i + OCR_PAGES_PER_REQUEST] for i in range(0, len(scanned), OCR_PAGES_PER_REQUEST)]
+
+    async def ocr_range(page_range):
+        first, last = page_range[0]["page_label"], page_range[-1]["page_label"]
+        async with semaphore:
+            for attempt in range(1, OCR_MAX_ATTEMPTS + 1):
+                try:
+                    texts = await _ocr_page_range(file_path, page_range)
+                    break
+                except Exception as ocr_error:
+                    print(f"Gemini OCR failed for pages {first}-{last} (attempt {attempt}): {ocr_error}")
+                    if attempt == OCR_MAX_ATTEMPTS:
+                        return
+                    await asyncio.sleep(OCR_RETRY_DELAY * (2 ** (attempt - 1)))
+        for page, text in zip(page_range, texts):
+            await run_blocking(_ocr_cache_put, file_hash, page["page_number"], text)
+            if text:
+                page["text"] = text
+                page["extraction"] = "ocr"
+
+    await asyncio.gather(*(ocr_range(page_range) for page_range in ranges))
+
+async def _ocr_page_range(file_path: str, page_range):
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        upload_path = tmp.name
+    try:
+        await run_blocking(write_page_subset, file_path, [page["page_number"] for page in page_range], upload_path)
+        text = await process_with_gemini_ocr(upload_path, page_count=len(page_range))
+    finally:
+        os.remove(upload_path)
+    return split_marked_pages(text or "", len(page_range))
+
+# Metadata used for bookkeeping only; kept out of embedding and LLM inputs.
+_INTERNAL_METADATA_KEYS = ["document_id", "file_hash", "text_hash", "chunk_hash", "extraction", "citations",
+                          "user_id", "upload_date", "language"]
+# Where a chunk came from rather than what it says: kept out of the embedded text, so identical
+# chunks of different files get the same chunk_hash (and embedding-cache key) and share one embedding
+_SOURCE_METADATA_KEYS = ["file_name", "file_path", "page_label"]
+
+def _is_indexed(key, value, shard_key=None):
+    index, _ = _resolve(shard_key)
+    return index is not None and bool(index.vector_store.lookup(key, value))
+
+def _indexed_document_id(key, value, shard_key=None):
+    """
+    document_id of the chunks indexed with metadata key == value (None if they have none).
+    """
+    index, _ = _resolve(shard_key)
+    nodes = index.vector_store.lookup_nodes(key, value) if index is not None else []
+    return nodes[0].metadata.get("document_id") if nodes else None
+
+async def ingest_file(file_path: str, document_id: int = None, progress=None, file_hash: str = None,
+                      file_name: str = None, user_id: int = None, upload_date: str = None, on_duplicate=None):
     """
     Ingests a single file into the vector index.
-    Supports standard docs and image/PDF OCR via Gemini.
+    Supports standard docs and image/PDF OCR via Gemini (PDFs are OCR'd only on pages without a text layer).
+    If document_id is given, every chunk is tied to that `documents` row so it can be deleted later.
+    file_name is the name shown in sources (uploads are stored under their content hash);
+    user_id and upload_date (ISO string) are stored on every chunk for scoped queries.
+    progress, if given, is called on the blocking pool with the current stage name (used by the job queue).
+    Files whose bytes (or normalised extracted text) are already indexed are skipped and return 0;
+    on_duplicate, if given, is then called with the document_id the existing chunks carry (None if they
+    have none), so the caller can record which document holds the content.
+
+    The file is streamed in two passes over its pages (see iter_documents): the first hashes the
+    text for the duplicate check (and fills the OCR cache), the second chunks, embeds and inserts
+    INGEST_BATCH_CHUNKS chunks at a time. Memory use is bounded by the batch, not the file size.
     """
+    async def report(stage):
+        # progress may block (the job queue writes the stage to the database)
+        if progress:
+            await run_blocking(progress, stage)
+
     init_settings()
-    from llama_index.core import Document
-    
     print(f"Ingesting file: {file_path}")
+    if file_hash is None:
+        file_hash = await run_blocking(file_sha256, file_path)
+    shard_key = shard_key_for(user_id)
+    if document_id is not None and await run_blocking(_is_indexed, "document_id", document_id, shard_key):
+        # Batches are inserted as they are embedded: an interrupted earlier attempt at this
+        # document left part of it indexed, which would otherwise pass for a duplicate
+        print(f"Dropping chunks of an interrupted earlier attempt at document {document_id}.")
+        await run_blocking(delete_document_vectors, document_id, user_id)
+    async def skip(key, value):
+        if on_duplicate:
+            await run_blocking(on_duplicate, await run_blocking(_indexed_document_id, key, value, shard_key))
+        return 0
+
+    if await run_blocking(_is_indexed, "file_hash", file_hash, shard_key):
+        print(f"Skipping {file_path}: identical content is already indexed.")
+        return await skip("file_hash", file_hash)
+
+    await report("extracting")
+    text_hash = NormalizedTextHash()
+    pages = 0
+    async for document in iter_documents(file_path, file_hash):
+        text_hash.update(document.text)
+        pages += 1
+    if not pages:
+        print("No content extracted.")
+        return 0
+
+    text_hash = text_hash.hexdigest()
+    if await run_blocking(_is_indexed, "text_hash", text_hash, shard_key):
+        print(f"Skipping {file_path}: the same text is already indexed from another file.")
+        return await skip("text_hash", text_hash)
+
+    chunks, batch, node_parser = 0, [], create_node_parser()
+
+    async def flush():
+        # Embed outside the lock so queries keep being served while the embedding API is busy
+        await report("embedding")
+        index, _ = await run_blocking(_resolve, shard_key)
+        await run_blocking(_embed_nodes, batch, index.vector_store if index is not None else None)
+        await report("indexing")
+        await run_blocking(_insert_nodes, batch, shard_key)
+
+    await report("chunking")
+    async for document in iter_documents(file_path, file_hash, ocr=False):
+        batch.extend(await run_blocking(
+            build_nodes, [document], file_hash, text_hash,
+            document_id=document_id, file_name=file_name, user_id=user_id, upload_date=upload_date,
+            node_parser=node_parser,
+        ))
+        if len(batch) >= INGEST_BATCH_CHUNKS:
+            await flush()
+            chunks += len(batch)
+            batch = []
+            await report("chunking")
+    if batch:
+        await flush()
+        chunks += len(batch)
+    return chunks
+
+async def iter_documents(file_path: str, file_hash: str, ocr: bool = True):
+    """
+    Yields a file's text as llama_index Documents (one per page for PDFs, read a window at a time).
+    With ocr=False nothing new is sent to Gemini: scanned pages and images use the OCR cache
+    (filled by an earlier pass) and otherwise fall back like a failed OCR call.
+    """
+    from llama_index.core import Document
+
     file_ext = os.path.splitext(file_path)[1].lower()
-    documents = []
+    found = False
 
-    # 1. OCR for Images and PDFs (Handles scanned content)
-    if file_ext in [".png", ".jpg", ".jpeg", ".pdf"]:
-        print(f"Processing {file_ext} with Gemini OCR...")
+    # 1. PDFs: use the text layer where there is one, OCR only the scanned pages
+    if file_ext == ".pdf":
         try:
-            # FIX: Await the coroutine directly instead of using asyncio.run()
-            text = await process_with_gemini_ocr(file_path)
-            if text and len(text.strip()) > 0:
-                documents = [Document(text=text, metadata={"file_name": os.path.basename(file_path)})]
+            async for document in _iter_pdf_documents(file_path, file_hash, ocr=ocr):
+                found = True
+                yield document
+        except Exception as pdf_error:
+            print(f"PDF extraction failed: {pdf_error}")
+            if found:
+                # Part of the file was already consumed; falling back would repeat it
+                raise
+
+    # 2. OCR for Images (Handles scanned content)
+    if file_ext in [".png", ".jpg", ".jpeg"]:
+        try:
+            if ocr:
+                print(f"Processing {file_ext} with Gemini OCR...")
+                text = await _ocr_image(file_path, file_hash)
             else:
+                text = await run_blocking(_ocr_cache.get, _ocr_cache_key(file_hash, "image"), count=False)
+            if text and len(text.strip()) > 0:
+                found = True
+                yield Document(text=text, metadata={"file_name": os.path.basename(file_path)})
+            elif ocr:
                 print("OCR returned no text. Falling back to standard readers.")
         except Exception as ocr_error:
             print(f"Gemini OCR failed: {ocr_error}")
-            # Fallback for PDFs if OCR fails (e.g., if it's not a scan)
-            if file_ext == ".pdf":
-                try:
-                    from llama_index.readers.file import PyMuPDFReader
-                    parser = PyMuPDFReader()
-                    documents = parser.load_data(file_path)
-                except:
-                    pass
-    
-    # 2. Handle DOCX and other text-based files
-    if not documents:
+
+    # 3. Handle DOCX and other text-based files (their readers load the whole file)
+    if not found:
         try:
-            documents = SimpleDirectoryReader(input_files=[file_path]).load_data()
-            print(f"Used standard reader for {file_ext}.")
+            documents = await run_blocking(SimpleDirectoryReader(input_files=[file_path]).load_data)
+            if ocr:
+                print(f"Used standard reader for {file_ext}.")
         except Exception as e:
             print(f"Standard reader failed: {e}")
-    
-    if not documents:
-        print("No content extracted.")
-        return 0
+            documents = []
+        for document in documents:
+            yield document
 
-    # Optimization: Split into consistent semantic nodes before indexing
+async def extract_documents(file_path: str, file_hash: str):
+    """
+    Extracts a file's text as llama_index Documents (one per page for PDFs); [] if nothing was found.
+    Holds the whole file in memory; ingest_file streams it instead.
+    """
+    return [document async for document in iter_documents(file_path, file_hash)]
+
+def documents_text_hash(documents) -> str:
+    return text_sha256(normalize_text("\n".join(document.text for document in documents)))
+
+def create_node_parser():
+    """
+    The chunker selected by CHUNKER. One instance per file: the legal chunker carries the
+    current section from one page to the next.
+    """
     from llama_index.core.node_parser import SentenceSplitter
-    node_parser = SentenceSplitter(chunk_size=512, chunk_overlap=150)
+
+    if CHUNKER == "legal":
+        return LegalStructureSplitter(chunk_size=CHUNK_SIZE)
+    return SentenceSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=150)
+
+def build_nodes(documents, file_hash: str, text_hash: str, document_id: int = None, file_name: str = None,
+                user_id: int = None, upload_date: str = None, node_parser=None):
+    """
+    Attaches the chunk metadata (ids, hashes, uploader, upload date, language) to a file's
+    documents and splits them into nodes, ready for embedding.
+    Pass the same node_parser (see create_node_parser) for every batch of pages of one file.
+    """
+    # Chunks inherit ref_doc_id and metadata from their source document
+    for document in documents:
+        if document_id is not None:
+            document.id_ = str(document_id)
+            document.metadata["document_id"] = document_id
+        if file_name:
+            document.metadata["file_name"] = file_name
+        if user_id is not None:
+            document.metadata["user_id"] = user_id
+        if upload_date:
+            document.metadata["upload_date"] = upload_date
+        document.metadata["file_hash"] = file_hash
+        document.metadata["text_hash"] = text_hash
+        document.metadata["language"] = detect_language(document.text)
+        document.excluded_embed_metadata_keys.extend(_INTERNAL_METADATA_KEYS + _SOURCE_METADATA_KEYS)
+        document.excluded_llm_metadata_keys.extend(_INTERNAL_METADATA_KEYS)
+
+    if node_parser is None:
+        node_parser = create_node_parser()
     nodes = node_parser.get_nodes_from_documents(documents)
+    for node in nodes:
+        node.metadata["citations"] = sorted(extract_citations(node.text))
+    return nodes
 
-    if os.path.exists(CHROMA_PATH):
-        print("Loading existing index...")
-        storage_context = StorageContext.from_defaults(persist_dir=CHROMA_PATH)
-        index = load_index_from_storage(storage_context)
-        index.insert_nodes(nodes)
-        index.storage_context.persist(persist_dir=CHROMA_PATH)
-    else:
-        print("Creating new index...")
-        index = VectorStoreIndex(nodes)
-        index.storage_context.persist(persist_dir=CHROMA_PATH)
-    
-    return len(nodes)
+def _embed_nodes(nodes, vector_store=None):
+    """
+    Embeds nodes, calling the embedding model once per distinct chunk text.
+    Chunks whose text is already in vector_store (default: the resident index) reuse the stored embedding.
+    """
+    from llama_index.core.indices.utils import embed_nodes
+    from llama_index.core.schema import MetadataMode
 
-def get_query_engine():
+    if vector_store is None:
+        index = get_index()
+        vector_store = index.vector_store if index is not None else None
+    groups = {}
+    for node in nodes:
+        chunk_hash = text_sha256(node.get_content(metadata_mode=MetadataMode.EMBED))
+        node.metadata["chunk_hash"] = chunk_hash
+        group = groups.setdefault(chunk_hash, [])
+        if not group and vector_store is not None:
+            rows = vector_store.lookup("chunk_hash", chunk_hash)
+            if rows:
+                node.embedding = vector_store.get_embedding(rows[0])
+        group.append(node)
+
+    to_embed = [group[0] for group in groups.values() if group[0].embedding is None]
+    id_to_embedding = embed_nodes(to_embed, Settings.embed_model)
+    for group in groups.values():
+        first = group[0]
+        if first.embedding is None:
+            first.embedding = id_to_embedding[first.node_id]
+        for node in group[1:]:
+            node.embedding = first.embedding
+
+    print(f"Embedded {len(to_embed)} chunks ({len(nodes) - len(to_embed)} reused).")
+
+def shard_key_for(user_id):
+    """
+    The index shard holding a user's documents, or None when the index is not sharded
+    (INDEX_SHARD_MODE="none"). Documents without an uploader go to the "shared" shard.
+    """
+    if INDEX_SHARD_MODE != "user":
+        return None
+    return f"user-{user_id}" if user_id is not None else SHARED_SHARD
+
+def readable_shards(user_id):
+    """
+    Shards a user's queries read in sharded mode: their own, the shared shard and the root
+    (documents indexed before sharding was enabled). None when the index is not sharded.
+    """
+    own = shard_key_for(user_id)
+    if own is None:
+        return None
+    return [own, SHARED_SHARD, ROOT_SHARD]
+
+def list_shards():
+    """
+    Keys of every shard of the live index version (loaded or not), ROOT_SHARD included when
+    the unsharded index holds chunks.
+    """
+    keys = _get_shards().keys()
+    return keys + [ROOT_SHARD] if get_index() is not None else keys
+
+def _get_shards():
+    get_index()  # follows the CURRENT pointer; a flip replaces the shard manager
+    return _shards
+
+def _load_shard(key, path):
+    index, bm25 = _load_index(path)
+    return Shard(key, index, bm25) if index is not None else None
+
+def _resolve(shard_key):
+    """
+    (index, bm25) of a shard, or of the unsharded index for shard_key None or ROOT_SHARD;
+    (None, None) if there is none yet.
+    """
+    if shard_key is None or shard_key == ROOT_SHARD:
+        return get_index(), _bm25
+    shard = _get_shards().get(shard_key)
+    return (shard.index, shard.bm25) if shard is not None else (None, None)
+
+def _insert_nodes(nodes, shard_key=None):
+    """
+    Inserts embedded nodes into the resident index (or a tenant's shard), persists them and
+    hot-swaps the engine.
+    """
+    global _index, _query_engine, _streaming_engine, _bm25, _index_version
+    if shard_key is not None:
+        return _insert_shard_nodes(nodes, shard_key)
+    with _index_lock:
+        index = get_index()
+        if index is not None:
+            if _bm25 is None:
+                _bm25 = _open_bm25(index.vector_store)
+            index.insert_nodes(nodes)
+        else:
+            print("Creating new index...")
+            index, _bm25 = _create_index(nodes, index_versions.current_path())
+        _persist_nodes(index)
+        _bm25.add(_bm25_items(nodes))
+        _bm25.persist()
+
+        # Hot swap: later queries pick up the new chunks without reloading from disk
+        _index = index
+        _query_engine = _build_query_engine(_build_retriever(index, bm25=_bm25))
+        _streaming_engine = None  # rebuilt from the new index on first use
+        _index_version += 1
+
+def _insert_shard_nodes(nodes, shard_key):
+    global _index_version
+    shards = _get_shards()
+    with _index_lock, shards.pinned(shard_key):
+        shard = shards.get(shard_key)
+        if shard is not None:
+            shard.index.insert_nodes(nodes)
+        else:
+            print(f"Creating index shard {shard_key}...")
+            index, bm25 = _create_index(nodes, shards.path(shard_key))
+            shard = Shard(shard_key, index, bm25)
+        _persist_nodes(shard.index)
+        shard.bm25.add(_bm25_items(nodes))
+        shard.bm25.persist()
+        shard.engines = {}  # rebuilt from the new chunks on first use
+        shards.add(shard)
+        _index_version += 1
+
+def delete_document_vectors(document_id: int, user_id: int = None) -> bool:
+    """
+    Tombstones every chunk of a document in the resident index (and, when sharded, in its
+    uploader's shard). Returns True when enough dead chunks accumulated that compact_index() should run.
+    """
+    global _bm25, _index_version
+    ref_doc_id = str(document_id)
+    needs_compaction = False
+    with _index_lock:
+        # Chunks indexed before sharding was enabled stay in the unsharded index
+        index = get_index()
+        if index is not None:
+            vector_store = index.vector_store
+            vector_store.delete(ref_doc_id)
+            if _bm25 is None:
+                _bm25 = _open_bm25(vector_store)
+            _bm25.delete(ref_doc_id)
+            needs_compaction = max(vector_store.dead_ratio, _bm25.dead_ratio) >= INDEX_COMPACT_DEAD_RATIO
+
+        shard_key = shard_key_for(user_id)
+        if shard_key is not None:
+            shards = _get_shards()
+            with shards.pinned(shard_key):
+                shard = shards.get(shard_key)
+                if shard is not None:
+                    shard.vector_store.delete(ref_doc_id)
+                    shard.bm25.delete(ref_doc_id)
+                    needs_compaction = needs_compaction or (
+                        max(shard.vector_store.dead_ratio, shard.bm25.dead_ratio) >= INDEX_COMPACT_DEAD_RATIO
+                    )
+        _index_version += 1
+        return needs_compaction
+
+def compact_index(user_id: int = None):
+    """
+    Rewrites the index (and the uploader's shard, when sharded) without tombstoned chunks.
+    Meant to run in the background.
+    """
+    index = get_index()
+    if index is not None:
+        index.vector_store.compact()
+        if _bm25 is not None:
+            _bm25.compact()
+    shard_key = shard_key_for(user_id)
+    if shard_key is not None:
+        shards = _get_shards()
+        with shards.pinned(shard_key):
+            shard = shards.get(shard_key)
+            if shard is not None:
+                shard.vector_store.compact()
+                shard.bm25.compact()
+                shards.add(shard)  # re-measured without the dropped chunks
+
+def _has_index(path: str) -> bool:
+    return os.path.exists(os.path.join(path, "manifest.json")) or os.path.exists(os.path.join(path, "docstore.json"))
+
+def get_index():
+    """
+    Returns the resident index of the live version (see app/index_versions.py), loading it on
+    first use. When the CURRENT pointer has been flipped (a rebuild was activated or rolled back),
+    the new version is loaded and swapped in; requests already running finish on the old one.
+    """
+    version = index_versions.current_version()
+    if version == _loaded_version and (_index is not None or not _has_index(index_versions.path(version))):
+        return _index
+    with _index_lock:
+        if version != _loaded_version or (_index is None and _has_index(index_versions.path(version))):
+            _switch_index(version)
+        return _index
+
+def _switch_index(version):
+    global _index, _query_engine, _streaming_engine, _bm25, _shards, _loaded_version, _index_version
+    path = index_versions.path(version)
+    index = bm25 = None
+    if _has_index(path):
+        init_settings()
+        index, bm25 = _load_index(path)
+    if _loaded_version is not None and version != _loaded_version:
+        print(f"Switched to index version {version}.")
+    if _index is not None or index is not None or version != _loaded_version:
+        _index_version += 1  # cached answers came from another index
+    if _index is not None or (_loaded_version is not None and version != _loaded_version):
+        # Engines are bound to the index they were built from
+        _query_engine = None
+        _streaming_engine = None
+    if _shards is None or version != _loaded_version:
+        _shards = ShardManager(os.path.join(path, "shards"), _load_shard, budget_bytes=SHARD_MEMORY_BUDGET_MB * 1024 * 1024)
+    _index = index
+    _bm25 = bm25
+    _loaded_version = version
+
+def _legacy_nodes(index):
+    # The docstore keeps nodes without embeddings; re-attach them from the old vector store
+    nodes = []
+    for node in index.docstore.docs.values():
+        node = node.model_copy()
+        node.embedding = index.vector_store.get(node.node_id)
+        nodes.append(node)
+    return nodes
+
+def _bm25_items(nodes):
+    from llama_index.core.schema import MetadataMode
+    return [(node.node_id, node.ref_doc_id, node.get_content(metadata_mode=MetadataMode.NONE)) for node in nodes]
+
+def _open_bm25(vector_store):
+    """
+    Opens the keyword index next to the vector store (<index dir>/bm25) and brings it in line
+    with the stored chunks: built from them the first time (indexes created before hybrid
+    search), caught up with chunks it missed (a crash between the two persists), or rebuilt
+    if it holds chunks the vector store no longer has.
+    """
+    bm25 = BM25Index(os.path.join(vector_store.persist_dir, "bm25"), compact_segments=INDEX_COMPACT_SEGMENTS)
+    if bm25.doc_count != vector_store.node_count:
+        nodes = vector_store.get_nodes()
+        indexed = bm25.node_ids()
+        if indexed - {node.node_id for node in nodes}:
+            print(f"Rebuilding keyword index for {len(nodes)} chunks...")
+            bm25.rebuild(_bm25_items(nodes))
+        else:
+            missing = [node for node in nodes if node.node_id not in indexed]
+            print(f"Adding {len(missing)} chunks to the keyword index...")
+            bm25.add(_bm25_items(missing))
+            bm25.persist()
+    return bm25
+
+def _open_vector_store(path: str):
+    return NumpyVectorStore(path, ann=create_ann_index(), compact_segments=INDEX_COMPACT_SEGMENTS)
+
+def _load_index(path: str):
+    """
+    Opens the memory-mapped vector store under path and its keyword index; returns
+    (index, bm25), or (None, None) if there is nothing indexed there. Node payloads are replayed
+    from the segment journal, embeddings are mapped straight from the matrix file.
+    Indexes persisted in the old SimpleVectorStore JSON format are migrated on first load.
+    """
+    vector_store = _open_vector_store(path)
+    if vector_store.node_count == 0 and os.path.exists(os.path.join(path, "docstore.json")):
+        print("Migrating legacy index to the NumPy vector store...")
+        storage_context = StorageContext.from_defaults(persist_dir=path)
+        legacy_index = load_index_from_storage(storage_context)
+        vector_store.add(_legacy_nodes(legacy_index))
+        vector_store.persist()
+
+    if vector_store.node_count == 0:
+        return None, None
+    bm25 = _open_bm25(vector_store)
+    print(f"Loaded index with {vector_store.node_count} chunks from {path}.")
+    return VectorStoreIndex.from_vector_store(vector_store), bm25
+
+def _create_index(nodes, path: str):
+    vector_store = _open_vector_store(path)
+    bm25 = _open_bm25(vector_store)
+    storage_context = StorageContext.from_defaults(vector_store=vector_store)
+    return VectorStoreIndex(nodes, storage_context=storage_context), bm25
+
+def _persist_nodes(index):
+    """
+    Journals only the nodes inserted since the last persist (the vector store compacts itself).
+    """
+    index.vector_store.persist()
+
+def warm_up_index():
+    """
+    Loads the index and builds the query engine ahead of the first request.
+    """
     init_settings()
-    if os.path.exists(CHROMA_PATH):
-        storage_context = StorageContext.from_defaults(persist_dir=CHROMA_PATH)
-        index = load_index_from_storage(storage_context)
-        from llama_index.core import PromptTemplate
-        
-        # Custom Prompt for Multilingual Support and Legal Precision
-        qa_prompt_tmpl_str = (
-            "Context information is below.\n"
-            "---------------------\n"
-            "{context_str}\n"
-            "---------------------\n"
-            "Given the context information and not prior knowledge, "
-            "answer the query.\n"
-            "CRITICAL PRIVACY & CONTENT RULES:\n"
-            "1. NEVER mention full local file paths (e.g., ../data/..., C:\\Users\\...) or internal system directories in your answer. Refer to documents only by their filenames if necessary.\n"
-            "2. Prioritize the ACTUAL TEXT content of the document. Do not just summarize the metadata or file structure unless specifically asked.\n"
-            "3. If the context contains specific sections or clauses, use them to provide a detailed answer instead of saying the content is not provided.\n"
-            "LEGAL PRECISION RULES:\n"
-            "1. Treat legal citations (e.g., Section 2(j), Article 14) as LITERAL IDENTIFIERS. "
-            "Do NOT assume '2j' and '2(j)' are the same unless the document explicitly says so. "
-            "2. If you find multiple similar citations, clarify which one you are quoting.\n"
-            "3. Answer in the same language as the query. "
-            "If the query is in Hindi, Tamil, Telugu, Kannada, Malayalam, Sanskrit, or Urdu, "
-            "provide the complete answer in that language.\n"
-            "4. If the context contains legal text in another language, translate and explain it clearly.\n"
-            "Query: {query_str}\n"
-            "Answer: "
-        )
-        qa_prompt_tmpl = PromptTemplate(qa_prompt_tmpl_str)
+    return get_query_engine() is not None
 
-        # Increase similarity_top_k for better context retrieval in legal sections
-        return index.as_query_engine(text_qa_template=qa_prompt_tmpl, similarity_top_k=10)
+def _build_retriever(index, top_k: int = 10, filters=None, bm25=None):
+    """
+    Hybrid (vector + BM25, fused by reciprocal rank) unless RETRIEVAL_MODE is "vector" or there is no bm25.
+    With CITATION_LOOKUP, questions naming an exact citation are answered from the citation index first.
+    filters (see app/filters.py) restrict every stage to the matching chunks.
+    """
+    if RETRIEVAL_MODE != "hybrid" or bm25 is None:
+        retriever = index.as_retriever(similarity_top_k=top_k, filters=filters)
     else:
+        retriever = HybridRetriever(
+            index.as_retriever(similarity_top_k=max(top_k, HYBRID_CANDIDATES), filters=filters),
+            bm25,
+            index.vector_store,
+            similarity_top_k=top_k,
+            candidates=max(top_k, HYBRID_CANDIDATES),
+            filters=filters,
+        )
+    if CITATION_LOOKUP:
+        retriever = CitationRetriever(retriever, index.vector_store, similarity_top_k=top_k, filters=filters)
+    return retriever
+
+def _build_query_engine(retriever, streaming: bool = False):
+    from llama_index.core import PromptTemplate
+    from llama_index.core.query_engine import RetrieverQueryEngine
+
+    # Custom Prompt for Multilingual Support and Legal Precision
+    qa_prompt_tmpl_str = (
+        "Context information is below.\n"
+        "---------------------\n"
+        "{context_str}\n"
+        "---------------------\n"
+        "Given the context information and not prior knowledge, "
+        "answer the query.\n"
+        "CRITICAL PRIVACY & CONTENT RULES:\n"
+        "1. NEVER mention full local file paths (e.g., ../data/..., C:\\Users\\...) or internal system directories in your answer. Refer to documents only by their filenames if necessary.\n"
+        "2. Prioritize the ACTUAL TEXT content of the document. Do not just summarize the metadata or file structure unless specifically asked.\n"
+        "3. If the context contains specific sections or clauses, use them to provide a detailed answer instead of saying the content is not provided.\n"
+        "LEGAL PRECISION RULES:\n"
+        "1. Treat legal citations (e.g., Section 2(j), Article 14) as LITERAL IDENTIFIERS. "
+        "Do NOT assume '2j' and '2(j)' are the same unless the document explicitly says so. "
+        "2. If you find multiple similar citations, clarify which one you are quoting.\n"
+        "3. Answer in the same language as the query. "
+        "If the query is in Hindi, Tamil, Telugu, Kannada, Malayalam, Sanskrit, or Urdu, "
+        "provide the complete answer in that language.\n"
+        "4. If the context contains legal text in another language, translate and explain it clearly.\n"
+        "Query: {query_str}\n"
+        "Answer: "
+    )
+    qa_prompt_tmpl = PromptTemplate(qa_prompt_tmpl_str)
+
+    # Increase similarity_top_k for better context retrieval in legal sections
+    return RetrieverQueryEngine.from_args(
+        retriever, text_qa_template=qa_prompt_tmpl, streaming=streaming
+    )
+
+def get_metrics():
+    """
+    Cache and index counters for the admin metrics endpoint.
+    """
+    metrics = {}
+    if _embedding_cache is not None:
+        metrics["embedding_cache"] = _embedding_cache.stats()
+        metrics["query_embedding_cache"] = Settings.embed_model.query_cache_stats()
+    metrics["answer_cache"] = _answer_cache.stats()
+    lookups = _ocr_cache.hits + _ocr_cache.misses
+    metrics["ocr_cache"] = {
+        "hits": _ocr_cache.hits,
+        "misses": _ocr_cache.misses,
+        "hit_rate": _ocr_cache.hits / lookups if lookups else 0.0,
+    }
+    if _embedding_batcher is not None and _embedding_batcher.last_stats:
+        metrics["embedding_batches"] = _embedding_batcher.last_stats
+    index = _index
+    if index is not None:
+        metrics["index"] = {
+            "version": _loaded_version,
+            "chunks": index.vector_store.node_count,
+            "dead_ratio": index.vector_store.dead_ratio,
+            **index.vector_store.memory_usage(),
+        }
+    if _bm25 is not None:
+        metrics["keyword_index"] = {**_bm25.stats(), "heap_bytes": _bm25.memory_bytes()}
+    if _shards is not None and INDEX_SHARD_MODE != "none":
+        metrics["shards"] = _shards.stats()
+    return metrics
+
+def _scoped_retriever(top_k: int = 10, filters=None, shard_keys=None):
+    """
+    Retriever over the unsharded index (shard_keys None) or over the given shards (ROOT_SHARD
+    being the unsharded index), merging their results when there are several. None if none of
+    them has an index.
+    """
+    if shard_keys is None:
+        index = get_index()
+        return _build_retriever(index, top_k, filters, _bm25) if index is not None else None
+    retrievers = []
+    for key in shard_keys:
+        index, bm25 = _resolve(key)
+        if index is not None:
+            retrievers.append(_build_retriever(index, top_k, filters, bm25))
+    if not retrievers:
+        return None
+    return retrievers[0] if len(retrievers) == 1 else FanOutRetriever(retrievers, similarity_top_k=top_k)
+
+async def run_search(query_str: str, top_k: int = 10, filters=None, shard_keys=None):
+    """
+    Retrieval only: the top_k chunks for the query, best first, with no LLM call.
+    shard_keys (sharded mode) are the tenant shards to search.
+    Returns None if there is no index yet.
+    """
+    retriever = await run_blocking(_scoped_retriever, top_k, filters, shard_keys)
+    if retriever is None:
+        return None
+    return await run_blocking(retriever.retrieve, query_str)
+
+def _lookup_answer(query_str: str, scope: str = ""):
+    """
+    Checks the answer cache: exact normalised text first, then embedding similarity.
+    The question is only embedded when a cached one could match it (same scope and anchors);
+    a citation question answered from the citation index may never need its embedding.
+    Returns (cached answer or None, query embedding or None, index version).
+    """
+    version = _index_version
+    answer = _answer_cache.get(query_str, version, scope)
+    if answer is not None:
+        return answer, None, version
+    if not _settings_ready:
+        _answer_cache.record_miss()
+        return None, None, version
+    embedded = {}
+
+    def embed(text):
+        vector = Settings.embed_model.get_query_embedding(text)
+        if text == query_str:
+            embedded["query"] = vector
+        return vector
+
+    answer = _answer_cache.get_similar(query_str, embed, version, scope)
+    return answer, embedded.get("query"), version
+
+def _get_engine(filters=None, streaming: bool = False, shard_keys=None):
+    """
+    The shared (cached) query engine, a single shard's (cached) engine, or for a scoped or
+    fan-out query one built for it. Those are cheap to build: they reuse the resident indexes.
+    """
+    if shard_keys is None:
+        if filters is None:
+            return get_streaming_query_engine() if streaming else get_query_engine()
+        retriever = _scoped_retriever(10, filters, None)
+        return _build_query_engine(retriever, streaming=streaming) if retriever is not None else None
+    present = set(list_shards())
+    shard_keys = [key for key in shard_keys if key in present]
+    if not shard_keys:
+        return None
+    if filters is None and shard_keys == [ROOT_SHARD]:
+        return get_streaming_query_engine() if streaming else get_query_engine()
+    if filters is None and len(shard_keys) == 1:
+        shard = _get_shards().get(shard_keys[0])
+        if shard is None:
+            return None
+        engine = shard.engines.get(streaming)
+        if engine is None:
+            engine = _build_query_engine(_build_retriever(shard.index, bm25=shard.bm25), streaming=streaming)
+            shard.engines[streaming] = engine
+        return engine
+    retriever = _scoped_retriever(10, filters, shard_keys)
+    return _build_query_engine(retriever, streaming=streaming) if retriever is not None else None
+
+def _answer_scope(filters, shard_keys) -> str:
+    scope = filters_key(filters)
+    return scope if shard_keys is None else f"{scope}|{','.join(sorted(shard_keys))}"
+
+async def run_query(query_str: str, filters=None, shard_keys=None):
+    """
+    Answers a query on the blocking pool so the event loop keeps serving other requests.
+    Repeated and near-duplicate questions are answered from the answer cache.
+    filters (see app/filters.py) limit retrieval to the matching chunks; shard_keys (sharded
+    mode) are the tenant shards to read.
+    Returns None if there is no index yet.
+    """
+    engine = await run_blocking(_get_engine, filters, False, shard_keys)
+    if engine is None:
+        return None
+    scope = _answer_scope(filters, shard_keys)
+    cached, embedding, version = await run_blocking(_lookup_answer, query_str, scope)
+    if cached is not None:
+        return cached
+
+    started = time.perf_counter()
+    response = await run_blocking(engine.query, query_str)
+    _answer_cache.put(query_str, response, version, time.perf_counter() - started, embedding, scope)
+    return response
+
+async def stream_query(query_str: str, filters=None, shard_keys=None):
+    """
+    Retrieves context and starts a streaming answer on the blocking pool.
+    Returns None if there is no index yet; otherwise a response whose source_nodes are
+    already available and whose tokens are read with iter_answer_tokens.
+    A cached answer is returned as a complete (non-streaming) Response.
+    """
+    engine = await run_blocking(_get_engine, filters, True, shard_keys)
+    if engine is None:
         return None
+    scope = _answer_scope(filters, shard_keys)
+    cached, embedding, version = await run_blocking(_lookup_answer, query_str, scope)
+    if cached is not None:
+        return cached
+
+    started = time.perf_counter()
+    response = await run_blocking(engine.query, query_str)
+    # Picked up by iter_answer_tokens to cache the answer once it has been fully generated
+    response.metadata = dict(response.metadata or {}, answer_cache=(query_str, embedding, version, started, scope))
+    return response
+
+async def iter_answer_tokens(response):
+    """
+    Yields answer tokens as the LLM produces them, without blocking the event loop on each one.
+    """
+    from llama_index.core.base.response.schema import Response
+
+    if not hasattr(response, "response_gen"):
+        # Cached answer: sent in one piece
+        yield str(response.response)
+        return
+
+    tokens = []
+    while True:
+        token = await run_blocking(next, response.response_gen, None)
+        if token is None:
+            break
+        tokens.append(token)
+        yield token
+
+    pending = (response.metadata or {}).pop("answer_cache", None)
+    if pending is not None:
+        query_str, embedding, version, started, scope = pending
+        answer = Response(response="".join(tokens), source_nodes=response.source_nodes)
+        _answer_cache.put(query_str, answer, version, time.perf_counter() - started, embedding, scope)
+
+def get_streaming_query_engine():
+    global _streaming_engine
+    get_index()  # follows the CURRENT pointer; a flip resets the engines
+    if _streaming_engine is not None:
+        return _streaming_engine
+    with _index_lock:
+        if _streaming_engine is None:
+            index = get_index()
+            if index is not None:
+                _streaming_engine = _build_query_engine(_build_retriever(index, bm25=_bm25), streaming=True)
+        return _streaming_engine
+
+def get_query_engine():
+    global _query_engine
+    get_index()  # follows the CURRENT pointer; a flip resets the engines
+    if _query_engine is not None:
+        return _query_engine
+    with _index_lock:
+        if _query_engine is None:
+            index = get_index()
+            if index is not None:
+                _query_engine = _build_query_engine(_build_retriever(index, bm25=_bm25))
+        return _query_engine
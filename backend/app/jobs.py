@@ -0,0 +1,225 @@
+import asyncio
+import os
+import time
+import traceback
+from datetime import datetime
+
+from app.config import INGEST_WORKERS, INGEST_MAX_ATTEMPTS, INGEST_RETRY_DELAY, INGEST_POLL_SECONDS
+from app.database import SessionLocal, IngestionJob, Document
+from app.ingestion import ingest_file, delete_document_vectors, index_versions
+from app.concurrency import run_blocking
+
+# Durable ingestion queue: jobs live in the ingestion_jobs table, so queued work
+# survives restarts. A fixed pool of asyncio workers (INGEST_WORKERS) drains it.
+_wakeup = None
+_loop = None  # the event loop the workers run on (enqueue_ingestion may be called from other threads)
+_workers = []
+
+
+def enqueue_ingestion(document_id: int, user_id: int, filename: str, file_path: str, file_hash: str = None) -> int:
+    """
+    Queues a file for ingestion and returns the job id. Blocking (database write); safe to call
+    from any thread.
+    file_hash (sha256 of the file) is passed on to ingest_file when known.
+    """
+    now = datetime.utcnow().isoformat()
+    db = SessionLocal()
+    try:
+        job = IngestionJob(
+            document_id=document_id,
+            user_id=user_id,
+            filename=filename,
+            file_path=file_path,
+            file_hash=file_hash,
+            status="queued",
+            attempts=0,
+            run_after=0.0,
+            created_at=now,
+            updated_at=now,
+        )
+        db.add(job)
+        db.commit()
+        job_id = job.id
+    finally:
+        db.close()
+
+    if _wakeup is not None:
+        _loop.call_soon_threadsafe(_wakeup.set)
+    return job_id
+
+
+def _update_job(job_id: int, **fields):
+    fields["updated_at"] = datetime.utcnow().isoformat()
+    db = SessionLocal()
+    try:
+        db.query(IngestionJob).filter(IngestionJob.id == job_id).update(fields)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _delete_document_row(document_id: int):
+    # A permanently failed upload: drop its row and its stored file (unless another row uses the same file)
+    db = SessionLocal()
+    try:
+        doc = db.query(Document).filter(Document.id == document_id).first()
+        if doc is None:
+            return
+        file_path = doc.file_path
+        db.delete(doc)
+        db.commit()
+        if file_path and not db.query(Document).filter(Document.file_path == file_path).first():
+            if os.path.exists(file_path):
+                os.remove(file_path)
+    finally:
+        db.close()
+
+
+def _set_index_document(document_id: int, index_document_id):
+    # The document was skipped as a duplicate: its content is indexed under index_document_id
+    if index_document_id is None or index_document_id == document_id:
+        return
+    db = SessionLocal()
+    try:
+        db.query(Document).filter(Document.id == document_id).update({"index_document_id": index_document_id})
+        db.commit()
+    finally:
+        db.close()
+
+
+def reassign_duplicates(db, document_id: int):
+    """
+    Hands the indexed content of a document being deleted over to the documents that were
+    skipped as its duplicates (their index_document_id points at it): the oldest one is queued
+    to index its own file and the others now point at that one. Returns the job id, or None
+    if no document shared the content.
+    """
+    duplicates = db.query(Document).filter(Document.index_document_id == document_id).order_by(Document.id).all()
+    if not duplicates:
+        return None
+    heir = duplicates[0]
+    heir.index_document_id = None
+    for duplicate in duplicates[1:]:
+        duplicate.index_document_id = heir.id
+    db.commit()
+    return enqueue_ingestion(heir.id, heir.user_id, heir.filename, heir.file_path, file_hash=heir.content_hash)
+
+
+def _claim_next_job():
+    """
+    Atomically moves the oldest runnable job from queued to running.
+    The conditional UPDATE makes sure two workers never claim the same job.
+    Nothing is claimed while a rebuild has paused ingestion (see reingest.py).
+    """
+    if index_versions.ingestion_paused():
+        return None
+    db = SessionLocal()
+    try:
+        job = (
+            db.query(IngestionJob)
+            .filter(IngestionJob.status == "queued", IngestionJob.run_after <= time.time())
+            .order_by(IngestionJob.id)
+            .first()
+        )
+        if job is None:
+            return None
+        attempts = job.attempts
+        claimed = (
+            db.query(IngestionJob)
+            .filter(IngestionJob.id == job.id, IngestionJob.status == "queued")
+            .update({
+                "status": "running",
+                "attempts": attempts + 1,
+                "updated_at": datetime.utcnow().isoformat(),
+            })
+        )
+        db.commit()
+        if not claimed:
+            return None
+        if index_versions.ingestion_paused():
+            # Paused between the check above and the claim: the rebuild may already have seen no
+            # running jobs, so hand the job back
+            db.query(IngestionJob).filter(IngestionJob.id == job.id).update(
+                {"status": "queued", "attempts": attempts}
+            )
+            db.commit()
+            return None
+        db.refresh(job)
+        db.expunge(job)
+        return job
+    finally:
+        db.close()
+
+
+async def _run_job(job):
+    print(f"[ingest worker] Job {job.id}: {job.filename} (attempt {job.attempts})")
+    try:
+        chunks = await ingest_file(
+            job.file_path,
+            document_id=job.document_id,
+            file_hash=job.file_hash,
+            file_name=job.filename,
+            user_id=job.user_id,
+            upload_date=job.created_at,  # set in the same request that created the document row
+            progress=lambda stage: _update_job(job.id, stage=stage),
+            on_duplicate=lambda index_document_id: _set_index_document(job.document_id, index_document_id),
+        )
+        await run_blocking(_update_job, job.id, status="done", stage="done", chunks=chunks, error=None)
+        print(f"[ingest worker] Job {job.id} done: {chunks} chunks")
+    except Exception as e:
+        traceback.print_exc()
+        # Drop whatever part of the document made it into the index before retrying
+        try:
+            await run_blocking(delete_document_vectors, job.document_id, job.user_id)
+        except Exception as cleanup_error:
+            print(f"[ingest worker] Cleanup failed for job {job.id}: {cleanup_error}")
+
+        if job.attempts < INGEST_MAX_ATTEMPTS:
+            delay = INGEST_RETRY_DELAY * (2 ** (job.attempts - 1))
+            print(f"[ingest worker] Job {job.id} failed, retrying in {delay:.0f}s: {e}")
+            await run_blocking(_update_job, job.id, status="queued", error=str(e), run_after=time.time() + delay)
+        else:
+            print(f"[ingest worker] Job {job.id} failed permanently: {e}")
+            await run_blocking(_update_job, job.id, status="failed", error=str(e))
+            await run_blocking(_delete_document_row, job.document_id)
+
+
+async def _worker_loop(worker_id: int):
+    while True:
+        try:
+            job = await run_blocking(_claim_next_job)
+        except Exception as e:
+            print(f"[ingest worker {worker_id}] Failed to poll jobs: {e}")
+            job = None
+
+        if job is None:
+            _wakeup.clear()
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout=INGEST_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        await _run_job(job)
+
+
+def start_ingestion_workers():
+    """
+    Requeues jobs interrupted by a restart and starts the worker pool.
+    Must be called from the running event loop (app startup).
+    """
+    global _wakeup, _loop
+    db = SessionLocal()
+    try:
+        interrupted = db.query(IngestionJob).filter(IngestionJob.status == "running").update({"status": "queued"})
+        db.commit()
+        if interrupted:
+            print(f"Requeued {interrupted} interrupted ingestion job(s).")
+    finally:
+        db.close()
+
+    _loop = asyncio.get_running_loop()
+    _wakeup = asyncio.Event()
+    for worker_id in range(INGEST_WORKERS):
+        _workers.append(asyncio.create_task(_worker_loop(worker_id)))
+    print(f"Started {INGEST_WORKERS} ingestion worker(s).")
@@ -0,0 +1,35 @@
+# Unicode blocks of the scripts the OCR prompt supports, mapped to the language stored on chunks.
+# Devanagari covers both Hindi and Sanskrit; they are not told apart and are stored as "hi".
+_SCRIPTS = (
+    (0x0900, 0x097F, "hi"),
+    (0x0980, 0x09FF, "bn"),
+    (0x0A00, 0x0A7F, "pa"),
+    (0x0A80, 0x0AFF, "gu"),
+    (0x0B80, 0x0BFF, "ta"),
+    (0x0C00, 0x0C7F, "te"),
+    (0x0C80, 0x0CFF, "kn"),
+    (0x0D00, 0x0D7F, "ml"),
+    (0x0600, 0x06FF, "ur"),
+)
+
+
+def detect_language(text: str, sample: int = 4000) -> str:
+    """
+    Dominant language of the text by script: the Indic/Urdu script with the most letters,
+    "en" for Latin letters, "unknown" when there are no letters at all.
+    Only the first `sample` characters are inspected.
+    """
+    counts = {}
+    for char in text[:sample]:
+        code = ord(char)
+        if code < 0x0600:
+            if char.isalpha():
+                counts["en"] = counts.get("en", 0) + 1
+            continue
+        for start, end, language in _SCRIPTS:
+            if start <= code <= end:
+                counts[language] = counts.get(language, 0) + 1
+                break
+    if not counts:
+        return "unknown"
+    return max(counts, key=counts.get)
@@ -0,0 +1,206 @@
+import re
+from typing import Any, List, Sequence
+
+from pydantic import Field, PrivateAttr
+from llama_index.core.node_parser import NodeParser, SentenceSplitter
+from llama_index.core.node_parser.node_utils import build_nodes_from_splits
+from llama_index.core.schema import BaseNode, MetadataMode
+from llama_index.core.utils import get_tokenizer
+
+# Structural levels, outermost first
+HEADING, SECTION, SUBSECTION, CLAUSE, SUBCLAUSE = range(5)
+
+# "CHAPTER IV", "PART II - Definitions", "SCHEDULE I" on a line of their own
+_HEADING = re.compile(
+    r"^[ \t]*((?:CHAPTER|PART|SCHEDULE|APPENDIX|ANNEXURE)\b[^\n]{0,80})[ \t]*$", re.MULTILINE | re.IGNORECASE
+)
+# "6. Devolution of interest ..." (sections of an Act, numbered paragraphs of a judgment, rows of a schedule)
+_SECTION = re.compile(r"^[ \t]*(\d{1,3}[A-Z]{0,2})\.(?=[ \t]+\S)", re.MULTILINE)
+# "12.3 The tenant ..."
+_PARAGRAPH = re.compile(r"^[ \t]*(\d{1,3}\.\d{1,3})\.?(?=[ \t]+\S)", re.MULTILINE)
+# "(1)", "(a)", "(iv)" at the start of a line or right after the end of a sentence or clause
+# ("...2004.(2)Any property", "shall,—(a)by birth"), but not inside "sub-section (1)" or "2(j)"
+_MARKER = re.compile(r"(?:^|(?<=[.;:—–-]))[ \t]*\((\d{1,3}[A-Z]?|[a-z]{1,2}|[ivxl]{1,6})\)", re.MULTILINE)
+# "i) Partition among family members" (lists without the opening bracket)
+_BARE_MARKER = re.compile(r"^[ \t]*([ivx]{1,5}|[a-z])\)(?=[ \t]*\S)", re.MULTILINE)
+
+_ROMAN = re.compile(r"^(?:x{0,3})(?:ix|iv|v?i{0,3})$")
+
+
+def _marker_level(label: str, path) -> int:
+    if label[0].isdigit():
+        return SUBSECTION
+    if _ROMAN.match(label):
+        # "(i)" right after "(h)" (or "(v)" after "(u)") is a clause letter, not a roman numeral
+        clause = next((name for level, name in reversed(path) if level == CLAUSE), None)
+        if len(label) == 1 and clause == f"({chr(ord(label) - 1)})":
+            return CLAUSE
+        return SUBCLAUSE
+    return CLAUSE
+
+
+def _boundaries(text: str, path):
+    """
+    (offset, level, label) of every structural boundary in text, in order.
+    """
+    found = {}
+    for match in _HEADING.finditer(text):
+        found[match.start()] = (HEADING, " ".join(match.group(1).split())[:60])
+    for match in _SECTION.finditer(text):
+        found.setdefault(match.start(), (SECTION, match.group(1)))
+    for match in _PARAGRAPH.finditer(text):
+        found.setdefault(match.start(), (SUBSECTION, match.group(1)))
+    markers = [(match.start(), match.group(1)) for match in _MARKER.finditer(text)]
+    markers += [(match.start(), match.group(1)) for match in _BARE_MARKER.finditer(text)]
+    # Marker levels depend on the clauses seen before them, so they are resolved in text order
+    path = list(path)
+    for offset, kind in sorted(list(found.items()) + markers, key=lambda item: item[0]):
+        if isinstance(kind, tuple):
+            level, label = kind
+        elif offset in found:
+            continue
+        else:
+            label = f"({kind})"
+            level = _marker_level(kind, path)
+            found[offset] = (level, label)
+        path = [entry for entry in path if entry[0] < level] + [(level, label)]
+    return [(offset, level, label) for offset, (level, label) in sorted(found.items())]
+
+
+def structural_units(text: str):
+    """
+    The text of each structural unit (heading, section, sub-section, clause, ...) in text, in order.
+    """
+    starts = [0] + [offset for offset, _, _ in _boundaries(text, [])] + [len(text)]
+    return [text[start:end] for start, end in zip(starts, starts[1:]) if text[start:end].strip()]
+
+
+class LegalStructureSplitter(NodeParser):
+    """
+    Splits legal documents along their structure: chapter/part/schedule headings, numbered
+    sections or paragraphs, sub-sections "(1)", clauses "(a)" and sub-clauses "(i)".
+
+    Consecutive units are packed into chunks of up to chunk_size tokens. A chunk that would
+    overflow ends at the most significant boundary inside it (a new section rather than its
+    clause), and a heading always starts a new chunk. Only a single unit longer than chunk_size
+    is cut by sentences, with chunk_overlap tokens of overlap; elsewhere chunks do not overlap.
+
+    Every chunk gets section_path metadata (e.g. "6 > (3) > (a)"): the structure shared by the
+    units it holds. The path is carried from one document to the next, so the pages of a file
+    (parsed in order, by the same instance) keep the section they continue.
+    """
+
+    chunk_size: int = Field(default=512, gt=0, description="Maximum tokens per chunk, metadata included.")
+    chunk_overlap: int = Field(default=20, ge=0, description="Overlap when a single unit has to be cut.")
+
+    _path: Any = PrivateAttr(default_factory=list)
+    _tokenizer: Any = PrivateAttr()
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._tokenizer = get_tokenizer()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LegalStructureSplitter"
+
+    def _tokens(self, text: str) -> int:
+        return len(self._tokenizer(text))
+
+    def _units(self, text: str):
+        """
+        Splits text at its boundaries into [text, tokens, level, path] units; text before the
+        first boundary continues the current path.
+        """
+        boundaries = _boundaries(text, self._path)
+        units = []
+        starts = [0] + [offset for offset, _, _ in boundaries]
+        for i, start in enumerate(starts):
+            end = starts[i + 1] if i + 1 < len(starts) else len(text)
+            if i == 0:
+                level = None
+            else:
+                _, level, label = boundaries[i - 1]
+                self._path = [entry for entry in self._path if entry[0] < level] + [(level, label)]
+            piece = text[start:end]
+            if piece.strip():
+                units.append([piece, self._tokens(piece), level, list(self._path)])
+        return units
+
+    def _pack(self, units, chunk_size: int):
+        """
+        Groups units into chunks of at most chunk_size tokens (see the class docstring).
+        """
+        chunks, current, size = [], [], 0
+        for unit in units:
+            _, tokens, level, _ = unit
+            if current and (level == HEADING or size + tokens > chunk_size):
+                cut = len(current)
+                if level != HEADING:
+                    # Carry the trailing, most significant unit group over, if it fits with the new unit
+                    # (unless that would leave a fragment of a chunk behind)
+                    levels = [u[2] for u in current[1:] if u[2] is not None]
+                    if levels:
+                        top = min(levels)
+                        last = max(i for i in range(1, len(current)) if current[i][2] == top)
+                        head = sum(u[1] for u in current[:last])
+                        if head >= chunk_size // 4 and size - head + tokens <= chunk_size:
+                            cut = last
+                chunks.append(current[:cut])
+                current = current[cut:]
+                size = sum(u[1] for u in current)
+            current.append(unit)
+            size += tokens
+        if current:
+            chunks.append(current)
+        return chunks
+
+    @staticmethod
+    def _section_path(paths) -> str:
+        """
+        The structure shared by a chunk's units, then the range of units below it:
+        "6 > (3)" for clauses of one sub-section, "6 > (2)–(3)" across sub-sections, "15–17" across sections.
+        """
+        common = paths[0]
+        for path in paths[1:]:
+            length = 0
+            while length < min(len(common), len(path)) and common[length] == path[length]:
+                length += 1
+            common = common[:length]
+        labels = [label for _, label in common]
+        below = [path[len(common)][1] for path in paths if len(path) > len(common)]
+        if below:
+            labels.append(below[0] if below[0] == below[-1] else f"{below[0]}–{below[-1]}")
+        return " > ".join(labels)
+
+    def _split_text(self, text: str, chunk_size: int):
+        """
+        (chunk text, section_path) pairs for one document.
+        """
+        splits = []
+        for group in self._pack(self._units(text), chunk_size):
+            section_path = self._section_path([unit[3] for unit in group])
+            chunk_text = "".join(unit[0] for unit in group).strip()
+            if len(group) == 1 and group[0][1] > chunk_size:
+                sentences = SentenceSplitter(chunk_size=chunk_size, chunk_overlap=min(self.chunk_overlap, chunk_size // 2))
+                splits.extend((piece, section_path) for piece in sentences.split_text(chunk_text))
+            else:
+                splits.append((chunk_text, section_path))
+        return splits
+
+    def _parse_nodes(self, nodes: Sequence[BaseNode], show_progress: bool = False, **kwargs: Any) -> List[BaseNode]:
+        all_nodes = []
+        for node in nodes:
+            # Like SentenceSplitter: the longer of the embed/LLM metadata counts against the chunk size,
+            # plus room for the section_path added here
+            metadata_str = max(
+                node.get_metadata_str(mode=MetadataMode.EMBED), node.get_metadata_str(mode=MetadataMode.LLM), key=len
+            )
+            chunk_size = max(64, self.chunk_size - self._tokens(metadata_str) - 24)
+            splits = self._split_text(node.get_content(metadata_mode=MetadataMode.NONE), chunk_size)
+            parsed = build_nodes_from_splits([text for text, _ in splits], node, id_func=self.id_func)
+            for parsed_node, (_, section_path) in zip(parsed, splits):
+                if section_path:
+                    parsed_node.metadata["section_path"] = section_path
+            all_nodes.extend(parsed)
+        return all_nodes
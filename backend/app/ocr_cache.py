@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import time
+
+
+class OCRCache:
+    """
+    Content-addressed store for OCR output on local disk.
+
+    An entry is keyed by the sha256 of the source file's bytes, the page it came from and the
+    OCR model + prompt version, so unchanged pages are never transcribed twice while a prompt or
+    model change naturally misses. Each entry is one small JSON file under root/<key[:2]>/<key>.json.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(file_hash: str, page: str, model: str, prompt_version: str) -> str:
+        return hashlib.sha256(f"{file_hash}|{page}|{model}|{prompt_version}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def get(self, key: str, count: bool = True):
+        """
+        The cached text, or None. count=False leaves hits/misses alone (re-reading a page
+        whose lookup was already counted).
+        """
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            if count:
+                self.misses += 1
+            return None
+        if count:
+            self.hits += 1
+        return entry["text"]
+
+    def put(self, key: str, text: str, **meta):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = dict(meta, key=key, text=text, created_at=time.time())
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def entries(self):
+        """
+        Yields (path, entry) for every cached page.
+        """
+        if not os.path.isdir(self.root):
+            return
+        for shard in sorted(os.listdir(self.root)):
+            shard_dir = os.path.join(self.root, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for name in sorted(os.listdir(shard_dir)):
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(shard_dir, name)
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        yield path, json.load(f)
+                except (OSError, ValueError):
+                    continue
+
+    def evict(self, file_hash: str = None, older_than: float = None, prompt_version: str = None) -> int:
+        """
+        Removes entries matching every given filter (all entries if none is given).
+        older_than is a unix timestamp. Returns the number of entries removed.
+        """
+        removed = 0
+        for path, entry in list(self.entries()):
+            if file_hash is not None and entry.get("file_hash") != file_hash:
+                continue
+            if older_than is not None and entry.get("created_at", 0) >= older_than:
+                continue
+            if prompt_version is not None and entry.get("prompt_version") != prompt_version:
+                continue
+            os.remove(path)
+            removed += 1
+        return removed
+
+    def stats(self) -> dict:
+        entries = 0
+        size = 0
+        files = set()
+        for path, entry in self.entries():
+            entries += 1
+            size += os.path.getsize(path)
+            files.add(entry.get("file_hash"))
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "files": len(files),
+            "bytes": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,66 @@
+import re
+
+import pymupdf
+
+# A page with fewer extractable characters than this is treated as scanned and sent to OCR
+MIN_PAGE_CHARS = 50
+
+
+def pdf_page_count(file_path: str) -> int:
+    with pymupdf.open(file_path) as pdf:
+        return pdf.page_count
+
+
+def triage_pdf(file_path: str, min_chars: int = MIN_PAGE_CHARS, start: int = 0, stop: int = None):
+    """
+    Reads the PDF's text layer page by page, for pages start..stop-1 (default: all of them).
+    Returns a list of dicts (page_number 0-based, page_label, text, needs_ocr, extraction).
+    A page needs OCR when its text layer is missing or too short to be real content
+    (image-only scans, stamped pages).
+    """
+    pages = []
+    with pymupdf.open(file_path) as pdf:
+        stop = pdf.page_count if stop is None else min(stop, pdf.page_count)
+        for page_number in range(start, stop):
+            page = pdf[page_number]
+            text = page.get_text("text")
+            chars = len("".join(text.split()))
+            pages.append({
+                "page_number": page.number,
+                "page_label": page.get_label() or str(page.number + 1),
+                "text": text,
+                "needs_ocr": chars < min_chars,
+                "extraction": "text_layer",
+            })
+    return pages
+
+
+def write_page_subset(file_path: str, page_numbers, out_path: str):
+    """
+    Copies the given 0-based pages (in order) into a new PDF, so only those pages are uploaded for OCR.
+    """
+    with pymupdf.open(file_path) as source, pymupdf.open() as subset:
+        for page_number in page_numbers:
+            subset.insert_pdf(source, from_page=page_number, to_page=page_number)
+        subset.save(out_path)
+
+
+_PAGE_MARKER = re.compile(r"^=+\s*PAGE\s+(\d+)\s*=+\s*$", re.MULTILINE | re.IGNORECASE)
+
+
+def split_marked_pages(text: str, page_count: int):
+    """
+    Splits OCR output written with "=== PAGE n ===" markers (n is 1-based within the uploaded subset)
+    into a list of page_count strings. If the model ignored the markers, all text goes to the first page.
+    """
+    pages = [""] * page_count
+    markers = list(_PAGE_MARKER.finditer(text))
+    if not markers:
+        pages[0] = text.strip()
+        return pages
+    for i, marker in enumerate(markers):
+        end = markers[i + 1].start() if i + 1 < len(markers) else len(text)
+        index = int(marker.group(1)) - 1
+        if 0 <= index < page_count:
+            pages[index] = (pages[index] + "\n" + text[marker.end():end]).strip()
+    return pages
@@ -0,0 +1,117 @@
+from typing import Any, List
+
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+
+from app.citations import cited_acts, query_citation_keys
+from app.filters import metadata_matches
+
+# Standard RRF constant: dampens the weight of the very top ranks of each list
+RRF_K = 60
+
+
+def reciprocal_rank_fusion(rankings, k: int = RRF_K):
+    """
+    Fuses several rankings (lists of ids, best first) into [(id, score)], best first.
+    An id scores sum(1 / (k + rank)) over the rankings it appears in.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda pair: pair[1], reverse=True)
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Dense (vector) + keyword (BM25) retrieval fused with reciprocal rank fusion.
+    Keyword matches catch literal identifiers such as "Section 2(j)" that embeddings blur.
+    With filters, keyword results are restricted to the matching chunks as well (the vector
+    retriever is expected to be built with the same filters).
+    """
+
+    def __init__(self, vector_retriever: BaseRetriever, bm25: Any, vector_store: Any,
+                 similarity_top_k: int = 10, candidates: int = 30, filters: Any = None, **kwargs: Any):
+        self._vector_retriever = vector_retriever
+        self._bm25 = bm25
+        self._vector_store = vector_store
+        self._similarity_top_k = similarity_top_k
+        self._candidates = candidates
+        self._filters = filters
+        super().__init__(**kwargs)
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        vector_hits = self._vector_retriever.retrieve(query_bundle)
+        allowed = None
+        if self._filters is not None:
+            allowed = self._vector_store.filter_node_ids(self._filters)
+        keyword_hits = self._bm25.search(query_bundle.query_str, top_k=self._candidates, node_ids=allowed)
+
+        fused = reciprocal_rank_fusion([
+            [hit.node.node_id for hit in vector_hits],
+            [node_id for node_id, _ in keyword_hits],
+        ])[:self._similarity_top_k]
+
+        nodes = {hit.node.node_id: hit.node for hit in vector_hits}
+        missing = [node_id for node_id, _ in fused if node_id not in nodes]
+        if missing:
+            nodes.update((node.node_id, node) for node in self._vector_store.get_nodes_by_id(missing))
+        return [NodeWithScore(node=nodes[node_id], score=score) for node_id, score in fused if node_id in nodes]
+
+
+class CitationRetriever(BaseRetriever):
+    """
+    Exact citation lookup in front of another retriever. When the question cites provisions
+    ("Section 6 of the Hindu Succession Act") and the chunks citing them fit in similarity_top_k,
+    those chunks are returned straight from the vector store's citation index: no query
+    embedding, no vector scan. Anything else falls through to the inner retriever.
+    A question that cites a provision without naming the act ("What is Section 6?") also falls
+    through when the chunks citing it name different acts: they are about different provisions.
+    Only chunks matching `filters` (if given) are returned.
+    """
+
+    def __init__(self, inner: BaseRetriever, vector_store: Any, similarity_top_k: int = 10,
+                 filters: Any = None, **kwargs: Any):
+        self._inner = inner
+        self._vector_store = vector_store
+        self._similarity_top_k = similarity_top_k
+        self._filters = filters
+        super().__init__(**kwargs)
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        keys = query_citation_keys(query_bundle.query_str)
+        if keys:
+            nodes, ambiguous = {}, False
+            for key in sorted(keys):
+                acts = set()
+                for node in self._vector_store.lookup_nodes("citations", key):
+                    if self._filters is None or metadata_matches(node.metadata, self._filters):
+                        nodes.setdefault(node.node_id, node)
+                        if "@" not in key:
+                            acts |= cited_acts(node.metadata.get("citations", []), key)
+                ambiguous = ambiguous or len(acts) > 1
+            if not ambiguous and 0 < len(nodes) <= self._similarity_top_k:
+                return [NodeWithScore(node=node, score=1.0) for node in nodes.values()]
+        return self._inner.retrieve(query_bundle)
+
+
+class FanOutRetriever(BaseRetriever):
+    """
+    Queries several retrievers (one per index shard) and fuses their rankings with reciprocal
+    rank fusion. Raw scores are not compared: citation hits score 1.0, hybrid results carry
+    per-shard RRF values and vector results cosine similarities, none of them on a shared scale.
+    """
+
+    def __init__(self, retrievers: List[BaseRetriever], similarity_top_k: int = 10, **kwargs: Any):
+        self._retrievers = retrievers
+        self._similarity_top_k = similarity_top_k
+        super().__init__(**kwargs)
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        nodes, rankings = {}, []
+        for retriever in self._retrievers:
+            hits = retriever.retrieve(query_bundle)
+            nodes.update((hit.node.node_id, hit.node) for hit in hits)
+            rankings.append([hit.node.node_id for hit in hits])
+        fused = reciprocal_rank_fusion(rankings)[:self._similarity_top_k]
+        return [NodeWithScore(node=nodes[node_id], score=score) for node_id, score in fused]
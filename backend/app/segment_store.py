@@ -0,0 +1,97 @@
+import os
+import json
+
+MANIFEST_FILE = "manifest.json"
+SEGMENTS_DIR = "segments"
+
+
+def _atomic_write(path: str, data: str):
+    """
+    Writes data to a temp file, fsyncs it and renames it over the target.
+    A crash leaves either the old file or the new one, never a torn write.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class SegmentStore:
+    """
+    Append-only journal of index records.
+
+    Each append writes one immutable segment file (JSON lines). The manifest lists the
+    committed segments and is replaced atomically, so it is the commit point: a segment
+    that was written but never made it into the manifest is simply ignored on load.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.segments_dir = os.path.join(root, SEGMENTS_DIR)
+        self.manifest_path = os.path.join(root, MANIFEST_FILE)
+        self.manifest = self._read_manifest()
+
+    def _read_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {"segments": [], "next_segment": 1}
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_manifest(self, manifest):
+        _atomic_write(self.manifest_path, json.dumps(manifest))
+        self.manifest = manifest
+
+    def exists(self) -> bool:
+        return os.path.exists(self.manifest_path)
+
+    @property
+    def segment_count(self) -> int:
+        return len(self.manifest["segments"])
+
+    def _write_segment(self, records) -> str:
+        os.makedirs(self.segments_dir, exist_ok=True)
+        name = f"seg-{self.manifest['next_segment']:08d}.jsonl"
+        _atomic_write(
+            os.path.join(self.segments_dir, name),
+            "".join(json.dumps(record) + "\n" for record in records),
+        )
+        return name
+
+    def append(self, records, **meta) -> str:
+        """
+        Journals new records as one segment. Cost is proportional to the records only.
+        Extra keyword arguments are committed into the manifest together with the segment.
+        """
+        name = self._write_segment(records)
+        manifest = dict(self.manifest, **meta)
+        manifest["segments"] = self.manifest["segments"] + [name]
+        manifest["next_segment"] = self.manifest["next_segment"] + 1
+        self._write_manifest(manifest)
+        return name
+
+    def iter_records(self):
+        for name in self.manifest["segments"]:
+            with open(os.path.join(self.segments_dir, name), "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+
+    def compact(self, records, **meta):
+        """
+        Replaces every committed segment with a single segment holding `records`,
+        then removes the superseded files (including orphans from interrupted writes).
+        """
+        name = self._write_segment(records)
+        manifest = dict(self.manifest, **meta)
+        manifest["segments"] = [name]
+        manifest["next_segment"] = self.manifest["next_segment"] + 1
+        self._write_manifest(manifest)
+
+        for existing in os.listdir(self.segments_dir):
+            if existing != name:
+                try:
+                    os.remove(os.path.join(self.segments_dir, existing))
+                except OSError as e:
+                    print(f"Warning: Could not remove old segment {existing}: {e}")
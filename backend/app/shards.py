@@ -0,0 +1,147 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class Shard:
+    """
+    One tenant's index: a VectorStoreIndex over its own NumpyVectorStore, the BM25 keyword index
+    next to it, and the query engines built from them (created lazily, dropped on every write).
+    """
+
+    def __init__(self, key: str, index, bm25):
+        self.key = key
+        self.index = index
+        self.bm25 = bm25
+        self.engines = {}
+
+    @property
+    def vector_store(self):
+        return self.index.vector_store
+
+    def memory_usage(self) -> dict:
+        """
+        Estimated resident size: heap_bytes (node payloads, lookups, ANN lists, BM25 postings) and
+        mapped_bytes (the memory-mapped embedding matrix).
+        """
+        usage = self.vector_store.memory_usage()
+        usage["heap_bytes"] += self.bm25.memory_bytes() if self.bm25 is not None else 0
+        return usage
+
+
+class ShardManager:
+    """
+    Per-tenant index shards stored as subdirectories of root (one per shard key).
+
+    Shards are opened on first use by `loader(key, path)` (which returns a Shard, or None if the
+    directory holds no index) and kept resident while their estimated size (see
+    Shard.memory_usage()) fits in budget_bytes; beyond it the least recently used ones are
+    dropped. An evicted shard is reopened from disk when next needed: its matrix is mapped, not
+    read, so only the node payloads and keyword postings are rebuilt. The shard just used is never
+    evicted, even if it alone exceeds the budget, and neither are shards pinned by a writer
+    (see pinned()), so two copies of the same shard are never written to.
+    """
+
+    def __init__(self, root: str, loader, budget_bytes: int):
+        self.root = root
+        self.budget_bytes = budget_bytes
+        self._loader = loader
+        self._loaded = OrderedDict()  # key -> Shard, least recently used first
+        self._sizes = {}  # key -> estimated resident bytes of the loaded shard
+        self._pins = {}
+        self._lock = threading.RLock()
+        self.loads = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def keys(self):
+        """
+        Every shard on disk, loaded or not.
+        """
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root) if os.path.isdir(self.path(name)))
+
+    def get(self, key: str):
+        """
+        The resident shard for key, loading it if needed. None if the shard has no index yet.
+        """
+        with self._lock:
+            shard = self._loaded.get(key)
+            if shard is not None:
+                self._loaded.move_to_end(key)
+                return shard
+            if not os.path.isdir(self.path(key)):
+                return None
+            shard = self._loader(key, self.path(key))
+            if shard is not None:
+                self.loads += 1
+                self.add(shard)
+            return shard
+
+    def add(self, shard: Shard):
+        """
+        Registers a resident shard (e.g. one just created by a write) and measures it. Call it
+        again after a write or compaction changes the shard's size.
+        """
+        with self._lock:
+            usage = shard.memory_usage()
+            self._loaded[shard.key] = shard
+            self._loaded.move_to_end(shard.key)
+            self._sizes[shard.key] = usage["heap_bytes"] + usage["mapped_bytes"]
+            self._evict()
+
+    def resident_bytes(self) -> int:
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def _evict(self):
+        resident = sum(self._sizes.values())
+        # The most recently used shard stays: it is the one a request is about to query
+        for key in list(self._loaded)[:-1]:
+            if resident <= self.budget_bytes:
+                break
+            if self._pins.get(key):
+                continue
+            del self._loaded[key]
+            size = self._sizes.pop(key)
+            resident -= size
+            self.evictions += 1
+            self.evicted_bytes += size
+            print(f"Evicted index shard {key} ({size / (1024 * 1024):.1f} MB).")
+
+    @contextmanager
+    def pinned(self, key: str):
+        """
+        Keeps the shard resident (or, if it is not loaded yet, keeps whatever gets loaded) while held.
+        """
+        with self._lock:
+            self._pins[key] = self._pins.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._pins[key] -= 1
+                if not self._pins[key]:
+                    del self._pins[key]
+                self._evict()
+
+    def loaded(self):
+        with self._lock:
+            return list(self._loaded.values())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "shards": len(self.keys()),
+                "loaded": len(self._loaded),
+                "resident_bytes": sum(self._sizes.values()),
+                "budget_bytes": self.budget_bytes,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "evicted_bytes": self.evicted_bytes,
+            }
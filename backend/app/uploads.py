@@ -0,0 +1,166 @@
+import hashlib
+import os
+import tempfile
+
+try:
+    from python_multipart.exceptions import MultipartParseError
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.exceptions import MultipartParseError
+    from multipart.multipart import MultipartParser, parse_options_header
+
+from app.concurrency import run_blocking
+
+# Received bytes are buffered up to this size before each disk write
+WRITE_CHUNK_BYTES = 1024 * 1024
+OBJECTS_DIR = "objects"
+TMP_DIR = "tmp"
+
+
+class UploadError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class StreamedUpload:
+    """
+    A file received by receive_upload: written to a temp file under data_dir, with its
+    sha256 and size computed while the bytes were streamed in.
+    """
+
+    def __init__(self, filename: str, temp_path: str, sha256: str, size: int):
+        self.filename = filename
+        self.temp_path = temp_path
+        self.sha256 = sha256
+        self.size = size
+
+    def commit(self, data_dir: str) -> str:
+        """
+        Atomically moves the file to content-addressed storage (data_dir/objects/<hash[:2]>/<hash><ext>)
+        and returns the final path. Identical bytes are only stored once.
+        """
+        ext = os.path.splitext(self.filename)[1].lower()
+        target_dir = os.path.join(data_dir, OBJECTS_DIR, self.sha256[:2])
+        os.makedirs(target_dir, exist_ok=True)
+        path = os.path.join(target_dir, f"{self.sha256}{ext}")
+        os.replace(self.temp_path, path)
+        return path
+
+    def discard(self):
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+async def receive_upload(request, data_dir: str, max_bytes: int, allowed_extensions, field_name: str = "file"):
+    """
+    Streams the multipart file field of the request straight to disk, instead of letting
+    Starlette spool the whole body first and then copying it again.
+
+    The sha256 and size are computed on the fly. A body announced (Content-Length) or found
+    to be larger than max_bytes, or a file with a disallowed extension, is rejected with an
+    UploadError before the rest of the body is read; so are a malformed Content-Length or body.
+    """
+    content_type = request.headers.get("content-type", "")
+    _, params = parse_options_header(content_type)
+    boundary = params.get(b"boundary")
+    if not content_type.startswith("multipart/form-data") or not boundary:
+        raise UploadError(400, "Expected a multipart/form-data upload")
+
+    content_length = request.headers.get("content-length")
+    if content_length and not content_length.isdigit():
+        raise UploadError(400, "Invalid Content-Length header")
+    # Allow some room for the multipart headers around the file
+    if content_length and int(content_length) > max_bytes + 64 * 1024:
+        raise UploadError(413, f"File too large. Maximum size is {max_bytes // (1024 * 1024)} MB")
+
+    tmp_dir = os.path.join(data_dir, TMP_DIR)
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    state = {
+        "header_field": b"", "header_value": b"", "headers": {}, "in_file": False, "filename": None, "size": 0,
+        "complete": False,
+    }
+    pending = []
+    sha256 = hashlib.sha256()
+    out = None
+    temp_path = None
+
+    def on_header_field(data, start, end):
+        state["header_field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        state["header_value"] += data[start:end]
+
+    def on_header_end():
+        state["headers"][state["header_field"].lower()] = state["header_value"]
+        state["header_field"] = b""
+        state["header_value"] = b""
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(state["headers"].get(b"content-disposition", b""))
+        name = disposition.get(b"name", b"").decode("utf-8", "replace")
+        filename = disposition.get(b"filename")
+        state["in_file"] = name == field_name and filename is not None and state["filename"] is None
+        if state["in_file"]:
+            state["filename"] = os.path.basename(filename.decode("utf-8", "replace"))
+
+    def on_part_data(data, start, end):
+        if state["in_file"]:
+            pending.append(data[start:end])
+            state["size"] += end - start
+
+    def on_part_end():
+        state["in_file"] = False
+        state["headers"] = {}
+
+    def on_end():
+        state["complete"] = True
+
+    parser = MultipartParser(boundary, {
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+        "on_end": on_end,
+    })
+
+    def write_pending():
+        data = b"".join(pending)
+        pending.clear()
+        sha256.update(data)
+        out.write(data)
+
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if state["filename"] is not None and out is None:
+                ext = os.path.splitext(state["filename"])[1].lower()
+                if ext not in allowed_extensions:
+                    raise UploadError(400, f"Invalid file type. Allowed: {', '.join(allowed_extensions)}")
+                fd, temp_path = tempfile.mkstemp(dir=tmp_dir, suffix=ext)
+                out = os.fdopen(fd, "wb")
+            if state["size"] > max_bytes:
+                raise UploadError(413, f"File too large. Maximum size is {max_bytes // (1024 * 1024)} MB")
+            if out is not None and sum(len(part) for part in pending) >= WRITE_CHUNK_BYTES:
+                await run_blocking(write_pending)
+        parser.finalize()
+        if not state["complete"]:
+            raise UploadError(400, "Incomplete multipart body")
+        if out is None:
+            raise UploadError(400, f"No '{field_name}' file in the upload")
+        await run_blocking(write_pending)
+        await run_blocking(out.close)
+    except BaseException as e:
+        if out is not None:
+            out.close()
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+        if isinstance(e, MultipartParseError):
+            raise UploadError(400, f"Malformed multipart body: {e}") from e
+        raise
+
+    return StreamedUpload(state["filename"], temp_path, sha256.hexdigest(), state["size"])
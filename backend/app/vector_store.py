@@ -0,0 +1,572 @@
+import os
+import bisect
+import copy
+import threading
+from typing import Any, List, Optional, Sequence
+
+import numpy as np
+from pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.storage.docstore.utils import doc_to_json, json_to_doc
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    FilterCondition,
+    FilterOperator,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+
+from app.filters import metadata_matches
+from app.segment_store import SegmentStore
+
+
+# Metadata keys with an exact-match row lookup: content hashes used for deduplication, the legal
+# citations found in each chunk (a list value indexes the row under every element), and the
+# fields queries are most often scoped by
+LOOKUP_KEYS = ("file_hash", "text_hash", "chunk_hash", "citations", "document_id", "user_id", "language")
+# Metadata keys with a sorted index for range filters (GT/GTE/LT/LTE): upload dates are ISO strings,
+# so a date-only scope is a bisect instead of a scan of every row's metadata
+RANGE_KEYS = ("upload_date",)
+
+# Rough per-node heap cost beyond its text and metadata values: the node object, its
+# relationships and the id/lookup entries pointing at its row
+_NODE_OVERHEAD_BYTES = 1024
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class NumpyVectorStore(BasePydanticVectorStore):
+    """
+    Local vector store backed by a contiguous float32 matrix.
+
+    On disk:
+    - vectors-<gen>.f32: unit-normalised embeddings, one row per chunk, memory-mapped on load
+      (pages are shared between uvicorn workers through the OS page cache)
+    - vectors-<gen>.ids: node-id sidecar, one id per line, row-aligned with the matrix
+    - segments/: node payloads (text + metadata), journaled by SegmentStore
+
+    The segment manifest records how many rows/bytes are committed, so a torn append
+    after a crash is truncated away on the next write.
+
+    Deleting a document (by ref_doc_id) tombstones its rows in O(chunks-of-doc) and journals
+    a delete record; compact() later rewrites the matrix without the dead rows.
+    Search is a single matrix-vector product followed by argpartition for the top-k.
+    With an ANN index (see app/ann.py) only the candidate rows it returns are scored.
+    Queries with metadata filters score only the rows that match them.
+    """
+
+    stores_text: bool = True
+    persist_dir: str
+    compact_segments: int = 32
+
+    _segments: Any = PrivateAttr()
+    _lock: Any = PrivateAttr()
+    _matrix: Any = PrivateAttr()
+    _tail: Any = PrivateAttr()
+    _ids: Any = PrivateAttr()
+    _nodes: Any = PrivateAttr()
+    _pending: Any = PrivateAttr()
+    _ann: Any = PrivateAttr()
+    _dead: Any = PrivateAttr()
+    _ref_rows: Any = PrivateAttr()
+    _key_rows: Any = PrivateAttr()
+    _range_rows: Any = PrivateAttr()
+    _range_pending: Any = PrivateAttr()
+    _range_lock: Any = PrivateAttr()
+    _id_rows: Any = PrivateAttr()
+    _view_lock: Any = PrivateAttr()
+    _payload_bytes: Any = PrivateAttr()
+
+    def __init__(self, persist_dir: str, ann: Any = None, **kwargs: Any):
+        super().__init__(persist_dir=persist_dir, **kwargs)
+        self._ann = ann
+        self._lock = threading.RLock()
+        # Guards swapping the searchable state; held only for reference assignments
+        self._view_lock = threading.Lock()
+        self._range_lock = threading.Lock()
+        self._segments = SegmentStore(persist_dir)
+        self._load()
+
+    @property
+    def client(self) -> Any:
+        return None
+
+    # --- Loading ---------------------------------------------------------
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.persist_dir, name)
+
+    def _load(self):
+        manifest = self._segments.manifest
+        rows = manifest.get("rows", 0)
+        dim = manifest.get("dim")
+
+        self._nodes = []
+        self._ref_rows = {}
+        self._key_rows = {key: {} for key in LOOKUP_KEYS}
+        self._reset_range_rows()
+        self._id_rows = {}
+        self._payload_bytes = 0
+        dead = []
+        for record in self._segments.iter_records():
+            if "delete" in record:
+                dead.extend(self._ref_rows.pop(record["delete"], []))
+            else:
+                node = json_to_doc(record["node"])
+                self._track_node(node, len(self._nodes))
+                self._nodes.append(node)
+        self._ids = [node.node_id for node in self._nodes]
+        self._dead = np.array(sorted(dead), dtype=np.int64)
+        self._tail = None
+        self._pending = []
+
+        if rows and dim:
+            # Read-only mapping: loading is O(1) and pages are faulted in on demand
+            self._matrix = np.memmap(
+                self._path(manifest["vectors_file"]), dtype=np.float32, mode="r", shape=(rows, dim)
+            )
+        else:
+            self._matrix = None
+
+        if self._ann is not None and self._matrix is not None:
+            self._ann.load(self.persist_dir, manifest, rows, self._matrix)
+
+    @property
+    def dim(self) -> Optional[int]:
+        return self._segments.manifest.get("dim")
+
+    @property
+    def node_count(self) -> int:
+        # Not __len__: StorageContext.from_defaults tests the store for truthiness
+        return len(self._ids) - len(self._dead)
+
+    @property
+    def ann(self):
+        """
+        The ANN index queries use, or None. Training and compaction swap in a new object, so
+        tune it (e.g. nprobe) through this rather than through the object passed to __init__.
+        """
+        return self._ann
+
+    @property
+    def dead_ratio(self) -> float:
+        return len(self._dead) / len(self._ids) if self._ids else 0.0
+
+    def memory_usage(self) -> dict:
+        """
+        Estimated memory held by this store: heap_bytes for node payloads, lookups, unpersisted
+        rows and the ANN index; mapped_bytes for the memory-mapped matrix (resident only once
+        its pages are touched, and reclaimable by the OS under pressure).
+        """
+        heap = self._payload_bytes
+        if self._tail is not None:
+            heap += self._tail.nbytes
+        if self._ann is not None:
+            heap += self._ann.nbytes
+        mapped = self._matrix.nbytes if self._matrix is not None else 0
+        return {"heap_bytes": heap, "mapped_bytes": mapped}
+
+    def _track_node(self, node: BaseNode, row: int):
+        self._id_rows[node.node_id] = row
+        self._payload_bytes += (
+            len(node.get_content()) + sum(len(str(value)) for value in node.metadata.values()) + _NODE_OVERHEAD_BYTES
+        )
+        if node.ref_doc_id is not None:
+            self._ref_rows.setdefault(node.ref_doc_id, []).append(row)
+        for key, rows_by_value in self._key_rows.items():
+            value = node.metadata.get(key)
+            if isinstance(value, list):
+                for item in value:
+                    rows_by_value.setdefault(item, []).append(row)
+            elif value is not None:
+                rows_by_value.setdefault(value, []).append(row)
+        for key in RANGE_KEYS:
+            value = node.metadata.get(key)
+            if isinstance(value, str):
+                with self._range_lock:
+                    self._range_pending[key].append((value, row))
+
+    def _reset_range_rows(self):
+        with self._range_lock:
+            self._range_rows = {key: ([], []) for key in RANGE_KEYS}
+            self._range_pending = {key: [] for key in RANGE_KEYS}
+
+    def _sorted_range_rows(self, key: str):
+        """
+        (values, rows) of every row with a string `key`, sorted by value. Rows added since the
+        last call are merged in here (rows mostly arrive in upload order, so the sort is cheap).
+        """
+        with self._range_lock:
+            pending = self._range_pending[key]
+            if pending:
+                values, rows = self._range_rows[key]
+                merged = sorted(list(zip(values, rows)) + pending)
+                self._range_rows[key] = ([value for value, _ in merged], [row for _, row in merged])
+                self._range_pending[key] = []
+            return self._range_rows[key]
+
+    def _range_filter_rows(self, item) -> set:
+        values, rows = self._sorted_range_rows(item.key)
+        if item.operator in (FilterOperator.GT, FilterOperator.GTE):
+            side = bisect.bisect_right if item.operator == FilterOperator.GT else bisect.bisect_left
+            return set(rows[side(values, item.value):])
+        side = bisect.bisect_left if item.operator == FilterOperator.LT else bisect.bisect_right
+        return set(rows[:side(values, item.value)])
+
+    def lookup(self, key: str, value) -> List[int]:
+        """
+        Returns the live rows whose metadata `key` equals `value` (key must be in LOOKUP_KEYS).
+        """
+        rows = self._key_rows[key].get(value, [])
+        if not rows or not len(self._dead):
+            return list(rows)
+        return [row for row in rows if not np.isin(row, self._dead)]
+
+    def lookup_nodes(self, key: str, value) -> List[BaseNode]:
+        """
+        The live nodes whose metadata `key` equals (or, for list values, contains) `value`.
+        """
+        with self._view_lock:
+            nodes = self._nodes
+        return [nodes[row] for row in self.lookup(key, value) if row < len(nodes)]
+
+    def _filter_rows(self, nodes, dead, filters) -> np.ndarray:
+        # EQ/IN conditions on LOOKUP_KEYS and range conditions on RANGE_KEYS (ANDed) narrow the
+        # candidates through the row lookups; every candidate is then checked against the full filters.
+        # Only filters with neither (e.g. NE/NIN alone, or OR) scan every row.
+        rows = None
+        if filters.condition != FilterCondition.OR:
+            for item in filters.filters:
+                key = getattr(item, "key", None)
+                if key in self._key_rows and item.operator in (FilterOperator.EQ, FilterOperator.IN):
+                    values = item.value if item.operator == FilterOperator.IN else [item.value]
+                    found = set()
+                    for value in values:
+                        found.update(self._key_rows[key].get(value, []))
+                elif key in self._range_rows and isinstance(item.value, str) and item.operator in (
+                    FilterOperator.GT, FilterOperator.GTE, FilterOperator.LT, FilterOperator.LTE
+                ):
+                    found = self._range_filter_rows(item)
+                else:
+                    continue
+                rows = found if rows is None else rows & found
+        candidates = range(len(nodes)) if rows is None else sorted(rows)
+        selected = np.fromiter(
+            (row for row in candidates if row < len(nodes) and metadata_matches(nodes[row].metadata, filters)),
+            dtype=np.int64,
+        )
+        if len(dead) and len(selected):
+            selected = selected[~np.isin(selected, dead)]
+        return selected
+
+    def filter_node_ids(self, filters) -> List[str]:
+        """
+        Ids of the live nodes whose metadata satisfies `filters` (llama_index MetadataFilters).
+        """
+        with self._view_lock:
+            nodes, dead = self._nodes, self._dead
+        return [nodes[row].node_id for row in self._filter_rows(nodes, dead, filters)]
+
+    def get_embedding(self, row: int) -> List[float]:
+        with self._view_lock:
+            matrix, tail = self._matrix, self._tail
+        matrix_rows = 0 if matrix is None else len(matrix)
+        vector = matrix[row] if row < matrix_rows else tail[row - matrix_rows]
+        return vector.tolist()
+
+    # --- Writes ----------------------------------------------------------
+
+    def add(self, nodes: Sequence[BaseNode], **kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+        embeddings = _normalize(np.asarray([node.get_embedding() for node in nodes], dtype=np.float32))
+        with self._lock:
+            if self.dim is not None and embeddings.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {embeddings.shape[1]} does not match index dimension {self.dim}")
+            # Nodes first, then rows: readers only see rows whose node already exists
+            for node in nodes:
+                stored = node.model_copy()
+                stored.embedding = None
+                self._track_node(stored, len(self._nodes))
+                self._nodes.append(stored)
+                self._ids.append(node.node_id)
+                self._pending.append(stored)
+            with self._view_lock:
+                self._tail = embeddings if self._tail is None else np.vstack([self._tail, embeddings])
+            if self._ann is not None:
+                self._ann.add(embeddings)
+        return [node.node_id for node in nodes]
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        """
+        Tombstones every chunk of the document. Space is reclaimed by compact().
+        """
+        with self._lock:
+            rows = self._ref_rows.pop(ref_doc_id, None)
+            if not rows:
+                return
+            # Flush pending rows first so the journal stays row-aligned
+            self.persist()
+            self._segments.append([{"delete": ref_doc_id}])
+            with self._view_lock:
+                self._dead = np.union1d(self._dead, np.asarray(rows, dtype=np.int64))
+
+    def persist(self, persist_path: Optional[str] = None, fs: Any = None) -> None:
+        """
+        Appends rows added since the last persist. `persist_path` is accepted for
+        compatibility with StorageContext.persist; files always live in persist_dir.
+        """
+        with self._lock:
+            if not self._pending:
+                return
+            manifest = self._segments.manifest
+            generation = manifest.get("generation", 1)
+            vectors_file = manifest.get("vectors_file", f"vectors-{generation:06d}.f32")
+            ids_file = manifest.get("ids_file", f"vectors-{generation:06d}.ids")
+            rows = manifest.get("rows", 0)
+            ids_bytes = manifest.get("ids_bytes", 0)
+            dim = self._tail.shape[1]
+
+            os.makedirs(self.persist_dir, exist_ok=True)
+            # Drop anything past the committed size (left over from an interrupted append)
+            with open(self._path(vectors_file), "ab") as f:
+                f.truncate(rows * dim * 4)
+                f.write(self._tail.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            ids_blob = "".join(f"{node.node_id}\n" for node in self._pending).encode("utf-8")
+            with open(self._path(ids_file), "ab") as f:
+                f.truncate(ids_bytes)
+                f.write(ids_blob)
+                f.flush()
+                os.fsync(f.fileno())
+
+            matrix = np.memmap(self._path(vectors_file), dtype=np.float32, mode="r", shape=(len(self._ids), dim))
+            ann_meta = self._persist_ann(manifest, matrix)
+
+            # Committing the segment + manifest makes the new rows visible
+            self._segments.append(
+                [{"node": doc_to_json(node)} for node in self._pending],
+                rows=rows + len(self._pending),
+                dim=dim,
+                ids_bytes=ids_bytes + len(ids_blob),
+                vectors_file=vectors_file,
+                ids_file=ids_file,
+                generation=generation,
+                **ann_meta,
+            )
+            self._pending = []
+            with self._view_lock:
+                self._matrix = matrix
+                self._tail = None
+
+            if "ivf_generation" in ann_meta and manifest.get("ivf_centroids"):
+                # Retrained: the previous generation's files are no longer referenced
+                for name in (manifest["ivf_centroids"], manifest["ivf_assign"]):
+                    try:
+                        os.remove(self._path(name))
+                    except OSError:
+                        pass
+
+            if self._segments.segment_count >= self.compact_segments:
+                self.compact()
+
+    def _persist_ann(self, manifest: dict, matrix) -> dict:
+        """
+        Trains the ANN index once the corpus is large enough, otherwise appends the
+        bucket assignments of the new rows. Returns the manifest fields to commit.
+        """
+        if self._ann is None:
+            return {}
+        if self._ann.needs_training(len(matrix)):
+            print(f"Training ANN index on {len(matrix)} vectors...")
+            # Train a copy so in-flight queries keep using a consistent index
+            ann = copy.copy(self._ann)
+            ann.train(matrix)
+            ann_generation = manifest.get("ivf_generation", 0) + 1
+            meta = dict(ann.save(self.persist_dir, ann_generation), ivf_generation=ann_generation)
+            with self._view_lock:
+                self._ann = ann
+            return meta
+        if self._ann.trained and manifest.get("ivf_assign"):
+            return self._ann.append(self.persist_dir, manifest)
+        return {}
+
+    def compact(self):
+        """
+        Merges the node journal into a single segment. If documents were deleted, the
+        vector matrix, id sidecar and ANN assignments are rewritten without the dead rows.
+        """
+        with self._lock:
+            self.persist()
+            if not len(self._dead):
+                print(f"Compacting {self._segments.segment_count} index segments...")
+                self._segments.compact([{"node": doc_to_json(node)} for node in self._nodes])
+                return
+
+            print(f"Compacting index: dropping {len(self._dead)} deleted chunks...")
+            manifest = self._segments.manifest
+            live = np.setdiff1d(np.arange(len(self._ids)), self._dead)
+            nodes = [self._nodes[row] for row in live]
+            generation = manifest.get("generation", 1) + 1
+            vectors_file = f"vectors-{generation:06d}.f32"
+            ids_file = f"vectors-{generation:06d}.ids"
+
+            # New generation files are invisible until the manifest points at them
+            with open(self._path(vectors_file), "wb") as f:
+                for start in range(0, len(live), 65536):
+                    f.write(np.ascontiguousarray(self._matrix[live[start:start + 65536]]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            ids_blob = "".join(f"{node.node_id}\n" for node in nodes).encode("utf-8")
+            with open(self._path(ids_file), "wb") as f:
+                f.write(ids_blob)
+                f.flush()
+                os.fsync(f.fileno())
+
+            ann, ann_meta = self._ann, {}
+            if ann is not None and ann.trained:
+                ann = copy.copy(ann)
+                ann.assign = ann.assign[live]
+                ann._lists = None
+                ann_generation = manifest.get("ivf_generation", 0) + 1
+                ann_meta = dict(ann.save(self.persist_dir, ann_generation), ivf_generation=ann_generation)
+
+            self._segments.compact(
+                [{"node": doc_to_json(node)} for node in nodes],
+                rows=len(nodes),
+                ids_bytes=len(ids_blob),
+                vectors_file=vectors_file,
+                ids_file=ids_file,
+                generation=generation,
+                **ann_meta,
+            )
+
+            matrix = None
+            if nodes:
+                matrix = np.memmap(self._path(vectors_file), dtype=np.float32, mode="r", shape=(len(nodes), self.dim))
+            with self._view_lock:
+                self._matrix = matrix
+                self._nodes = nodes
+                self._ids = [node.node_id for node in nodes]
+                self._dead = np.empty(0, dtype=np.int64)
+                self._ann = ann
+            self._ref_rows = {}
+            self._key_rows = {key: {} for key in LOOKUP_KEYS}
+            self._reset_range_rows()
+            self._id_rows = {}
+            self._payload_bytes = 0
+            for row, node in enumerate(nodes):
+                self._track_node(node, row)
+
+            # Old generation files are no longer referenced by the manifest
+            stale = [manifest.get("vectors_file"), manifest.get("ids_file")]
+            if ann_meta:
+                stale += [manifest.get("ivf_centroids"), manifest.get("ivf_assign")]
+            for name in stale:
+                if name:
+                    try:
+                        os.remove(self._path(name))
+                    except OSError:
+                        pass
+
+    # --- Reads -----------------------------------------------------------
+
+    def get_nodes(self, node_ids: Optional[List[str]] = None, filters: Any = None) -> List[BaseNode]:
+        nodes, dead = self._nodes, set(self._dead.tolist())
+        wanted = None if node_ids is None else set(node_ids)
+        return [
+            node for row, node in enumerate(nodes)
+            if row not in dead and (wanted is None or node.node_id in wanted)
+        ]
+
+    def get_nodes_by_id(self, node_ids: List[str]) -> List[BaseNode]:
+        """
+        Live nodes for the given ids, looked up in O(1) each (unknown or deleted ids are skipped).
+        """
+        with self._view_lock:
+            nodes, dead = self._nodes, self._dead
+        found = []
+        for node_id in node_ids:
+            row = self._id_rows.get(node_id)
+            # The id check guards against the brief window in which compact() renumbers rows
+            if row is not None and row < len(nodes) and nodes[row].node_id == node_id:
+                if not (len(dead) and np.isin(row, dead)):
+                    found.append(nodes[row])
+        return found
+
+    def _score(self, matrix, tail, q, rows=None):
+        """
+        Scores either every row (rows=None) or only the given candidate rows.
+        Returns (row_ids, scores); row_ids is None when every row was scored.
+        """
+        matrix_rows = 0 if matrix is None else len(matrix)
+        if rows is None:
+            parts = []
+            if matrix is not None:
+                parts.append(matrix @ q)
+            if tail is not None:
+                parts.append(tail @ q)
+            return None, (parts[0] if len(parts) == 1 else np.concatenate(parts))
+
+        total = matrix_rows + (0 if tail is None else len(tail))
+        rows = np.sort(rows[rows < total])
+        in_matrix = rows[rows < matrix_rows]
+        in_tail = rows[rows >= matrix_rows] - matrix_rows
+        parts = [np.empty(0, dtype=np.float32)]
+        if len(in_matrix):
+            parts.append(matrix[in_matrix] @ q)
+        if len(in_tail):
+            parts.append(tail[in_tail] @ q)
+        return rows, np.concatenate(parts)
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        # Snapshot references so a concurrent add/persist/compact cannot change rows mid-search
+        with self._view_lock:
+            matrix, tail, nodes, dead, ann = self._matrix, self._tail, self._nodes, self._dead, self._ann
+        if query.query_embedding is None or (matrix is None and tail is None):
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+
+        q = _normalize(np.asarray(query.query_embedding, dtype=np.float32))
+        if query.filters is not None:
+            # Scoped query: only the matching rows are scored (exactly), so cost follows the scope's size
+            candidates = self._filter_rows(nodes, dead, query.filters)
+            if not len(candidates):
+                return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+        else:
+            candidates = ann.candidates(q) if ann is not None else None
+        row_ids, scores = self._score(matrix, tail, q, candidates)
+
+        # Tombstoned rows stay in the matrix until compaction; never return them
+        if len(dead):
+            if row_ids is None:
+                scores[dead[dead < len(scores)]] = -np.inf
+            else:
+                scores[np.isin(row_ids, dead)] = -np.inf
+
+        # VectorStoreIndex passes its (empty, since we store text) nodes_dict as node_ids
+        if query.node_ids:
+            wanted = set(query.node_ids)
+            rows = range(len(scores)) if row_ids is None else row_ids
+            mask = np.fromiter((nodes[row].node_id in wanted for row in rows), dtype=bool, count=len(scores))
+            scores = np.where(mask, scores, -np.inf)
+
+        k = min(query.similarity_top_k, len(scores))
+        if k <= 0:
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        top = [int(i) for i in top if np.isfinite(scores[i])]
+        similarities = [float(scores[i]) for i in top]
+        if row_ids is not None:
+            top = [int(row_ids[i]) for i in top]
+
+        return VectorStoreQueryResult(
+            nodes=[nodes[row] for row in top],
+            similarities=similarities,
+            ids=[nodes[row].node_id for row in top],
+        )
@@ -0,0 +1,180 @@
+"""
+Chunking benchmark: fixed-size SentenceSplitter windows (512 tokens, 150 overlap) vs the
+structure-aware legal chunker (app/legal_chunker.py), on the files in a directory (default ../data).
+
+Text is extracted the way ingestion does it, without new OCR calls (cached OCR is used).
+For each chunker it reports:
+- chunks and mean tokens per chunk
+- embedded tokens (what the embedding API is billed for, metadata included) and their ratio
+  to the source text's tokens (the overlap duplication)
+- intact sentences: share of sample sentences that sit whole inside one chunk
+- intact clauses: share of structural units (sections, sub-sections, clauses that fit in a chunk)
+  that sit whole inside one chunk, i.e. were not split mid-clause
+- hit@k / MRR: a query made of words from a sample sentence must retrieve a chunk that
+  contains that sentence, by vector search (local trigram hashing embedding by default,
+  --embed gemini for the real model) and by BM25
+
+Usage: python bench_chunking.py [--dir ../data] [--queries 200] [--k 3] [--embed hashing|gemini]
+"""
+import argparse
+import asyncio
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+
+from llama_index.core import Settings
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import MetadataMode
+from llama_index.core.utils import get_tokenizer
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from app.bm25 import BM25Index
+from app.hashing import file_sha256, normalize_text
+from app.ingestion import build_nodes, documents_text_hash, init_settings, iter_documents
+from app.legal_chunker import LegalStructureSplitter, structural_units
+from app.vector_store import NumpyVectorStore
+from bench_hybrid import HashingEmbedding
+
+CHUNKERS = {
+    "sentence": lambda: SentenceSplitter(chunk_size=512, chunk_overlap=150),
+    "legal": lambda: LegalStructureSplitter(chunk_size=512),
+}
+
+
+async def _collect(path: str):
+    return [document async for document in iter_documents(path, file_sha256(path), ocr=False)]
+
+
+def load_corpus(data_dir: str):
+    files = []
+    for name in sorted(os.listdir(data_dir)):
+        path = os.path.join(data_dir, name)
+        if not os.path.isfile(path):
+            continue
+        documents = asyncio.run(_collect(path))
+        if not any(document.text.strip() for document in documents):
+            print(f"Skipping {name}: no text without OCR.")
+            continue
+        files.append((name, path, documents))
+    return files
+
+
+def sample_sentences(files, count: int, rng: random.Random):
+    sentences = []
+    for _, _, documents in files:
+        for document in documents:
+            # Sentence ends, and the starts of numbered rows and clause markers ("2004.(2)Any", "\n14. Lease")
+            for sentence in re.split(r"(?<=[.;:])(?:\s+|(?=\())|\n(?=[ \t]*(?:\d+\.|[ivx]+\)))", document.text):
+                if len(sentence.split()) >= 12:
+                    sentences.append(" ".join(sentence.split()))
+    return rng.sample(sentences, min(count, len(sentences)))
+
+
+def chunk(files, make_parser):
+    nodes = []
+    for number, (name, path, documents) in enumerate(files):
+        documents = [document.model_copy(deep=True) for document in documents]
+        nodes += build_nodes(
+            documents, file_sha256(path), documents_text_hash(documents),
+            document_id=number, file_name=name, node_parser=make_parser(),
+        )
+    return nodes
+
+
+def clause_units(files):
+    tokenizer = get_tokenizer()
+    units = []
+    for _, _, documents in files:
+        for document in documents:
+            units += [
+                normalize_text(unit) for unit in structural_units(document.text) if len(tokenizer(unit)) <= 400
+            ]
+    return units
+
+
+def evaluate(nodes, sentences, clauses, embed_model, k: int):
+    tokenizer = get_tokenizer()
+    texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+    normalized = [normalize_text(node.text) for node in nodes]
+    targets = [normalize_text(sentence) for sentence in sentences]
+    holders = [{node.node_id for node, text in zip(nodes, normalized) if target in text} for target in targets]
+    whole_clauses = sum(1 for clause in clauses if any(clause in text for text in normalized))
+
+    root = tempfile.mkdtemp()
+    try:
+        start = time.perf_counter()
+        for node, embedding in zip(nodes, embed_model.get_text_embedding_batch(texts)):
+            node.embedding = embedding
+        embed_seconds = time.perf_counter() - start
+        vector_store = NumpyVectorStore(root)
+        vector_store.add(nodes)
+        bm25 = BM25Index(os.path.join(root, "bm25"))
+        bm25.add((node.node_id, node.ref_doc_id, node.text) for node in nodes)
+
+        scores = {"vector": [0, 0.0], "bm25": [0, 0.0]}
+        for sentence, wanted in zip(sentences, holders):
+            if not wanted:
+                continue
+            query = " ".join(sentence.split()[2:12])
+            result = vector_store.query(
+                VectorStoreQuery(query_embedding=embed_model.get_query_embedding(query), similarity_top_k=k)
+            )
+            rankings = {"vector": result.ids, "bm25": [node_id for node_id, _ in bm25.search(query, top_k=k)]}
+            for name, ids in rankings.items():
+                rank = next((i for i, node_id in enumerate(ids) if node_id in wanted), None)
+                if rank is not None:
+                    scores[name][0] += 1
+                    scores[name][1] += 1 / (rank + 1)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    queries = len(sentences)
+    return {
+        "chunks": len(nodes),
+        "mean_tokens": sum(len(tokenizer(node.text)) for node in nodes) / max(1, len(nodes)),
+        "embedded_tokens": sum(len(tokenizer(text)) for text in texts),
+        "embed_seconds": embed_seconds,
+        "intact": sum(1 for wanted in holders if wanted) / max(1, queries),
+        "intact_clauses": whole_clauses / max(1, len(clauses)),
+        **{f"{name}_hit": hits / max(1, queries) for name, (hits, _) in scores.items()},
+        **{f"{name}_mrr": mrr / max(1, queries) for name, (_, mrr) in scores.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data"))
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--embed", choices=("hashing", "gemini"), default="hashing")
+    args = parser.parse_args()
+
+    if args.embed == "gemini":
+        init_settings()
+        embed_model = Settings.embed_model
+    else:
+        embed_model = HashingEmbedding(embed_batch_size=512)
+
+    files = load_corpus(args.dir)
+    tokenizer = get_tokenizer()
+    source_tokens = sum(len(tokenizer(document.text)) for _, _, documents in files for document in documents)
+    sentences = sample_sentences(files, args.queries, random.Random(7))
+    clauses = clause_units(files)
+    print(f"{len(files)} files, {source_tokens} source tokens, {len(sentences)} sample sentences, {len(clauses)} clauses\n")
+
+    k = args.k
+    print(f"{'chunker':<10}{'chunks':>8}{'tok/chunk':>11}{'embedded':>10}{'x source':>10}{'embed s':>9}"
+          f"{'sentences':>10}{'clauses':>9}{'vec hit@' + str(k):>11}{'vec mrr':>9}{'bm25 hit@' + str(k):>12}{'bm25 mrr':>10}")
+    for name, make_parser in CHUNKERS.items():
+        stats = evaluate(chunk(files, make_parser), sentences, clauses, embed_model, k)
+        print(f"{name:<10}{stats['chunks']:>8}{stats['mean_tokens']:>11.0f}{stats['embedded_tokens']:>10}"
+              f"{stats['embedded_tokens'] / max(1, source_tokens):>10.2f}{stats['embed_seconds']:>9.2f}"
+              f"{stats['intact']:>10.3f}{stats['intact_clauses']:>9.3f}{stats['vector_hit']:>11.3f}{stats['vector_mrr']:>9.3f}"
+              f"{stats['bm25_hit']:>12.3f}{stats['bm25_mrr']:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,25 @@
 import os
-from llama_index.core import StorageContext, load_index_from_storage
-from llama_index.embeddings.gemini import GeminiEmbedding
-from llama_index.core import Settings
-from dotenv import load_dotenv
-
-load_dotenv()
-
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-CHROMA_PATH = "../chroma_db"
+from app.config import GOOGLE_API_KEY, CHROMA_PATH
+from app.ingestion import get_index
 
 def inspect():
     if not GOOGLE_API_KEY:
         print("GOOGLE_API_KEY not found")
         return
 
-    Settings.embed_model = GeminiEmbedding(api_key=GOOGLE_API_KEY, model="models/text-embedding-004")
-    
     if not os.path.exists(CHROMA_PATH):
         print(f"Path {CHROMA_PATH} does not exist")
         return
 
-    storage_context = StorageContext.from_defaults(persist_dir=CHROMA_PATH)
-    index = load_index_from_storage(storage_context)
-    
-    docstore = index.storage_context.docstore
-    docs = list(docstore.docs.values())
-    
-    print(f"Total nodes in docstore: {len(docs)}")
+    index = get_index()
+    if index is None:
+        print("No index found. Upload or ingest a file first.")
+        return
+
+    # Nodes live in the vector store (the docstore is not persisted)
+    docs = index.vector_store.get_nodes()
+
+    print(f"Total nodes in vector store: {len(docs)}")
     
     # Try to find specific file nodes
     target_file = "1416(P1)2014_17.9.2014.pdf"
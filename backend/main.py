@@ -1,19 +1,24 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, status, BackgroundTasks
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, Request, HTTPException, Depends, status, BackgroundTasks
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordRequestForm
-import shutil
 import os
+import json
 import pyotp
 import qrcode
 import io
 import base64
 from sqlalchemy.orm import Session
-from app.config import DATA_DIR
-from app.ingestion import ingest_file, get_query_engine
-from app.database import init_db, get_db, User, Feedback
+from app.config import DATA_DIR, MAX_UPLOAD_BYTES
+from app.ingestion import run_query, run_search, stream_query, iter_answer_tokens, warm_up_index, get_metrics, delete_document_vectors, compact_index
+from app.ingestion import shard_key_for, list_shards, readable_shards
+from app.database import init_db, get_db, User, Feedback, IngestionJob
+from app.jobs import enqueue_ingestion, reassign_duplicates, start_ingestion_workers
 from app.auth import get_current_active_user, verify_password, get_password_hash, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
 from app.utils import validate_password, send_email
+from app.uploads import receive_upload, UploadError
+from app.concurrency import run_blocking
+from app.filters import build_filters
 from pydantic import BaseModel
 from datetime import timedelta, datetime
 from typing import Optional, List
@@ -43,8 +48,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class QueryFilters(BaseModel):
+    document_ids: Optional[List[int]] = None
+    user_ids: Optional[List[int]] = None  # uploaders
+    languages: Optional[List[str]] = None  # e.g. "en", "hi", "ta" (see app/language.py)
+    uploaded_after: Optional[str] = None  # ISO date/datetime, inclusive
+    uploaded_before: Optional[str] = None  # ISO date/datetime, exclusive
+
 class QueryRequest(BaseModel):
     query: str
+    filters: Optional[QueryFilters] = None
+
+class SearchRequest(BaseModel):
+    query: str
+    top_k: int = 10
+    filters: Optional[QueryFilters] = None
 
 class UserCreate(BaseModel):
     email: str
@@ -62,6 +80,21 @@ class MFAVerify(BaseModel):
 class EmailVerify(BaseModel):
     token: str
 
+@app.on_event("startup")
+def load_resident_index():
+    # Warm up the shared index/query engine once instead of on every /query
+    try:
+        if warm_up_index():
+            print("Resident index loaded.")
+        else:
+            print("No index found yet. It will be created on first upload.")
+    except Exception as e:
+        print(f"Warning: Failed to warm up index: {e}")
+
+@app.on_event("startup")
+async def start_ingestion_queue():
+    start_ingestion_workers()
+
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
@@ -371,8 +404,43 @@ def delete_account(delete_data: DeleteAccount, current_user: User = Depends(get_
     db.commit()
     return {"message": "Account deleted successfully"}
 
+def _register_upload(upload, user_id: int):
+    """
+    Records a received upload. Returns (existing Document, None, None) when the same bytes were
+    already uploaded, else (None, new document id, stored file path).
+    """
+    # Save to Document table first so every chunk can carry the document id
+    from app.database import Document, SessionLocal
+    db = SessionLocal()
+    try:
+        # Deduplicate: the same bytes were already uploaded (possibly under another name).
+        # With a sharded index, tenants only see their own uploads, so only those are matched.
+        duplicates = db.query(Document).filter(Document.content_hash == upload.sha256)
+        if shard_key_for(user_id) is not None:
+            duplicates = duplicates.filter(Document.user_id == user_id)
+        existing = duplicates.first()
+        if existing:
+            upload.discard()
+            db.expunge(existing)
+            return existing, None, None
+
+        # Stored under its content hash, so same-named uploads never overwrite each other
+        file_path = upload.commit(DATA_DIR)
+        new_doc = Document(
+            filename=upload.filename,
+            upload_date=datetime.utcnow().isoformat(),
+            user_id=user_id,
+            content_hash=upload.sha256,
+            file_path=file_path,
+        )
+        db.add(new_doc)
+        db.commit()
+        return None, new_doc.id, file_path
+    finally:
+        db.close()
+
 @app.post("/upload")
-async def upload_file(file: UploadFile = File(...), current_user: User = Depends(get_current_active_user)):
+async def upload_file(request: Request, current_user: User = Depends(get_current_active_user)):
     # Check if user has permission to upload
     if current_user.role not in ["admin", "lawyer"]:
         raise HTTPException(
@@ -383,49 +451,59 @@ async def upload_file(file: UploadFile = File(...), current_user: User = Depends
     if not os.path.exists(DATA_DIR):
         os.makedirs(DATA_DIR)
         
-    # Validation: Check file extension
+    # Validation: extension and size are checked while the body streams in
     allowed_extensions = {".pdf", ".txt", ".docx", ".doc", ".png", ".jpg", ".jpeg"}
-    file_ext = os.path.splitext(file.filename)[1].lower()
-    
-    if file_ext not in allowed_extensions:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Invalid file type. Allowed: {', '.join(allowed_extensions)}"
-        )
-    
-    file_path = os.path.join(DATA_DIR, file.filename)
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    
     try:
-        print(f"Processing upload for: {file.filename}")
-        num_docs = await ingest_file(file_path)
-        print(f"Ingestion complete. Docs: {num_docs}")
+        upload = await receive_upload(request, DATA_DIR, MAX_UPLOAD_BYTES, allowed_extensions)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    content_hash = upload.sha256
+
+    # Database and file moves run on the blocking pool, off the event loop
+    duplicate, doc_id, file_path = await run_blocking(_register_upload, upload, current_user.id)
+    if duplicate is not None:
+        return {
+            "message": "Document already uploaded",
+            "filename": duplicate.filename,
+            "document_id": duplicate.id,
+            "duplicate": True,
+        }
+
+    # Ingestion (OCR, chunking, embedding) runs on the background worker pool
+    job_id = await run_blocking(
+        enqueue_ingestion, doc_id, current_user.id, upload.filename, file_path, file_hash=content_hash
+    )
+    print(f"Queued ingestion job {job_id} for: {upload.filename} ({upload.size / (1024 * 1024):.1f} MB)")
 
-        # Save to Document table
-        from app.database import Document
-        new_doc = Document(
-            filename=file.filename,
-            upload_date=datetime.utcnow().isoformat(),
-            user_id=current_user.id
-        )
-        # Use a new DB session for this
-        from app.database import SessionLocal
-        db = SessionLocal()
-        try:
-            db.add(new_doc)
-            db.commit()
-        finally:
-            db.close()
+    return {"message": "File uploaded, ingestion queued", "filename": upload.filename, "job_id": job_id}
 
-        return {"message": "File uploaded and ingested", "filename": file.filename, "chunks": num_docs}
-    except Exception as e:
-        print(f"Upload failed: {e}")
-        import traceback
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=str(e))
+@app.get("/jobs/{job_id}")
+def get_job_status(job_id: int, current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    job = db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+    if not job or (job.user_id != current_user.id and current_user.role != "admin"):
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return {
+        "id": job.id,
+        "filename": job.filename,
+        "document_id": job.document_id,
+        "status": job.status,
+        "stage": job.stage,
+        "attempts": job.attempts,
+        "chunks": job.chunks,
+        "error": job.error,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+    }
 
-@app.get("/documents")
+class DocumentResponse(BaseModel):
+    # Storage details (file_path, content_hash) stay internal
+    id: int
+    filename: str
+    upload_date: Optional[str] = None
+    user_id: Optional[int] = None
+
+@app.get("/documents", response_model=List[DocumentResponse])
 def get_documents(skip: int = 0, limit: int = 100, current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
     if current_user.role not in ["admin", "lawyer"]:
         raise HTTPException(status_code=403, detail="Not authorized")
@@ -443,14 +521,17 @@ def get_document_count(current_user: User = Depends(get_current_active_user), db
     return {"count": count}
 
 @app.get("/view-document/{filename}")
-async def view_document(filename: str, current_user: User = Depends(get_current_active_user)):
-    file_path = os.path.join(DATA_DIR, filename)
+def view_document(filename: str, current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    from app.database import Document
+    doc = db.query(Document).filter(Document.filename == filename, Document.file_path.isnot(None)).first()
+    # Documents uploaded before content-addressed storage live at DATA_DIR/<filename>
+    file_path = doc.file_path if doc else os.path.join(DATA_DIR, os.path.basename(filename))
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="File not found")
     return FileResponse(file_path)
 
 @app.delete("/documents/{doc_id}")
-def delete_document(doc_id: int, current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+def delete_document(doc_id: int, background_tasks: BackgroundTasks, current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
     if current_user.role not in ["admin", "lawyer"]:
         raise HTTPException(status_code=403, detail="Not authorized")
 
@@ -460,34 +541,36 @@ def delete_document(doc_id: int, current_user: User = Depends(get_current_active
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
         
-    # 1. Delete Physical File
-    file_path = os.path.join(DATA_DIR, doc.filename)
-    if os.path.exists(file_path):
+    # 1. Delete Physical File (unless another tenant's upload of the same bytes still uses it)
+    file_path = doc.file_path or os.path.join(DATA_DIR, doc.filename)
+    shared = doc.file_path and db.query(Document).filter(
+        Document.file_path == doc.file_path, Document.id != doc.id
+    ).first()
+    if not shared and os.path.exists(file_path):
         os.remove(file_path)
         
     # 2. Delete DB Record
     db.delete(doc)
     db.commit()
     
-    # 3. Handle Vector DB (Hard to delete single doc efficiently without metadata tracking on chunks)
-    # Ideally: We should re-ingest all remaining files to keep index clean.
-    # For now: We will leave vectors (they become "orphan" knowledge). 
-    # Better approach for V2: Clear index and re-ingest all files in DATA_DIR.
-    
+    # 3. Tombstone the document's chunks in the vector index (keyed by document id)
+    # Chunks ingested before document ids were tracked cannot be matched and stay in the index.
+    if delete_document_vectors(doc_id, doc.user_id):
+        background_tasks.add_task(compact_index, doc.user_id)
+    # Documents skipped as duplicates of this one were served by its chunks: one of them is re-indexed
+    job_id = reassign_duplicates(db, doc_id)
+    if job_id is not None:
+        print(f"Queued ingestion job {job_id} for a duplicate of deleted document {doc_id}")
+
     return {"message": f"Document {doc.filename} deleted"}
 
-@app.post("/query")
-async def query_index(request: QueryRequest, current_user: User = Depends(get_current_active_user)):
-    engine = get_query_engine()
-    if not engine:
-        raise HTTPException(status_code=404, detail="Index not found. Please upload a file first.")
-    
-    response = engine.query(request.query)
-    
-    # Process and de-duplicate sources
+def _format_sources(source_nodes, limit: int = 5):
+    """
+    De-duplicated, display-ready citations for the retrieved chunks, best match first.
+    """
     sources = []
     seen_sources = set()
-    for node in response.source_nodes:
+    for node in source_nodes:
         # Get filename and strip directory paths
         raw_file = node.metadata.get("file_name") or node.metadata.get("file_path", "Unknown Source")
         filename = os.path.basename(raw_file)
@@ -502,15 +585,102 @@ async def query_index(request: QueryRequest, current_user: User = Depends(get_cu
             sources.append({
                 "file": filename,
                 "page": page,
-                "text": text[:300] + "..." if len(text) > 300 else text
+                "section": node.metadata.get("section_path", ""),
+                "text": text[:300] + "..." if len(text) > 300 else text,
+                "score": node.score,
             })
             seen_sources.add(source_key)
 
+    return sources[:limit] # Limit to top 5 unique sources for readability by default
+
+def _query_filters(filters: Optional[QueryFilters]):
+    """
+    Metadata filters for a scoped query, or None to search the whole corpus.
+    """
+    if filters is None:
+        return None
+    for value in (filters.uploaded_after, filters.uploaded_before):
+        if value:
+            try:
+                datetime.fromisoformat(value)
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"Invalid date: {value}")
+    return build_filters(**filters.model_dump())
+
+def _query_shards(current_user: User, filters: Optional[QueryFilters]):
+    """
+    Index shards a query reads when the index is sharded per user (None otherwise): the user's
+    own shard plus the shared shard and the pre-sharding root index, or for admins every shard
+    (or the shards of filters.user_ids, plus shared and root).
+    """
+    shard_keys = readable_shards(current_user.id)
+    if shard_keys is None:
+        return None
+    if current_user.role == "admin":
+        if filters is not None and filters.user_ids:
+            return [shard_key_for(user_id) for user_id in filters.user_ids] + shard_keys[1:]
+        return list_shards()
+    return shard_keys
+
+@app.post("/query")
+async def query_index(request: QueryRequest, current_user: User = Depends(get_current_active_user)):
+    response = await run_query(
+        request.query, filters=_query_filters(request.filters), shard_keys=_query_shards(current_user, request.filters)
+    )
+    if response is None:
+        raise HTTPException(status_code=404, detail="Index not found. Please upload a file first.")
+
     return {
         "response": response.response,
-        "sources": sources[:5] # Limit to top 5 unique sources for readability
+        "sources": _format_sources(response.source_nodes)
     }
 
+@app.post("/search")
+async def search_index(request: SearchRequest, current_user: User = Depends(get_current_active_user)):
+    """
+    Retrieval-only lookup: ranked, de-duplicated sources without generating an answer.
+    """
+    top_k = max(1, min(request.top_k, 50))
+    nodes = await run_search(
+        request.query, top_k=top_k, filters=_query_filters(request.filters),
+        shard_keys=_query_shards(current_user, request.filters),
+    )
+    if nodes is None:
+        raise HTTPException(status_code=404, detail="Index not found. Please upload a file first.")
+    return {"sources": _format_sources(nodes, limit=top_k)}
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/query/stream")
+async def query_index_stream(request: QueryRequest, current_user: User = Depends(get_current_active_user)):
+    """
+    Server-Sent Events: one "sources" event as soon as retrieval is done, then "token" events
+    as the answer is generated, then "done" (or "error").
+    """
+    response = await stream_query(
+        request.query, filters=_query_filters(request.filters), shard_keys=_query_shards(current_user, request.filters)
+    )
+    if response is None:
+        raise HTTPException(status_code=404, detail="Index not found. Please upload a file first.")
+
+    async def events():
+        yield _sse("sources", {"sources": _format_sources(response.source_nodes)})
+        try:
+            async for token in iter_answer_tokens(response):
+                yield _sse("token", {"text": token})
+        except Exception as e:
+            print(f"Streaming answer failed: {e}")
+            yield _sse("error", {"detail": "Failed to generate the answer"})
+            return
+        yield _sse("done", {})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 class FeedbackCreate(BaseModel):
     query: str
     response: str
@@ -542,6 +712,12 @@ async def submit_feedback(
     
     return {"message": "Feedback submitted successfully"}
 
+@app.get("/admin/metrics")
+def get_admin_metrics(current_user: User = Depends(get_current_active_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return get_metrics()
+
 @app.get("/admin/feedback/summary")
 async def get_feedback_summary(current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
     if current_user.role not in ["admin", "lawyer"]:
@@ -0,0 +1,132 @@
+"""
+Inspect and switch index versions (blue/green rebuilds, see app/index_versions.py).
+
+Usage:
+  python manage_index.py list
+  python manage_index.py activate VERSION
+  python manage_index.py rollback
+  python manage_index.py remove VERSION
+  python manage_index.py prune [--keep N]
+  python manage_index.py resume-ingestion
+
+Running API processes follow the CURRENT pointer and switch on their next query.
+Before activate and rollback switch, ingestion is paused and the target version is caught up
+with the documents uploaded or deleted since it was built (see reingest.catch_up_version).
+"""
+import argparse
+import os
+
+from app.config import CHROMA_PATH
+from app.index_versions import IndexVersions
+from reingest import CHECKPOINT_NAME, DRAIN_TIMEOUT, _drain_ingestion, _stored_rows, catch_up_version
+
+
+def _size_mb(path: str, skip_versions: bool = False) -> float:
+    total = 0
+    for root, dirs, filenames in os.walk(path):
+        if skip_versions:
+            # The legacy index lives in the root, next to the versions/ directory
+            dirs[:] = [d for d in dirs if not (root == path and d == "versions")]
+        total += sum(os.path.getsize(os.path.join(root, filename)) for filename in filenames)
+    return total / (1024 * 1024)
+
+
+def _switch(versions, version: str, args) -> bool:
+    """
+    Catches version up with ingestion paused, then makes it live. False (nothing switched) if
+    uploads could not be drained or indexed.
+    """
+    if os.path.exists(os.path.join(versions.path(version), CHECKPOINT_NAME)):
+        print(f"Index version {version} is an unfinished rebuild; finish it with `python reingest.py`.")
+        return False
+    versions.pause_ingestion()
+    try:
+        if not _drain_ingestion(args.drain_timeout):
+            print(f"Ingestion jobs still running after {args.drain_timeout:.0f}s; nothing was switched.")
+            return False
+        failed = catch_up_version(version, args.workers)
+        if failed and not args.force:
+            print(f"{len(failed)} uploaded file(s) could not be indexed into {version}; nothing was switched "
+                  "(use --force to switch anyway):")
+            for file_path in sorted(failed):
+                print(f"  {file_path}")
+            return False
+        versions.activate(version)
+        return True
+    finally:
+        versions.resume_ingestion()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and switch index versions.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="Stored versions with chunk counts and sizes")
+    activate_parser = commands.add_parser("activate", help="Make a version live")
+    activate_parser.add_argument("version")
+    rollback_parser = commands.add_parser("rollback", help="Re-activate the previous version")
+    for switch_parser in (activate_parser, rollback_parser):
+        switch_parser.add_argument("--workers", type=int, default=os.cpu_count() or 4,
+                                   help="Extraction processes for the catch-up")
+        switch_parser.add_argument("--drain-timeout", type=float, default=DRAIN_TIMEOUT,
+                                   help="Seconds to wait for running ingestion jobs")
+        switch_parser.add_argument("--force", action="store_true", help="Switch even if some uploads failed to index")
+    remove_parser = commands.add_parser("remove", help="Delete a version that is not live")
+    remove_parser.add_argument("version")
+    prune_parser = commands.add_parser("prune", help="Delete old finished versions")
+    prune_parser.add_argument("--keep", type=int, default=2, help="Newest finished versions to keep")
+    commands.add_parser("resume-ingestion", help="Clear the ingestion pause left by a killed rebuild")
+    args = parser.parse_args()
+
+    versions = IndexVersions(CHROMA_PATH)
+    current, previous = versions.current_version(), versions.previous_version()
+
+    if args.command == "list":
+        print(f"Index root: {CHROMA_PATH}")
+        for version in versions.versions():
+            path = versions.path(version)
+            rows = _stored_rows(path)
+            marks = []
+            if version == current:
+                marks.append("live")
+            if version == previous:
+                marks.append("rollback target")
+            if os.path.exists(os.path.join(path, CHECKPOINT_NAME)):
+                marks.append("rebuild in progress")
+            suffix = f"  [{', '.join(marks)}]" if marks else ""
+            print(f"{version:<28}{rows:>10} chunks{_size_mb(path, skip_versions=version == 'legacy'):>10.1f} MB{suffix}")
+        if versions.ingestion_paused():
+            print("Ingestion is paused by a rebuild; if none is running, clear it with `resume-ingestion`.")
+
+    elif args.command == "activate":
+        if not versions.exists(args.version):
+            raise SystemExit(f"Index version {args.version} does not exist")
+        if args.version != current and _switch(versions, args.version, args):
+            print(f"Activated {args.version} (previous: {current}).")
+
+    elif args.command == "rollback":
+        if previous is None or not versions.exists(previous):
+            raise SystemExit("No previous index version to roll back to")
+        if _switch(versions, previous, args):
+            print(f"Rolled back to {previous} (previous: {current}).")
+
+    elif args.command == "remove":
+        versions.remove(args.version)
+        print(f"Removed {args.version}.")
+
+    elif args.command == "prune":
+        finished = [
+            version for version in versions.versions()
+            if version not in (current, previous, "legacy")
+            and not os.path.exists(os.path.join(versions.path(version), CHECKPOINT_NAME))
+        ]
+        for version in finished[:max(0, len(finished) - args.keep)]:
+            versions.remove(version)
+            print(f"Removed {version}.")
+
+    elif args.command == "resume-ingestion":
+        versions.resume_ingestion()
+        print("Ingestion workers resume on their next poll.")
+
+
+if __name__ == "__main__":
+    main()
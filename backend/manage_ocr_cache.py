@@ -0,0 +1,73 @@
+"""
+Inspect and evict the on-disk OCR cache (OCR_CACHE_DIR).
+
+Usage:
+  python manage_ocr_cache.py stats
+  python manage_ocr_cache.py list [--file-hash HASH]
+  python manage_ocr_cache.py evict [--file-hash HASH] [--older-than-days N] [--stale-prompt] [--all]
+"""
+import argparse
+import time
+from collections import Counter
+
+from app.config import OCR_CACHE_DIR
+from app.ocr_cache import OCRCache
+
+
+def _prompt_version():
+    # Imported lazily: app.ingestion pulls in the Gemini SDK
+    from app.ingestion import OCR_PROMPT_VERSION
+    return OCR_PROMPT_VERSION
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and evict the OCR cache.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("stats", help="Entry count, size and prompt versions")
+    list_parser = commands.add_parser("list", help="One line per cached page")
+    list_parser.add_argument("--file-hash")
+    evict_parser = commands.add_parser("evict", help="Remove cached pages")
+    evict_parser.add_argument("--file-hash", help="Only pages of the file with this sha256")
+    evict_parser.add_argument("--older-than-days", type=float)
+    evict_parser.add_argument("--stale-prompt", action="store_true", help="Pages OCR'd with an older prompt version")
+    evict_parser.add_argument("--all", action="store_true", help="Everything")
+    args = parser.parse_args()
+
+    cache = OCRCache(OCR_CACHE_DIR)
+
+    if args.command == "stats":
+        stats = cache.stats()
+        print(f"Cache directory: {OCR_CACHE_DIR}")
+        print(f"Entries: {stats['entries']} pages from {stats['files']} files, {stats['bytes'] / 1e6:.1f} MB")
+        versions = Counter(entry.get("prompt_version") for _, entry in cache.entries())
+        for version, count in versions.most_common():
+            print(f"  prompt {version}: {count} pages")
+
+    elif args.command == "list":
+        for _, entry in cache.entries():
+            if args.file_hash and entry.get("file_hash") != args.file_hash:
+                continue
+            created = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry.get("created_at", 0)))
+            print(
+                f"{entry.get('file_hash', '?')[:16]}  page {entry.get('page')!s:<6} "
+                f"{entry.get('model')}/{entry.get('prompt_version')}  {created}  {len(entry.get('text', ''))} chars"
+            )
+
+    elif args.command == "evict":
+        if args.stale_prompt:
+            current = _prompt_version()
+            removed = sum(
+                cache.evict(file_hash=args.file_hash, prompt_version=version)
+                for version in {entry.get("prompt_version") for _, entry in cache.entries()}
+                if version != current
+            )
+        elif args.all or args.file_hash or args.older_than_days is not None:
+            older_than = time.time() - args.older_than_days * 86400 if args.older_than_days is not None else None
+            removed = cache.evict(file_hash=args.file_hash, older_than=older_than)
+        else:
+            parser.error("evict needs --file-hash, --older-than-days, --stale-prompt or --all")
+        print(f"Removed {removed} cached page(s).")
+
+
+if __name__ == "__main__":
+    main()
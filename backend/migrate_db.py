@@ -19,6 +19,12 @@ engine = create_engine(DATABASE_URL)
 migrations = [
     "ALTER TABLE users ADD COLUMN IF NOT EXISTS mfa_disable_otp VARCHAR;",
     "ALTER TABLE users ADD COLUMN IF NOT EXISTS mfa_disable_otp_expiry VARCHAR;",
+    "ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_hash VARCHAR;",
+    "CREATE INDEX IF NOT EXISTS ix_documents_content_hash ON documents (content_hash);",
+    "ALTER TABLE documents ADD COLUMN IF NOT EXISTS file_path VARCHAR;",
+    "ALTER TABLE ingestion_jobs ADD COLUMN IF NOT EXISTS file_hash VARCHAR;",
+    "ALTER TABLE documents ADD COLUMN IF NOT EXISTS index_document_id INTEGER;",
+    "CREATE INDEX IF NOT EXISTS ix_documents_index_document_id ON documents (index_document_id);",
 ]
 
 print("Running database migrations...")
@@ -1,18 +1,518 @@
+"""
+Bulk rebuild of the search index from every file under DATA_DIR, without downtime.
+
+The rebuild goes into a new index version (see app/index_versions.py) while the API keeps
+serving the live one. Files are extracted (text layer / OCR) and chunked in a process pool,
+embedded in large batches in this process, and written to the new version. Every
+--checkpoint-every files it is flushed (an append, not a rewrite) and the finished files are
+recorded in a checkpoint, so an interrupted rebuild resumes where it stopped. With
+INDEX_SHARD_MODE="user", each file's chunks go to its uploader's shard.
+
+At the end, files uploaded during the rebuild are picked up, chunks of documents deleted
+meanwhile are dropped, and the new version is compacted once and validated. Then the CURRENT
+pointer is flipped; running API processes switch on their next query.
+Undo with `python manage_index.py rollback`.
+
+Before that last catch-up the API's ingestion workers are paused (new uploads stay queued)
+and running jobs are waited for, so no upload lands only in the outgoing version. Queued jobs
+resume against the new version once it is live. With --no-activate nothing is paused.
+
+Usage: python reingest.py [--workers N] [--batch-chunks 4096] [--checkpoint-every 50] [--restart]
+                          [--no-activate] [--force] [--drain-timeout 1800]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
 import os
-from app.ingestion import ingest_file
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from llama_index.core.storage.docstore.utils import doc_to_json, json_to_doc
+
 from app.config import DATA_DIR
+from app.database import SessionLocal, Document, IngestionJob
+from app.hashing import file_sha256, NormalizedTextHash
+from app.ingestion import (
+    init_settings, iter_documents, create_node_parser, build_nodes, _embed_nodes, _bm25_items, index_versions,
+    shard_key_for,
+)
+from app.segment_store import SegmentStore
+from app.vector_store import NumpyVectorStore
+from app.ann import create_ann_index
+from app.bm25 import BM25Index
+
+CHECKPOINT_NAME = "reingest-checkpoint.json"
+# The new version is compacted once, at the end, rather than as segments accumulate
+NO_AUTO_COMPACT = 10 ** 9
+# How long the final catch-up waits for running ingestion jobs to finish (--drain-timeout)
+DRAIN_TIMEOUT = 1800
+DRAIN_POLL_SECONDS = 2
+# Refuse to activate a rebuild with fewer chunks than this share of the live index (--force overrides)
+MIN_CHUNK_RATIO = 0.5
+
+
+def _stored_path(doc) -> str:
+    # Uploads are stored as DATA_DIR/objects/<hash>.<ext>; older ones as DATA_DIR/<filename> (file_path NULL)
+    return os.path.abspath(doc.file_path or os.path.join(DATA_DIR, os.path.basename(doc.filename)))
+
+
+def _documents_by_path():
+    # The original name and uploader live on the Document rows; one stored file can back several
+    # rows (the same bytes uploaded by different tenants). Duplicates (index_document_id set) are
+    # left out: their content is indexed from the original's file.
+    db = SessionLocal()
+    try:
+        documents = {}
+        for doc in db.query(Document).filter(Document.index_document_id.is_(None)).order_by(Document.id):
+            documents.setdefault(_stored_path(doc), []).append({
+                "document_id": doc.id,
+                "file_name": doc.filename,
+                "user_id": doc.user_id,
+                "upload_date": doc.upload_date,
+            })
+        return documents
+    finally:
+        db.close()
+
+
+def _duplicate_paths():
+    db = SessionLocal()
+    try:
+        return {_stored_path(doc) for doc in db.query(Document).filter(Document.index_document_id.isnot(None))}
+    finally:
+        db.close()
+
+
+def discover_files():
+    files = []
+    for root, dirs, filenames in os.walk(DATA_DIR):
+        dirs[:] = sorted(d for d in dirs if d != "tmp")  # partial uploads
+        files.extend(os.path.join(root, filename) for filename in sorted(filenames))
+    return files
+
+
+def _extract(file_path: str, info: dict):
+    """
+    Runs in a worker process: hashes, extracts and chunks one file a page window at a time, as
+    ingest_file does. The chunks (not embedded yet) are spooled to a temporary JSONL file, so
+    neither the worker nor the result pipe holds the whole file.
+    Returns (file_hash, text_hash, spool_path, chunks); text_hash and spool_path are None if
+    nothing was extracted.
+    """
+    file_hash = file_sha256(file_path)
+    return asyncio.run(_extract_windows(file_path, file_hash, info))
+
+
+async def _extract_windows(file_path: str, file_hash: str, info: dict):
+    # First pass: the text hash (and any OCR, which the cache keeps for the second pass)
+    text_hash = NormalizedTextHash()
+    pages = 0
+    async for document in iter_documents(file_path, file_hash):
+        text_hash.update(document.text)
+        pages += 1
+    if not pages:
+        return file_hash, None, None, 0
+
+    text_hash = text_hash.hexdigest()
+    node_parser = create_node_parser()
+    fd, spool_path = tempfile.mkstemp(prefix="reingest-", suffix=".jsonl")
+    chunks = 0
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            async for document in iter_documents(file_path, file_hash, ocr=False):
+                for node in build_nodes([document], file_hash, text_hash, node_parser=node_parser, **info):
+                    f.write(json.dumps(doc_to_json(node)) + "\n")
+                    chunks += 1
+    except BaseException:
+        os.remove(spool_path)
+        raise
+    return file_hash, text_hash, spool_path, chunks
+
+
+def _spooled_nodes(spool_path: str):
+    with open(spool_path, encoding="utf-8") as f:
+        for line in f:
+            yield json_to_doc(json.loads(line))
+
+
+def _checkpoint_path(version: str) -> str:
+    return os.path.join(index_versions.path(version), CHECKPOINT_NAME)
+
+
+def unfinished_versions():
+    """
+    Versions whose rebuild was interrupted (they still hold a checkpoint), oldest first.
+    """
+    return [version for version in index_versions.versions() if os.path.exists(_checkpoint_path(version))]
+
+
+def _load_checkpoint(version: str):
+    try:
+        with open(_checkpoint_path(version), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"done": []}
+
+
+def _write_checkpoint(version: str, done):
+    path = _checkpoint_path(version)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"done": sorted(done), "updated_at": time.time()}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class _Target:
+    """
+    The vector store and keyword index being built for one shard (or the unsharded index).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.vector_store = NumpyVectorStore(path, ann=create_ann_index(), compact_segments=NO_AUTO_COMPACT)
+        self.bm25 = BM25Index(os.path.join(path, "bm25"), compact_segments=NO_AUTO_COMPACT)
+        self.buffer = []
+
+
+class _Rebuild:
+    """
+    Accumulates extracted chunks, embeds them in batches and checkpoints the new index version.
+    Chunks go to their uploader's shard when the index is sharded (INDEX_SHARD_MODE).
+    A file counts as done only once its chunks have been flushed to disk.
+    """
+
+    def __init__(self, version: str, batch_chunks: int, checkpoint_every: int):
+        self.version = version
+        self.batch_chunks = batch_chunks
+        self.checkpoint_every = checkpoint_every
+        self.path = index_versions.path(version)
+        self.targets = {}  # shard key (None: unsharded) -> _Target
+        shards_dir = os.path.join(self.path, "shards")
+        # Resuming: reopen what earlier runs already wrote
+        self.target(None)
+        if os.path.isdir(shards_dir):
+            for key in sorted(os.listdir(shards_dir)):
+                self.target(key)
+        self.done = set(_load_checkpoint(version)["done"])
+        self.buffered = 0
+        self.buffered_files = []
+        self.unsaved_files = []
+        self.seen_hashes = set()
+        self.chunks = 0
+
+    def target(self, shard_key):
+        if shard_key not in self.targets:
+            path = self.path if shard_key is None else os.path.join(self.path, "shards", shard_key)
+            self.targets[shard_key] = _Target(path)
+        return self.targets[shard_key]
+
+    @property
+    def node_count(self) -> int:
+        return sum(target.vector_store.node_count for target in self.targets.values())
+
+    def is_duplicate(self, shard_key, key: str, value: str) -> bool:
+        return (shard_key, value) in self.seen_hashes or bool(self.target(shard_key).vector_store.lookup(key, value))
+
+    def add(self, file_path: str, shard_key, file_hash: str, text_hash: str, nodes):
+        # nodes may be a generator (a spooled file): a large file is embedded in several batches.
+        # It joins buffered_files only afterwards, so it is not checkpointed half-indexed.
+        if (text_hash and not self.is_duplicate(shard_key, "file_hash", file_hash)
+                and not self.is_duplicate(shard_key, "text_hash", text_hash)):
+            self.seen_hashes.update(((shard_key, file_hash), (shard_key, text_hash)))
+            target = self.target(shard_key)
+            for node in nodes:
+                target.buffer.append(node)
+                self.buffered += 1
+                if self.buffered >= self.batch_chunks:
+                    self.flush()
+        self.buffered_files.append(file_path)
+        if self.buffered >= self.batch_chunks:
+            self.flush()
+        if len(self.unsaved_files) >= self.checkpoint_every:
+            self.checkpoint()
+
+    def flush(self):
+        for target in self.targets.values():
+            if target.buffer:
+                _embed_nodes(target.buffer, target.vector_store)
+                target.vector_store.add(target.buffer)
+                target.bm25.add(_bm25_items(target.buffer))
+                self.chunks += len(target.buffer)
+                target.buffer = []
+        if self.buffered:
+            print(f"Embedded and indexed {self.buffered} chunks ({self.chunks} this run).")
+        self.unsaved_files.extend(self.buffered_files)
+        self.buffered, self.buffered_files = 0, []
+
+    def checkpoint(self):
+        self.flush()
+        for target in self.targets.values():
+            target.vector_store.persist()
+            target.bm25.persist()
+        self.done.update(self.unsaved_files)
+        self.unsaved_files = []
+        _write_checkpoint(self.version, self.done)
+        print(f"Checkpoint: {len(self.done)} files done.")
+
+    def compact(self):
+        for target in self.targets.values():
+            # Empty targets are left without a manifest, so they do not look like an index
+            if target.vector_store.node_count:
+                target.vector_store.compact()
+                target.bm25.compact()
+
+
+def _process(state, files, workers: int, failed):
+    """
+    Extracts the files in a process pool and feeds their chunks to the rebuild.
+    """
+    documents = _documents_by_path()
+    duplicates = _duplicate_paths() - set(documents)
+    queue = iter(files)
+    pending = {}
+    # spawn: this process already runs embedding threads, which must not be forked
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_settings) as pool:
+        while True:
+            for file_path in queue:
+                if os.path.abspath(file_path) in duplicates:
+                    state.add(file_path, None, None, None, [])
+                    continue
+                for info in documents.get(os.path.abspath(file_path), [{}]):
+                    pending[pool.submit(_extract, file_path, info)] = (file_path, info)
+                if len(pending) >= workers * 2:
+                    break
+            if not pending:
+                break
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                file_path, info = pending.pop(future)
+                try:
+                    file_hash, text_hash, spool_path, chunks = future.result()
+                except Exception as e:
+                    print(f"Failed to extract {file_path}: {e}")
+                    failed.add(file_path)
+                    continue
+                print(f"Extracted {chunks} chunks from {file_path}")
+                if spool_path is None:
+                    state.add(file_path, None, None, None, [])
+                    continue
+                try:
+                    state.add(file_path, shard_key_for(info.get("user_id")), file_hash, text_hash,
+                              _spooled_nodes(spool_path))
+                finally:
+                    os.remove(spool_path)
+    state.checkpoint()
+
+
+def _drop_deleted_documents(state):
+    # Documents deleted through the API while the rebuild ran
+    live_ids = {info["document_id"] for infos in _documents_by_path().values() for info in infos}
+    dropped = 0
+    for target in state.targets.values():
+        stale = {node.ref_doc_id for node in target.vector_store.get_nodes()
+                 if node.metadata.get("document_id") is not None and node.metadata["document_id"] not in live_ids}
+        for ref_doc_id in stale:
+            target.vector_store.delete(ref_doc_id)
+            target.bm25.delete(ref_doc_id)
+        dropped += len(stale)
+    if dropped:
+        print(f"Dropped {dropped} document(s) deleted during the rebuild.")
+
+
+def catch_up_version(version: str, workers: int, batch_chunks: int = 4096, checkpoint_every: int = 50):
+    """
+    Brings a finished version up to date with the documents table before it goes live again
+    (manage_index.py activate / rollback): indexes the documents it is missing and drops the
+    deleted ones. Ingestion must be paused and drained. Returns the files that failed to extract.
+    """
+    state = _Rebuild(version, batch_chunks, checkpoint_every)
+    db = SessionLocal()
+    try:
+        missing = set()
+        for doc in db.query(Document).filter(Document.index_document_id.is_(None)):
+            vector_store = state.target(shard_key_for(doc.user_id)).vector_store
+            if vector_store.lookup("document_id", doc.id):
+                continue
+            if doc.content_hash and vector_store.lookup("file_hash", doc.content_hash):
+                continue  # the same bytes, indexed under another upload of this tenant
+            missing.add(_stored_path(doc))
+    finally:
+        db.close()
+
+    failed = set()
+    files = sorted(path for path in missing if os.path.exists(path))
+    failed.update(missing - set(files))
+    if files:
+        print(f"Index version {version} is missing {len(files)} uploaded file(s); indexing them.")
+        init_settings()
+        _process(state, files, workers, failed)
+    _drop_deleted_documents(state)
+    state.checkpoint()
+    os.remove(_checkpoint_path(version))  # finished again: not an interrupted rebuild
+    return failed
+
+
+def _stored_rows(path: str) -> int:
+    # Rows of an index directory and its shards, read from the manifests (deleted rows included)
+    rows = SegmentStore(path).manifest.get("rows", 0)
+    shards_dir = os.path.join(path, "shards")
+    if os.path.isdir(shards_dir):
+        rows += sum(SegmentStore(os.path.join(shards_dir, key)).manifest.get("rows", 0) for key in os.listdir(shards_dir))
+    return rows
+
+
+def validate(state, force: bool = False):
+    """
+    Checks a finished rebuild before it goes live. Returns a list of problems (empty if it is fine).
+    """
+    from llama_index.core.vector_stores.types import VectorStoreQuery
+
+    problems = []
+    chunks = state.node_count
+    if chunks == 0:
+        return ["the new index is empty"]
+    for key, target in state.targets.items():
+        vector_store, name = target.vector_store, key or "unsharded index"
+        if target.bm25.doc_count != vector_store.node_count:
+            problems.append(f"{name}: keyword index has {target.bm25.doc_count} chunks, vector index {vector_store.node_count}")
+        # Every sampled chunk must find itself (or an identical chunk) as its own nearest neighbour
+        nodes = vector_store.get_nodes()
+        for node in nodes[:: max(1, len(nodes) // 20)]:
+            row = vector_store.lookup("chunk_hash", node.metadata.get("chunk_hash"))
+            if not row:
+                problems.append(f"{name}: chunk {node.node_id} has no chunk_hash lookup")
+                break
+            query = VectorStoreQuery(query_embedding=vector_store.get_embedding(row[0]), similarity_top_k=1)
+            result = vector_store.query(query)
+            if not result.similarities or result.similarities[0] < 0.99:
+                problems.append(f"{name}: chunk {node.node_id} is not its own nearest neighbour")
+                break
+    live = index_versions.current_version()
+    if not force:
+        live_rows = _stored_rows(index_versions.path(live))
+        if live_rows and chunks < MIN_CHUNK_RATIO * live_rows:
+            problems.append(f"only {chunks} chunks against {live_rows} in the live index (use --force to accept)")
+    return problems
+
+
+def _catch_up(state, workers: int, failed):
+    """Repeat until no new files turn up, so uploads made during the rebuild are included."""
+    while True:
+        files = discover_files()
+        todo = [path for path in files if path not in state.done and path not in failed]
+        print(f"Found {len(files)} files, {len(state.done)} done, {len(todo)} to process.")
+        if not todo:
+            return
+        _process(state, todo, workers, failed)
+
+
+def _running_jobs() -> int:
+    db = SessionLocal()
+    try:
+        return db.query(IngestionJob).filter(IngestionJob.status == "running").count()
+    finally:
+        db.close()
+
+
+def _drain_ingestion(timeout: float) -> bool:
+    """Waits until no ingestion job is running; workers must already be paused."""
+    deadline = time.time() + timeout
+    while True:
+        running = _running_jobs()
+        if not running:
+            return True
+        if time.time() >= deadline:
+            return False
+        print(f"Waiting for {running} running ingestion job(s) to finish...")
+        time.sleep(DRAIN_POLL_SECONDS)
+
+
+def rebuild(workers: int, batch_chunks: int, checkpoint_every: int, activate: bool = True, force: bool = False,
+            drain_timeout: float = DRAIN_TIMEOUT):
+    init_settings()
+    unfinished = unfinished_versions()
+    if unfinished:
+        version = unfinished[-1]
+        print(f"Resuming the rebuild of index version {version}.")
+    else:
+        version = index_versions.create()
+        _write_checkpoint(version, [])
+        print(f"Building index version {version} (live: {index_versions.current_version()}).")
+    state = _Rebuild(version, batch_chunks, checkpoint_every)
+
+    failed = set()
+    _catch_up(state, workers, failed)
+    if not activate:
+        return _finish(state, version, failed, activate, force)
+
+    # An upload ingested after the last discover would only reach the outgoing version
+    index_versions.pause_ingestion()
+    try:
+        print("Paused ingestion workers; new uploads stay queued until the new version is live.")
+        if not _drain_ingestion(drain_timeout):
+            print(f"Ingestion jobs still running after {drain_timeout:.0f}s; the live index is unchanged. "
+                  "Run again to resume the rebuild.")
+            return False
+        _catch_up(state, workers, failed)
+        return _finish(state, version, failed, activate, force)
+    finally:
+        index_versions.resume_ingestion()
+
+
+def _finish(state, version: str, failed, activate: bool, force: bool) -> bool:
+    _drop_deleted_documents(state)
+
+    if failed:
+        print(f"{len(failed)} file(s) failed and are not in the index; run again to retry them:")
+        for file_path in sorted(failed):
+            print(f"  {file_path}")
+
+    state.compact()
+    problems = validate(state, force)
+    if problems:
+        print(f"Index version {version} failed validation; the live index is unchanged:")
+        for problem in problems:
+            print(f"  {problem}")
+        return False
+    os.remove(_checkpoint_path(version))
+    print(f"Index version {version} is ready: {state.node_count} chunks.")
+    if activate:
+        index_versions.activate(version)
+        print(f"Activated {version} (previous: {index_versions.previous_version()}). "
+              "Running API processes switch on their next query; undo with `python manage_index.py rollback`.")
+    else:
+        print(f"Activate it with `python manage_index.py activate {version}`.")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the search index from DATA_DIR into a new index version.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="Extraction processes")
+    parser.add_argument("--batch-chunks", type=int, default=4096, help="Chunks embedded per batch")
+    parser.add_argument("--checkpoint-every", type=int, default=50, help="Files between checkpoints")
+    parser.add_argument("--restart", action="store_true", help="Discard an interrupted rebuild and start over")
+    parser.add_argument("--no-activate", action="store_true", help="Build and validate, but leave the live index")
+    parser.add_argument("--force", action="store_true", help="Activate even if much smaller than the live index")
+    parser.add_argument("--drain-timeout", type=float, default=DRAIN_TIMEOUT,
+                        help="Seconds to wait for running ingestion jobs before activating")
+    args = parser.parse_args()
+
+    print(f"Checking data directory: {DATA_DIR}")
+    if not os.path.exists(DATA_DIR):
+        print("Data directory not found.")
+        return
+    if args.restart:
+        for version in unfinished_versions():
+            print(f"Discarding unfinished index version {version}.")
+            index_versions.remove(version)
+    rebuild(args.workers, args.batch_chunks, args.checkpoint_every, activate=not args.no_activate, force=args.force,
+            drain_timeout=args.drain_timeout)
+
 
-print(f"Checking data directory: {DATA_DIR}")
-if os.path.exists(DATA_DIR):
-    files = os.listdir(DATA_DIR)
-    print(f"Found files: {files}")
-    for file in files:
-        file_path = os.path.join(DATA_DIR, file)
-        print(f"Re-ingesting: {file_path}")
-        try:
-            num_docs = ingest_file(file_path)
-            print(f"Successfully ingested {num_docs} chunks from {file}")
-        except Exception as e:
-            print(f"Failed to ingest {file}: {e}")
-else:
-    print("Data directory not found.")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import shutil
+import tempfile
+
+import numpy as np
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from app.ann import IVFIndex
+from app.vector_store import NumpyVectorStore
+
+DIM = 16
+
+
+def _corpus(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((32, DIM)).astype(np.float32)
+    vectors = centers[rng.integers(0, 32, rows)] + 0.5 * rng.standard_normal((rows, DIM)).astype(np.float32)
+    queries = vectors[rng.choice(rows, 40, replace=False)] + 0.3 * rng.standard_normal((40, DIM)).astype(np.float32)
+    return vectors, queries
+
+
+def _store(root, vectors, ann):
+    store = NumpyVectorStore(root, ann=ann)
+    store.add([TextNode(id_=f"n{i}", text="", embedding=vector.tolist()) for i, vector in enumerate(vectors)])
+    store.persist()
+    return store
+
+
+def _top(store, query, k=10):
+    return set(store.query(VectorStoreQuery(query_embedding=query.tolist(), similarity_top_k=k)).ids)
+
+
+def _unit(vectors):
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_train_assign_and_probe():
+    vectors, _ = _corpus(2000)
+    matrix = _unit(vectors).astype(np.float32)
+    ivf = IVFIndex(nlist=16, nprobe=2, train_min=1000)
+    assert not ivf.needs_training(999) and ivf.needs_training(1000)
+    assert ivf.candidates(matrix[0]) is None  # untrained: scan everything
+
+    ivf.train(matrix[:1500])
+    assert ivf.trained and ivf.centroids.shape == (16, DIM) and len(ivf.assign) == 1500
+    assert np.array_equal(ivf.assign, np.argmax(matrix[:1500] @ ivf.centroids.T, axis=1))
+    ivf.add(matrix[1500:])  # rows added after training get a bucket too
+    assert len(ivf.assign) == 2000
+    assert np.array_equal(ivf.assign[1500:], np.argmax(matrix[1500:] @ ivf.centroids.T, axis=1))
+
+    # The probed buckets are the nprobe closest centroids, and every row in them is a candidate
+    query = matrix[1700]
+    probes = set(np.argsort(-(ivf.centroids @ query))[:2])
+    assert set(ivf.candidates(query)) == set(np.flatnonzero(np.isin(ivf.assign, list(probes))))
+    assert 1700 in set(ivf.candidates(query))
+    assert not ivf.needs_training(2000) and ivf.needs_training(6000)
+
+
+def test_small_store_falls_back_to_exact_search():
+    vectors, queries = _corpus(300)
+    exact_root, ivf_root = tempfile.mkdtemp(), tempfile.mkdtemp()
+    try:
+        exact = _store(exact_root, vectors, ann=None)
+        store = _store(ivf_root, vectors, ann=IVFIndex(nlist=16, nprobe=1, train_min=1000))
+        assert not store.ann.trained
+        assert [_top(store, query) for query in queries] == [_top(exact, query) for query in queries]
+    finally:
+        shutil.rmtree(exact_root, ignore_errors=True)
+        shutil.rmtree(ivf_root, ignore_errors=True)
+
+
+def test_recall_against_exact_search():
+    vectors, queries = _corpus(4000)
+    exact_root, ivf_root = tempfile.mkdtemp(), tempfile.mkdtemp()
+    try:
+        exact = _store(exact_root, vectors, ann=None)
+        truth = [_top(exact, query) for query in queries]
+        store = _store(ivf_root, vectors, ann=IVFIndex(nlist=64, train_min=1000))
+        assert store.ann.trained
+
+        recalls = []
+        for nprobe in (1, 2, 4, 8, 16, 64):
+            store.ann.nprobe = nprobe
+            found = [_top(store, query) for query in queries]
+            recalls.append(np.mean([len(f & t) / len(t) for f, t in zip(found, truth)]))
+        assert recalls == sorted(recalls)  # a larger nprobe never lowers recall
+        assert recalls[0] < 1.0 and recalls[2] >= 0.9
+        assert recalls[-1] == 1.0  # every bucket probed: exact
+    finally:
+        shutil.rmtree(exact_root, ignore_errors=True)
+        shutil.rmtree(ivf_root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_train_assign_and_probe()
+    test_small_store_falls_back_to_exact_search()
+    test_recall_against_exact_search()
@@ -0,0 +1,86 @@
+import time
+
+from app.answer_cache import AnswerCache
+
+
+def test_exact_and_semantic_hits():
+    cache = AnswerCache(similarity_threshold=0.95)
+    assert cache.get("What is the stamp duty of gift?", index_version=1) is None
+    cache.put("What is the stamp duty of gift?", "5%", index_version=1, seconds=2.0, embedding=[1.0, 0.0, 0.1])
+
+    # Case, spacing and trailing punctuation do not matter
+    assert cache.get("what is the  stamp duty of gift", index_version=1) == "5%"
+    # Near-duplicate question: similar embedding
+    assert cache.get_similar("Stamp duty payable on a gift deed?", [0.98, 0.05, 0.1], index_version=1) == "5%"
+    # Unrelated question
+    assert cache.get_similar("Who can adopt a child?", [0.0, 1.0, 0.0], index_version=1) is None
+
+    stats = cache.stats()
+    assert (stats["exact_hits"], stats["semantic_hits"], stats["misses"]) == (1, 1, 1)
+    assert stats["saved_seconds"] == 4.0
+
+
+def test_index_change_invalidates():
+    cache = AnswerCache()
+    cache.get("q", index_version=1)
+    cache.put("q", "old answer", index_version=1, seconds=1.0)
+    assert cache.get("q", index_version=2) is None
+    # An answer generated against the old index is not stored after the index changed
+    cache.put("q", "stale", index_version=1, seconds=1.0)
+    assert cache.get("q", index_version=2) is None
+
+
+def test_lru_and_ttl_bounds():
+    cache = AnswerCache(max_entries=2, ttl_seconds=0.2)
+    cache.get("a", index_version=1)
+    for query in ("a", "b"):
+        cache.put(query, query.upper(), index_version=1, seconds=1.0)
+    cache.get("a", index_version=1)  # a is now most recently used
+    cache.put("c", "C", index_version=1, seconds=1.0)
+    assert cache.get("b", index_version=1) is None
+    assert cache.get("a", index_version=1) == "A"
+
+    time.sleep(0.3)
+    assert cache.get("c", index_version=1) is None
+
+
+def test_semantic_hit_needs_same_citations_and_numbers():
+    cache = AnswerCache(similarity_threshold=0.95)
+    cache.get("What is Section 6?", index_version=1)
+    cache.put("What is Section 6?", "Devolution of coparcenary property", index_version=1, seconds=2.0,
+              embedding=[1.0, 0.0, 0.1])
+    # Near-identical embeddings, but another section
+    assert cache.get_similar("What is Section 7?", [1.0, 0.0, 0.1], index_version=1) is None
+    assert cache.get_similar("What does section 6 say", [0.99, 0.02, 0.1], index_version=1) == "Devolution of coparcenary property"
+    cache.put("Stamp duty on a lease for 5 years", "2%", index_version=1, seconds=1.0, embedding=[0.0, 1.0, 0.0])
+    assert cache.get_similar("Stamp duty on a lease for 10 years", [0.0, 1.0, 0.01], index_version=1) is None
+
+
+def test_embeds_only_when_a_cached_query_could_match():
+    cache = AnswerCache(similarity_threshold=0.95)
+    vectors = {"Stamp duty on a gift deed?": [1.0, 0.0], "What is the stamp duty on a gift deed": [0.99, 0.05],
+               "Who can adopt a child?": [0.0, 1.0]}
+    embedded = []
+
+    def embed(text):
+        embedded.append(text)
+        return vectors[text]
+
+    cache.get("Stamp duty on a gift deed?", index_version=1)
+    assert cache.get_similar("Stamp duty on a gift deed?", embed, index_version=1) is None
+    assert embedded == []  # empty cache: nothing to compare with
+    cache.put("Stamp duty on a gift deed?", "5%", index_version=1, seconds=2.0)  # stored without an embedding
+    assert cache.get_similar("What is Section 6?", embed, index_version=1) is None
+    assert embedded == []  # other anchors
+    assert cache.get_similar("What is the stamp duty on a gift deed", embed, index_version=1) == "5%"
+    assert embedded == ["What is the stamp duty on a gift deed", "Stamp duty on a gift deed?"]
+    cache.get_similar("Who can adopt a child?", embed, index_version=1)
+    assert embedded[2:] == ["Who can adopt a child?"]  # the cached query's embedding was kept
+
+
+if __name__ == "__main__":
+    test_exact_and_semantic_hits()
+    test_index_change_invalidates()
+    test_lru_and_ttl_bounds()
+    test_semantic_hit_needs_same_citations_and_numbers()
+    test_embeds_only_when_a_cached_query_could_match()
@@ -0,0 +1,77 @@
+import shutil
+import tempfile
+
+from app.bm25 import BM25Index, tokenize
+from app.ingestion import _open_bm25
+from app.retrieval import reciprocal_rank_fusion
+from app.vector_store import NumpyVectorStore
+from test_vector_store import _nodes
+
+
+def test_citations_are_literal():
+    assert "2(j)" in tokenize("Section 2(j) applies")
+    assert "2(j)" not in tokenize("Section 2j applies")
+    # Indexed text also carries the bare number; queries do not
+    assert "2" in tokenize("Section 2(j)")
+    assert "2" not in tokenize("Section 2(j)", expand_citations=False)
+
+
+def test_search_delete_compact_reload():
+    root = tempfile.mkdtemp()
+    try:
+        index = BM25Index(root)
+        index.add([
+            ("a", "1", "Section 2(j) defines a consumer."),
+            ("b", "2", "Section 2j deals with something else."),
+            ("c", "3", "Stamp duty on a gift deed."),
+        ])
+        index.persist()
+        assert index.search("what is section 2(j)", top_k=1)[0][0] == "a"
+        assert index.search("stamp duty gift", top_k=1)[0][0] == "c"
+
+        index.delete("1")
+        assert "a" not in [node_id for node_id, _ in index.search("section 2(j)")]
+        index.compact()
+
+        reloaded = BM25Index(root)
+        assert reloaded.doc_count == 2
+        assert reloaded.search("section 2j", top_k=1)[0][0] == "b"
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_rrf_rewards_agreement():
+    fused = reciprocal_rank_fusion([["x", "y", "z"], ["y", "w"]])
+    assert fused[0][0] == "y"
+    assert {item for item, _ in fused} == {"x", "y", "z", "w"}
+
+
+def test_open_reconciles_with_the_vector_store():
+    root = tempfile.mkdtemp()
+    try:
+        vector_store = NumpyVectorStore(root)
+        vector_store.add(_nodes(1, 4, seed=1))
+        vector_store.persist()
+        assert _open_bm25(vector_store).doc_count == 4  # built from the stored chunks
+
+        # Chunks persisted to the vector store but not to the keyword index (crash in between)
+        vector_store.add(_nodes(2, 3, seed=2))
+        vector_store.persist()
+        bm25 = _open_bm25(vector_store)
+        assert bm25.doc_count == 7 and {node_id for node_id, _ in bm25.search("document 2", top_k=10)} >= {"2-0", "2-1", "2-2"}
+        assert _open_bm25(vector_store).node_ids() == {node.node_id for node in vector_store.get_nodes()}
+
+        # A delete that reached the vector store only
+        vector_store.delete("1")
+        bm25 = _open_bm25(vector_store)
+        assert bm25.node_ids() == {"2-0", "2-1", "2-2"}
+        assert BM25Index(bm25.root).doc_count == 3  # the rebuild is persisted
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_citations_are_literal()
+    test_search_delete_compact_reload()
+    test_rrf_rewards_agreement()
+    test_open_reconciles_with_the_vector_store()
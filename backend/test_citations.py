@@ -0,0 +1,92 @@
+import shutil
+import tempfile
+
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeRelationship, RelatedNodeInfo, TextNode
+
+from app.citations import extract_citations, query_citation_keys
+from app.retrieval import CitationRetriever
+from app.vector_store import NumpyVectorStore
+
+
+def test_extract_citations():
+    keys = extract_citations("Under Sec. 2(j) and Section 6 of the Hindu Succession Act, 1956, and Article 14(1)(a)")
+    assert {"section:2(j)", "section:6", "section:6@hindu succession act", "article:14(1)(a)"} <= keys
+    assert "section:2j" not in keys
+    assert query_citation_keys("What does section 6 of the Hindu Succession Act say?") == {
+        "section:6@hindu succession act"
+    }
+    assert query_citation_keys("What is section 2(j)?") == {"section:2(j)"}
+    assert not query_citation_keys("what is stamp duty on a gift deed")
+
+
+class _Fallback(BaseRetriever):
+    def __init__(self):
+        self.calls = 0
+        super().__init__()
+
+    def _retrieve(self, query_bundle):
+        self.calls += 1
+        return []
+
+
+def test_citation_lookup_short_circuits():
+    root = tempfile.mkdtemp()
+    try:
+        store = NumpyVectorStore(root)
+        texts = ["Section 2(j) defines a consumer.", "Section 2j deals with something else.", "Stamp duty."]
+        nodes = []
+        for i, text in enumerate(texts):
+            node = TextNode(id_=f"n{i}", text=text, embedding=[1.0, float(i)])
+            node.metadata["citations"] = sorted(extract_citations(text))
+            nodes.append(node)
+        store.add(nodes)
+        store.persist()
+
+        fallback = _Fallback()
+        retriever = CitationRetriever(fallback, store, similarity_top_k=5)
+        assert [hit.node.node_id for hit in retriever.retrieve("what is section 2(j)?")] == ["n0"]
+        assert fallback.calls == 0
+        retriever.retrieve("what is stamp duty?")
+        assert fallback.calls == 1
+
+        reloaded = NumpyVectorStore(root)
+        assert [node.node_id for node in reloaded.lookup_nodes("citations", "section:2j")] == ["n1"]
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_unqualified_citation_across_acts_falls_through():
+    root = tempfile.mkdtemp()
+    try:
+        store = NumpyVectorStore(root)
+        texts = ["Section 6 of the Hindu Succession Act gives daughters coparcenary rights.",
+                 "Under Section 6 of the Transfer of Property Act any property may be transferred.",
+                 "Section 6 applies to property acquired before 2005."]
+        nodes = []
+        for i, text in enumerate(texts):
+            node = TextNode(id_=f"n{i}", text=text, embedding=[1.0, float(i)],
+                            relationships={NodeRelationship.SOURCE: RelatedNodeInfo(node_id=f"d{i}")})
+            node.metadata["citations"] = sorted(extract_citations(text))
+            nodes.append(node)
+        store.add(nodes)
+        store.persist()
+
+        fallback = _Fallback()
+        retriever = CitationRetriever(fallback, store, similarity_top_k=5)
+        retriever.retrieve("what is section 6?")
+        assert fallback.calls == 1  # two acts: not one provision
+        hits = retriever.retrieve("what is section 6 of the Hindu Succession Act?")
+        assert [hit.node.node_id for hit in hits] == ["n0"] and fallback.calls == 1
+
+        store.delete("d1")
+        assert [hit.node.node_id for hit in retriever.retrieve("what is section 6?")] == ["n0", "n2"]
+        assert fallback.calls == 1
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_extract_citations()
+    test_citation_lookup_short_circuits()
+    test_unqualified_citation_across_acts_falls_through()
@@ -0,0 +1,62 @@
+import asyncio
+import time
+
+import app.ingestion as ingestion
+
+QUERY_SECONDS = 0.5
+CONCURRENT_QUERIES = 4
+
+
+class SlowEngine:
+    """
+    Stands in for the LlamaIndex query engine: a blocking call like the Gemini LLM round trip.
+    """
+
+    def query(self, query_str):
+        time.sleep(QUERY_SECONDS)
+        return query_str
+
+
+async def _run_concurrently():
+    start = time.perf_counter()
+    results = await asyncio.gather(*(ingestion.run_query(f"q{i}") for i in range(CONCURRENT_QUERIES)))
+    return results, time.perf_counter() - start
+
+
+async def _heartbeat_during_query():
+    # The event loop must stay responsive (e.g. /health) while a query is running
+    query = asyncio.create_task(ingestion.run_query("slow"))
+    start = time.perf_counter()
+    await asyncio.sleep(0.05)
+    latency = time.perf_counter() - start
+    await query
+    return latency
+
+
+def test_concurrent_queries_overlap():
+    ingestion._query_engine = SlowEngine()
+    try:
+        results, elapsed = asyncio.run(_run_concurrently())
+    finally:
+        ingestion._query_engine = None
+
+    assert results == [f"q{i}" for i in range(CONCURRENT_QUERIES)]
+    # Serialised execution would take CONCURRENT_QUERIES * QUERY_SECONDS
+    assert elapsed < 2 * QUERY_SECONDS, f"queries ran serially ({elapsed:.2f}s)"
+    print(f"{CONCURRENT_QUERIES} queries of {QUERY_SECONDS}s finished in {elapsed:.2f}s")
+
+
+def test_event_loop_not_blocked_by_query():
+    ingestion._query_engine = SlowEngine()
+    try:
+        latency = asyncio.run(_heartbeat_during_query())
+    finally:
+        ingestion._query_engine = None
+
+    assert latency < QUERY_SECONDS / 2, f"event loop blocked for {latency:.2f}s"
+    print(f"Event loop stayed responsive during query ({latency * 1000:.0f}ms tick)")
+
+
+if __name__ == "__main__":
+    test_concurrent_queries_overlap()
+    test_event_loop_not_blocked_by_query()
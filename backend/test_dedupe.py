@@ -0,0 +1,108 @@
+import asyncio
+import os
+import shutil
+import tempfile
+
+from llama_index.core import Document, Settings
+from llama_index.core.embeddings import MockEmbedding
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import app.ingestion as ingestion
+import app.jobs as jobs
+from app.database import Base, Document as DocumentRow, IngestionJob
+from test_streaming_ingest import _use_temp_index
+
+
+class CountingEmbedding(MockEmbedding):
+    texts: list = []
+
+    def _get_text_embeddings(self, texts):
+        self.texts.extend(texts)
+        return super()._get_text_embeddings(texts)
+
+
+def _pages(file_name, texts):
+    return [
+        Document(text=text, metadata={"file_name": file_name, "page_label": str(number)})
+        for number, text in enumerate(texts, start=1)
+    ]
+
+
+def test_identical_chunks_of_different_files_share_an_embedding():
+    root = tempfile.mkdtemp()
+    versions = ingestion.index_versions
+    try:
+        _use_temp_index(root)
+        Settings.embed_model = CountingEmbedding(embed_dim=8, texts=[])
+        act = "6. Devolution of interest in coparcenary property to the daughter of a coparcener."
+        first = ingestion.build_nodes(_pages("act.pdf", [act, "Schedule of the original print."]), "h1", "t1", document_id=1)
+        ingestion._embed_nodes(first)
+        ingestion._insert_nodes(first)
+
+        # The same section, on another page of another file
+        second = ingestion.build_nodes(_pages("bundle.pdf", ["Index of the bundle.", act]), "h2", "t2", document_id=2)
+        ingestion._embed_nodes(second)
+        assert len(Settings.embed_model.texts) == 3
+        assert second[1].metadata["chunk_hash"] == first[0].metadata["chunk_hash"]
+        vector_store = ingestion.get_index().vector_store
+        stored = vector_store.get_embedding(vector_store.lookup("chunk_hash", first[0].metadata["chunk_hash"])[0])
+        assert list(second[1].embedding) == list(stored)
+        # The source is still shown to the LLM
+        assert "bundle.pdf" in second[1].get_content(metadata_mode="llm")
+    finally:
+        _use_temp_index(versions.root)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def _use_temp_db(root):
+    engine = create_engine(f"sqlite:///{os.path.join(root, 'test.db')}")
+    Base.metadata.create_all(bind=engine)
+    jobs.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    return jobs.SessionLocal
+
+
+def test_deleting_the_original_hands_its_content_to_a_duplicate():
+    root = tempfile.mkdtemp()
+    versions, session_local = ingestion.index_versions, jobs.SessionLocal
+    try:
+        _use_temp_index(root)
+        SessionLocal = _use_temp_db(root)
+        paths = [os.path.join(root, name) for name in ("deed.txt", "deed copy.txt", "deed scan.txt")]
+        for path, text in zip(paths, ["Lease deed of the warehouse.", "LEASE deed of the  warehouse.\n", "Lease Deed of the warehouse."]):
+            with open(path, "w") as f:
+                f.write(text)
+        db = SessionLocal()
+        db.add_all([DocumentRow(id=number, filename=os.path.basename(path), file_path=path) for number, path in enumerate(paths, 1)])
+        db.commit()
+
+        assert asyncio.run(ingestion.ingest_file(paths[0], document_id=1)) == 1
+        for number in (2, 3):
+            # Same normalised text: skipped, and recorded as served by document 1's chunks
+            on_duplicate = lambda owner, number=number: jobs._set_index_document(number, owner)
+            assert asyncio.run(ingestion.ingest_file(paths[number - 1], document_id=number, on_duplicate=on_duplicate)) == 0
+        db.expire_all()
+        assert [row.index_document_id for row in db.query(DocumentRow).order_by(DocumentRow.id)] == [None, 1, 1]
+
+        # Deleting the original re-queues the oldest duplicate, which then indexes its own file
+        db.query(DocumentRow).filter(DocumentRow.id == 1).delete()
+        db.commit()
+        ingestion.delete_document_vectors(1)
+        job_id = jobs.reassign_duplicates(db, 1)
+        job = db.query(IngestionJob).filter(IngestionJob.id == job_id).one()
+        assert (job.document_id, job.file_path) == (2, paths[1])
+        assert [row.index_document_id for row in db.query(DocumentRow).order_by(DocumentRow.id)] == [None, 2]
+        assert asyncio.run(ingestion.ingest_file(job.file_path, document_id=job.document_id)) == 1
+        assert ingestion.get_index().vector_store.lookup_nodes("document_id", 2)
+        # Nothing else pointed at document 3
+        assert jobs.reassign_duplicates(db, 3) is None
+        db.close()
+    finally:
+        jobs.SessionLocal = session_local
+        _use_temp_index(versions.root)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_identical_chunks_of_different_files_share_an_embedding()
+    test_deleting_the_original_hands_its_content_to_a_duplicate()
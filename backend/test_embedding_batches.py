@@ -0,0 +1,111 @@
+import json
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app.embedding_batcher import AdaptiveEmbeddingBatcher
+
+# The fake server rejects requests over these limits with 429, like a quota-limited embedding API
+MAX_SERVER_BATCH = 24
+MAX_SERVER_IN_FLIGHT = 3
+
+
+class FakeEmbeddingServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeEmbeddingHandler)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.requests = 0
+        self.rejected = 0
+        self.batch_sizes = []
+
+
+class FakeEmbeddingHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        texts = json.loads(self.rfile.read(int(self.headers["Content-Length"])))["texts"]
+        with server.lock:
+            server.requests += 1
+            overloaded = len(texts) > MAX_SERVER_BATCH or server.in_flight >= MAX_SERVER_IN_FLIGHT
+            if overloaded:
+                server.rejected += 1
+            else:
+                server.in_flight += 1
+                server.batch_sizes.append(len(texts))
+        if overloaded:
+            self.send_response(429)
+            self.end_headers()
+            return
+        try:
+            # Deterministic "embedding" so the test can check results land in the right order
+            body = json.dumps({"embeddings": [[float(len(t)), float(sum(map(ord, t)) % 997)] for t in texts]})
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(body.encode())
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+
+def _embed_fn(url):
+    def embed(texts):
+        request = urllib.request.Request(
+            url, data=json.dumps({"texts": texts}).encode(), headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(request) as response:  # HTTPError(code=429) on rejection
+            return json.loads(response.read())["embeddings"]
+    return embed
+
+
+def _start_server():
+    server = FakeEmbeddingServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/embed"
+
+
+def test_batches_adapt_to_rate_limits():
+    server, url = _start_server()
+    try:
+        texts = [f"chunk {i} " + "x" * (i % 50) for i in range(1000)]
+        batcher = AdaptiveEmbeddingBatcher(
+            _embed_fn(url), max_batch_size=100, concurrency=4, base_delay=0.01, max_delay=0.1
+        )
+        embeddings = batcher.embed(texts)
+    finally:
+        server.shutdown()
+
+    expected = [[float(len(t)), float(sum(map(ord, t)) % 997)] for t in texts]
+    assert embeddings == expected, "embeddings missing or out of order"
+    assert server.rejected > 0 and batcher.last_stats["rate_limited"] > 0
+    assert max(server.batch_sizes) <= MAX_SERVER_BATCH
+    # Far fewer requests than one per chunk
+    assert len(server.batch_sizes) < len(texts) / 5
+    stats = batcher.last_stats
+    print(
+        f"{stats['chunks']} chunks in {stats['batches']} batches, {stats['rate_limited']} rate-limited, "
+        f"final batch size {stats['batch_size']}, {stats['chunks_per_second']:.0f} chunks/s"
+    )
+
+
+def test_gives_up_after_max_retries():
+    def always_limited(texts):
+        raise RuntimeError("429 Resource has been exhausted (e.g. check quota).")
+
+    batcher = AdaptiveEmbeddingBatcher(always_limited, concurrency=2, max_retries=2, base_delay=0.001)
+    try:
+        batcher.embed(["a", "b", "c"])
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("expected the rate-limit error to surface")
+
+
+if __name__ == "__main__":
+    test_batches_adapt_to_rate_limits()
+    test_gives_up_after_max_retries()
@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from llama_index.core.embeddings import MockEmbedding
+
+from app.embedding_cache import CachedEmbedding, EmbeddingCache
+
+
+class CountingEmbedding(MockEmbedding):
+    calls: list = []
+
+    def _get_text_embeddings(self, texts):
+        self.calls.append(list(texts))
+        return super()._get_text_embeddings(texts)
+
+
+def test_round_trip_and_reopen():
+    root = tempfile.mkdtemp()
+    try:
+        path = os.path.join(root, "embeddings.db")
+        cache = EmbeddingCache(path)
+        vectors = {"a": [0.1, 0.2, 0.3], "b": [1.0, -1.0, 0.5]}
+        cache.put_many("model-1", vectors)
+        found = cache.get_many("model-1", ["a", "b", "c"])
+        assert set(found) == {"a", "b"}
+        assert np.allclose(found["b"], vectors["b"])
+        assert cache.get_many("model-2", ["a"]) == {}  # another model never shares entries
+        assert (cache.stats()["hits"], cache.stats()["misses"]) == (2, 2)
+
+        reopened = EmbeddingCache(path)
+        assert np.allclose(reopened.get_many("model-1", ["a"])["a"], vectors["a"])
+        assert reopened.stats()["entries"] == 2
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_least_recently_used_entries_are_evicted():
+    root = tempfile.mkdtemp()
+    try:
+        cache = EmbeddingCache(os.path.join(root, "embeddings.db"), max_entries=10)
+        cache.put_many("m", {f"old-{i}": [float(i)] for i in range(10)})
+        assert cache.get_many("m", ["old-0", "old-1", "old-2"])  # used again: now the most recent
+        cache.put_many("m", {"new-0": [0.5], "new-1": [0.6]})
+
+        # 12 entries > 10: trimmed to 90% of the bound, least recently used first
+        stats = cache.stats()
+        assert (stats["entries"], stats["evictions"]) == (9, 3)
+        kept = cache.get_many("m", ["old-0", "old-1", "old-2", "new-0", "new-1"])
+        assert len(kept) == 5
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_cached_embedding_only_embeds_misses():
+    root = tempfile.mkdtemp()
+    try:
+        inner = CountingEmbedding(embed_dim=4, calls=[])
+        model = CachedEmbedding(inner, EmbeddingCache(os.path.join(root, "embeddings.db")))
+        first = model.get_text_embedding_batch(["lease", "deed", "lease"])
+        second = model.get_text_embedding_batch(["deed", "gift"])
+        assert inner.calls == [["lease", "deed"], ["gift"]]
+        assert np.allclose(first[1], second[0])
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_round_trip_and_reopen()
+    test_least_recently_used_entries_are_evicted()
+    test_cached_embedding_only_embeds_misses()
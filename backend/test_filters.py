@@ -0,0 +1,127 @@
+import asyncio
+import shutil
+import tempfile
+
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from app.answer_cache import AnswerCache
+from app.bm25 import BM25Index
+from app.filters import build_filters, filters_key
+from app.language import detect_language
+import app.ingestion as ingestion
+import app.vector_store as vector_store_module
+from app.vector_store import NumpyVectorStore
+from test_shards import _index_text
+from test_streaming_ingest import _use_temp_index
+
+
+def _nodes():
+    return [
+        TextNode(
+            id_=f"n{i}",
+            text=f"stamp duty on a gift deed {i}",
+            embedding=[1.0, i / 10],
+            metadata={"document_id": i % 3, "user_id": 7, "upload_date": f"2024-0{i + 1}-01T10:00:00", "language": "en"},
+        )
+        for i in range(9)
+    ]
+
+
+def test_scoped_vector_and_keyword_search():
+    root = tempfile.mkdtemp()
+    try:
+        store = NumpyVectorStore(root)
+        nodes = _nodes()
+        store.add(nodes)
+        store.persist()
+        filters = build_filters(document_ids=[1], uploaded_after="2024-03-01")
+        assert store.filter_node_ids(filters) == ["n4", "n7"]
+
+        result = store.query(VectorStoreQuery(query_embedding=[1.0, 0.0], similarity_top_k=5, filters=filters))
+        assert result.ids == ["n4", "n7"]
+        empty = build_filters(languages=["hi"])
+        assert store.query(VectorStoreQuery(query_embedding=[1.0, 0.0], similarity_top_k=5, filters=empty)).ids == []
+
+        bm25 = BM25Index(f"{root}/bm25")
+        bm25.add((node.node_id, None, node.text) for node in nodes)
+        hits = bm25.search("gift deed", top_k=5, node_ids=store.filter_node_ids(filters))
+        assert {node_id for node_id, _ in hits} == {"n4", "n7"}
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_answer_cache_is_scoped():
+    cache = AnswerCache()
+    scope = filters_key(build_filters(document_ids=[1]))
+    assert cache.get("what is the stamp duty?", 1, scope) is None
+    cache.put("what is the stamp duty?", "scoped answer", 1, 1.0, scope=scope)
+    assert cache.get("what is the stamp duty", 1, scope) == "scoped answer"
+    assert cache.get("what is the stamp duty", 1) is None
+
+
+def test_detect_language():
+    assert detect_language("The appellant filed a suit.") == "en"
+    assert detect_language("अपीलकर्ता ने वाद दायर किया") == "hi"
+    assert detect_language("") == "unknown"
+
+
+def test_date_only_filters_use_the_sorted_index():
+    root = tempfile.mkdtemp()
+    try:
+        store = NumpyVectorStore(root)
+        nodes = _nodes()
+        store.add(nodes[4:])
+        store.add(nodes[:4])  # uploaded out of order
+        store.persist()
+        checked = []
+        matches = vector_store_module.metadata_matches
+
+        def counting(metadata, filters):
+            checked.append(metadata["upload_date"])
+            return matches(metadata, filters)
+
+        vector_store_module.metadata_matches = counting
+        try:
+            window = build_filters(uploaded_after="2024-03-01", uploaded_before="2024-05-01T10:00:00")
+            assert sorted(store.filter_node_ids(window)) == ["n2", "n3"]
+            assert len(checked) == 2  # only the rows in the date range are read
+            assert store.filter_node_ids(build_filters(uploaded_after="2024-09-01T10:00:00")) == ["n8"]
+            assert sorted(NumpyVectorStore(root).filter_node_ids(build_filters(uploaded_before="2024-02-01"))) == ["n0"]
+        finally:
+            vector_store_module.metadata_matches = matches
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_filtered_query_and_stream_without_shards():
+    root = tempfile.mkdtemp()
+    versions = ingestion.index_versions
+    try:
+        _use_temp_index(root)
+        _index_text("Lease of the warehouse.", 1)
+        _index_text("Lease of the office.", 2)
+        filters = build_filters(document_ids=[1])
+
+        response = asyncio.run(ingestion.run_query("lease", filters=filters))
+        assert [hit.node.metadata["document_id"] for hit in response.source_nodes] == [1]
+
+        async def stream():
+            response = await ingestion.stream_query("lease office", filters=filters)
+            tokens = [token async for token in ingestion.iter_answer_tokens(response)]
+            return response, tokens
+
+        response, tokens = asyncio.run(stream())
+        assert [hit.node.metadata["document_id"] for hit in response.source_nodes] == [1]
+        assert "".join(tokens)
+    finally:
+        _use_temp_index(versions.root)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_scoped_vector_and_keyword_search()
+    test_answer_cache_is_scoped()
+    test_detect_language()
+    test_date_only_filters_use_the_sorted_index()
+    test_filtered_query_and_stream_without_shards()
@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+
+import app.ingestion as ingestion
+import reingest
+from app.database import Document
+from app.hashing import file_sha256
+from app.index_versions import IndexVersions, LEGACY_VERSION
+from app.vector_store import NumpyVectorStore
+from test_dedupe import _use_temp_db
+from test_streaming_ingest import _use_temp_index
+
+
+def test_activate_and_rollback():
+    root = tempfile.mkdtemp()
+    try:
+        versions = IndexVersions(root)
+        assert versions.current_version() == LEGACY_VERSION
+        assert versions.current_path() == root
+
+        blue = versions.create()
+        versions.activate(blue)
+        assert versions.current_path() == os.path.join(root, "versions", blue)
+        green = versions.create()
+        versions.activate(green)
+        assert (versions.current_version(), versions.previous_version()) == (green, blue)
+
+        # Another process sees the flip through the pointer file
+        assert IndexVersions(root).current_version() == green
+        assert versions.rollback() == blue
+        assert IndexVersions(root).current_version() == blue
+
+        for live in (blue, green):
+            try:
+                versions.remove(live)
+                assert False, "removed a live or rollback version"
+            except ValueError:
+                pass
+        third = versions.create()
+        versions.remove(third)
+        assert third not in versions.versions()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def _add_document(SessionLocal, root, document_id, text, user_id=7):
+    file_path = os.path.join(root, f"upload-{document_id}.txt")
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    db = SessionLocal()
+    db.add(Document(id=document_id, filename=os.path.basename(file_path), user_id=user_id, file_path=file_path,
+                    content_hash=file_sha256(file_path)))
+    db.commit()
+    db.close()
+
+
+def test_catch_up_before_switching():
+    root = tempfile.mkdtemp()
+    versions, session_local = ingestion.index_versions, reingest.SessionLocal
+    try:
+        _use_temp_index(os.path.join(root, "index"))
+        reingest.index_versions = ingestion.index_versions
+        SessionLocal = reingest.SessionLocal = _use_temp_db(root)
+        _add_document(SessionLocal, root, 1, "Lease of the warehouse in Pune for eleven months.")
+        _add_document(SessionLocal, root, 2, "Gift deed of the flat to the daughter.")
+        version = ingestion.index_versions.create()
+        assert reingest.catch_up_version(version, workers=1) == set()
+
+        # Uploads and deletes after the version was built
+        db = SessionLocal()
+        db.query(Document).filter(Document.id == 1).delete()
+        db.commit()
+        db.close()
+        _add_document(SessionLocal, root, 3, "Will leaving the farm land to the son.")
+        assert reingest.catch_up_version(version, workers=1) == set()
+
+        vector_store = NumpyVectorStore(ingestion.index_versions.path(version))
+        assert [bool(vector_store.lookup("document_id", document_id)) for document_id in (1, 2, 3)] == [False, True, True]
+        assert reingest.unfinished_versions() == []  # not left looking like an interrupted rebuild
+    finally:
+        reingest.SessionLocal, reingest.index_versions = session_local, versions
+        _use_temp_index(versions.root)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_activate_and_rollback()
+    test_catch_up_before_switching()
@@ -0,0 +1,133 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+
+import app.jobs as jobs
+from app.database import Document, IngestionJob
+from app.index_versions import IndexVersions
+from test_dedupe import _use_temp_db
+
+
+def _job(SessionLocal, job_id):
+    db = SessionLocal()
+    try:
+        return db.query(IngestionJob).filter(IngestionJob.id == job_id).one()
+    finally:
+        db.close()
+
+
+def _add_document(SessionLocal, root, document_id):
+    file_path = os.path.join(root, f"upload-{document_id}.pdf")
+    with open(file_path, "wb") as f:
+        f.write(b"%PDF")
+    db = SessionLocal()
+    db.add(Document(id=document_id, filename=f"upload-{document_id}.pdf", user_id=7, file_path=file_path))
+    db.commit()
+    db.close()
+    return file_path
+
+
+def test_claims_oldest_runnable_job_once():
+    root = tempfile.mkdtemp()
+    session_local = jobs.SessionLocal
+    try:
+        SessionLocal = _use_temp_db(root)
+        first = jobs.enqueue_ingestion(1, 7, "a.pdf", "/data/a.pdf")
+        second = jobs.enqueue_ingestion(2, 7, "b.pdf", "/data/b.pdf")
+        later = jobs.enqueue_ingestion(3, 7, "c.pdf", "/data/c.pdf")
+        db = SessionLocal()
+        db.query(IngestionJob).filter(IngestionJob.id == later).update({"run_after": time.time() + 60})
+        db.commit()
+        db.close()
+
+        claimed = jobs._claim_next_job()
+        assert (claimed.id, claimed.status, claimed.attempts) == (first, "running", 1)
+        assert jobs._claim_next_job().id == second
+        assert jobs._claim_next_job() is None  # the third is waiting for its retry time
+        assert _job(SessionLocal, first).status == "running"
+    finally:
+        jobs.SessionLocal = session_local
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_retries_then_fails_and_cleans_up():
+    root = tempfile.mkdtemp()
+    saved = jobs.SessionLocal, jobs.ingest_file, jobs.delete_document_vectors, jobs.INGEST_MAX_ATTEMPTS, jobs.INGEST_RETRY_DELAY
+    cleaned = []
+
+    async def failing_ingest(file_path, **kwargs):
+        kwargs["progress"]("extracting")
+        raise RuntimeError("OCR quota exceeded")
+
+    try:
+        SessionLocal = _use_temp_db(root)
+        jobs.ingest_file = failing_ingest
+        jobs.delete_document_vectors = lambda document_id, user_id: cleaned.append(document_id)
+        jobs.INGEST_MAX_ATTEMPTS, jobs.INGEST_RETRY_DELAY = 2, 0
+        file_path = _add_document(SessionLocal, root, 1)
+        job_id = jobs.enqueue_ingestion(1, 7, "upload-1.pdf", file_path)
+
+        asyncio.run(jobs._run_job(jobs._claim_next_job()))
+        job = _job(SessionLocal, job_id)
+        assert (job.status, job.stage, job.error, job.attempts) == ("queued", "extracting", "OCR quota exceeded", 1)
+        assert os.path.exists(file_path)
+
+        asyncio.run(jobs._run_job(jobs._claim_next_job()))
+        job = _job(SessionLocal, job_id)
+        assert (job.status, job.attempts) == ("failed", 2)
+        assert cleaned == [1, 1]  # partial chunks dropped after each attempt
+        db = SessionLocal()
+        assert db.query(Document).count() == 0
+        db.close()
+        assert not os.path.exists(file_path)
+    finally:
+        jobs.SessionLocal, jobs.ingest_file, jobs.delete_document_vectors, jobs.INGEST_MAX_ATTEMPTS, jobs.INGEST_RETRY_DELAY = saved
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_successful_job_is_done():
+    root = tempfile.mkdtemp()
+    saved = jobs.SessionLocal, jobs.ingest_file
+
+    async def ingest(file_path, **kwargs):
+        kwargs["progress"]("embedding")
+        return 12
+
+    try:
+        SessionLocal = _use_temp_db(root)
+        jobs.ingest_file = ingest
+        job_id = jobs.enqueue_ingestion(1, 7, "a.pdf", _add_document(SessionLocal, root, 1))
+        asyncio.run(jobs._run_job(jobs._claim_next_job()))
+        job = _job(SessionLocal, job_id)
+        assert (job.status, job.stage, job.chunks, job.error) == ("done", "done", 12, None)
+    finally:
+        jobs.SessionLocal, jobs.ingest_file = saved
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_nothing_is_claimed_while_ingestion_is_paused():
+    root = tempfile.mkdtemp()
+    saved = jobs.SessionLocal, jobs.index_versions
+    try:
+        SessionLocal = _use_temp_db(root)
+        jobs.index_versions = IndexVersions(os.path.join(root, "index"))
+        job_id = jobs.enqueue_ingestion(1, 7, "a.pdf", "/data/a.pdf")
+        jobs.index_versions.pause_ingestion()
+        assert IndexVersions(jobs.index_versions.root).ingestion_paused()  # seen by every process
+        assert jobs._claim_next_job() is None
+        assert (_job(SessionLocal, job_id).status, _job(SessionLocal, job_id).attempts) == ("queued", 0)
+
+        jobs.index_versions.resume_ingestion()
+        assert jobs._claim_next_job().id == job_id
+    finally:
+        jobs.SessionLocal, jobs.index_versions = saved
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_claims_oldest_runnable_job_once()
+    test_retries_then_fails_and_cleans_up()
+    test_successful_job_is_done()
+    test_nothing_is_claimed_while_ingestion_is_paused()
@@ -0,0 +1,57 @@
+from llama_index.core import Document
+
+from app.legal_chunker import LegalStructureSplitter, structural_units
+
+ACT = """CHAPTER II
+Succession
+6. Devolution of interest in coparcenary property. —
+(1)On and from the commencement of the Act, the daughter of a coparcener shall,—(a)by birth become a
+coparcener in her own right;(b)have the same rights as a son.(2)Any property to which a female Hindu
+becomes entitled by virtue of sub-section (1) shall be held by her with the incidents of ownership.
+7. Interest in the property of a tarwad. —
+(1)When a Hindu dies, his interest shall devolve under Section 2(j) of this Act.
+"""
+
+
+def test_units_follow_structure():
+    units = [" ".join(unit.split()) for unit in structural_units(ACT)]
+    assert units[0] == "CHAPTER II Succession"
+    assert units[2].startswith("(1)On and from")
+    # "sub-section (1)" and "2(j)" are references, not boundaries
+    assert any(unit.startswith("(2)Any property") and "sub-section (1) shall" in unit for unit in units)
+    assert any("Section 2(j) of this Act." in unit for unit in units)
+
+
+def test_chunks_keep_clauses_whole_and_record_section_path():
+    splitter = LegalStructureSplitter(chunk_size=96)
+    nodes = splitter.get_nodes_from_documents([Document(text=ACT)])
+    texts = [node.text for node in nodes]
+    # No overlap: every clause is in exactly one chunk
+    for unit in structural_units(ACT):
+        assert sum(unit.strip() in text for text in texts) == 1, unit
+    # Small whole sections are packed together; the path names the range
+    assert [node.metadata["section_path"] for node in nodes] == ["CHAPTER II > 6", "CHAPTER II > 6–7"]
+    assert texts[1].startswith("(2)Any property")
+
+
+def test_section_path_carries_across_pages():
+    pages = [
+        Document(text="6. Devolution of interest.\n(3)Where a Hindu dies after the commencement of the Act,"),
+        Document(text="his interest shall devolve by testamentary or intestate succession."),
+    ]
+    nodes = LegalStructureSplitter(chunk_size=256).get_nodes_from_documents(pages)
+    assert nodes[-1].metadata["section_path"] == "6 > (3)"
+
+
+def test_oversized_clause_is_split_by_sentences():
+    clause = "(1)" + " ".join(f"The lessee shall pay rent number {i}." for i in range(200))
+    nodes = LegalStructureSplitter(chunk_size=128).get_nodes_from_documents([Document(text=clause)])
+    assert len(nodes) > 1
+    assert {node.metadata["section_path"] for node in nodes} == {"(1)"}
+
+
+if __name__ == "__main__":
+    test_units_follow_structure()
+    test_chunks_keep_clauses_whole_and_record_section_path()
+    test_section_path_carries_across_pages()
+    test_oversized_clause_is_split_by_sentences()
@@ -0,0 +1,122 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+
+import pymupdf
+
+import app.ingestion as ingestion
+from app.ocr_cache import OCRCache
+
+
+def test_round_trip_and_keys():
+    root = tempfile.mkdtemp()
+    try:
+        cache = OCRCache(root)
+        key = OCRCache.make_key("file-a", 3, "gemini", "v1")
+        assert cache.get(key) is None
+        cache.put(key, "Schedule of property", file_hash="file-a", page=3, model="gemini", prompt_version="v1")
+        assert cache.get(key) == "Schedule of property"
+        assert OCRCache(root).get(key) == "Schedule of property"  # on disk, not in memory
+
+        # Another page, model or prompt version is another entry
+        assert len({key, OCRCache.make_key("file-a", 4, "gemini", "v1"), OCRCache.make_key("file-a", 3, "gemini", "v2"),
+                    OCRCache.make_key("file-a", 3, "other", "v1")}) == 4
+        stats = cache.stats()
+        assert (stats["entries"], stats["files"], stats["hits"], stats["misses"]) == (1, 1, 1, 1)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_eviction_filters():
+    root = tempfile.mkdtemp()
+    try:
+        cache = OCRCache(root)
+        for file_hash, page, version in (("a", 1, "v1"), ("a", 2, "v2"), ("b", 1, "v1")):
+            cache.put(OCRCache.make_key(file_hash, page, "m", version), f"{file_hash}{page}",
+                      file_hash=file_hash, page=page, model="m", prompt_version=version)
+        assert cache.evict(prompt_version="v1", file_hash="b") == 1
+        assert cache.evict(older_than=time.time() - 3600) == 0
+        assert cache.evict(prompt_version="v2") == 1
+        assert [entry["text"] for _, entry in cache.entries()] == ["a1"]
+        assert cache.evict() == 1 and cache.stats()["entries"] == 0
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_damaged_entries_are_misses_and_can_be_rewritten():
+    root = tempfile.mkdtemp()
+    try:
+        cache = OCRCache(root)
+        key = OCRCache.make_key("a", 1, "m", "v1")
+        cache.put(key, "text", file_hash="a", page=1)
+        path = cache._path(key)
+        with open(path, "w") as f:
+            f.write('{"text": "trunc')  # torn by a crash
+        with open(f"{path}.tmp", "w") as f:
+            f.write("{}")  # an interrupted put
+        assert cache.get(key) is None
+        assert list(cache.entries()) == []
+        cache.put(key, "text again", file_hash="a", page=1)
+        assert cache.get(key) == "text again"
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def _write_pdf(path):
+    with pymupdf.open() as pdf:
+        page = pdf.new_page()
+        page.insert_text((72, 72), "Sale deed between the parties, registered at Pune in 2004.")
+        page.insert_text((72, 100), "The vendor conveys the flat described in the schedule below.")
+        pdf.new_page()  # scanned: no text layer
+        pdf.new_page()
+        pdf.save(path)
+
+
+def test_scanned_pages_are_ocrd_once():
+    root = tempfile.mkdtemp()
+    cache, ocr_page_range = ingestion._ocr_cache, ingestion._ocr_page_range
+    ocr_pages = []
+
+    async def fake_ocr(file_path, page_range):
+        ocr_pages.extend(page["page_number"] for page in page_range)
+        return [f"Scanned page {page['page_number']} of the sale deed." for page in page_range]
+
+    try:
+        ingestion._ocr_cache = OCRCache(os.path.join(root, "ocr"))
+        ingestion._ocr_page_range = fake_ocr
+        pdf_path = os.path.join(root, "deed.pdf")
+        _write_pdf(pdf_path)
+
+        async def extract():
+            return [document async for document in ingestion.iter_documents(pdf_path, "deed-hash")]
+
+        first = asyncio.run(extract())
+        assert sorted(ocr_pages) == [1, 2]
+        assert [document.metadata["extraction"] for document in first] == ["text_layer", "ocr", "ocr"]
+        assert ingestion._ocr_cache.stats()["entries"] == 2
+
+        second = asyncio.run(extract())
+        assert sorted(ocr_pages) == [1, 2]  # served from the cache
+        assert [document.text for document in second] == [document.text for document in first]
+        stats = ingestion._ocr_cache.stats()
+        assert (stats["hits"], stats["misses"]) == (2, 2)
+
+        # ingest_file's chunking pass re-reads the cache without OCR: no lookups are counted
+        async def reread():
+            return [document async for document in ingestion.iter_documents(pdf_path, "deed-hash", ocr=False)]
+
+        assert [document.text for document in asyncio.run(reread())] == [document.text for document in first]
+        stats = ingestion._ocr_cache.stats()
+        assert (stats["hits"], stats["misses"]) == (2, 2)
+    finally:
+        ingestion._ocr_cache, ingestion._ocr_page_range = cache, ocr_page_range
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_round_trip_and_keys()
+    test_eviction_filters()
+    test_damaged_entries_are_misses_and_can_be_rewritten()
+    test_scanned_pages_are_ocrd_once()
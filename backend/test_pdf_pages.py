@@ -0,0 +1,97 @@
+import asyncio
+import os
+import shutil
+import tempfile
+
+import pymupdf
+
+import app.ingestion as ingestion
+from app.ocr_cache import OCRCache
+from app.pdf_pages import split_marked_pages, triage_pdf, write_page_subset
+
+PAGES = 8
+
+
+def _write_scanned_pdf(path):
+    # Every page has a short stamp ("p0".."p7") but no real text layer: all need OCR
+    with pymupdf.open() as pdf:
+        for number in range(PAGES):
+            pdf.new_page().insert_text((72, 72), f"p{number}")
+        pdf.save(path)
+
+
+def _stamps(path):
+    with pymupdf.open(path) as pdf:
+        return [page.get_text("text").strip() for page in pdf]
+
+
+def test_split_marked_pages():
+    text = "=== PAGE 2 ===\nsecond\n=== PAGE 1 ===\nfirst\n===PAGE 3===\nthird\n=== PAGE 2 ===\nmore\n=== PAGE 9 ===\nnone"
+    assert split_marked_pages(text, 3) == ["first", "second\n\nmore", "third"]
+    assert split_marked_pages("no markers at all", 3) == ["no markers at all", "", ""]
+    assert split_marked_pages("", 2) == ["", ""]
+
+
+def test_triage_windows_and_page_subsets():
+    root = tempfile.mkdtemp()
+    try:
+        path = os.path.join(root, "scan.pdf")
+        _write_scanned_pdf(path)
+        window = triage_pdf(path, start=3, stop=6)
+        assert [(page["page_number"], page["page_label"]) for page in window] == [(3, "4"), (4, "5"), (5, "6")]
+        assert all(page["needs_ocr"] for page in window)
+        assert len(triage_pdf(path, start=6, stop=100)) == 2
+
+        subset = os.path.join(root, "subset.pdf")
+        write_page_subset(path, [5, 2, 7], subset)
+        assert _stamps(subset) == ["p5", "p2", "p7"]
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_ranges_are_ocrd_in_page_order_and_retried_alone():
+    root = tempfile.mkdtemp()
+    saved = (ingestion.process_with_gemini_ocr, ingestion._ocr_cache, ingestion.OCR_PAGES_PER_REQUEST,
+             ingestion.OCR_MAX_ATTEMPTS, ingestion.OCR_RETRY_DELAY)
+    calls = []
+
+    async def fake_ocr(file_path, page_count=None):
+        # The uploaded subset's stamps tell which pages were sent, in which order
+        stamps = _stamps(file_path)
+        assert len(stamps) == page_count
+        calls.append(stamps)
+        if "p3" in stamps and calls.count(stamps) == 1:
+            raise RuntimeError("503 from the OCR model")
+        if "p6" in stamps:
+            raise RuntimeError("page range keeps failing")
+        # Out of order on purpose: the markers decide where text goes
+        return "\n".join(f"=== PAGE {i} ===\nTranscribed {stamps[i - 1]}" for i in reversed(range(1, page_count + 1)))
+
+    try:
+        ingestion.process_with_gemini_ocr = fake_ocr
+        ingestion._ocr_cache = OCRCache(os.path.join(root, "ocr"))
+        ingestion.OCR_PAGES_PER_REQUEST, ingestion.OCR_MAX_ATTEMPTS, ingestion.OCR_RETRY_DELAY = 3, 2, 0
+        path = os.path.join(root, "scan.pdf")
+        _write_scanned_pdf(path)
+
+        async def extract():
+            return [document async for document in ingestion.iter_documents(path, "scan-hash")]
+
+        documents = asyncio.run(extract())
+        assert sorted(calls) == sorted([["p0", "p1", "p2"], ["p3", "p4", "p5"], ["p3", "p4", "p5"],
+                                        ["p6", "p7"], ["p6", "p7"]])
+        assert [document.metadata["page_label"] for document in documents] == [str(n + 1) for n in range(PAGES)]
+        assert [document.text.strip() for document in documents] == (
+            [f"Transcribed p{n}" for n in range(6)] + ["p6", "p7"]  # the failed range keeps its text layer
+        )
+        assert [document.metadata["extraction"] for document in documents] == ["ocr"] * 6 + ["text_layer"] * 2
+    finally:
+        (ingestion.process_with_gemini_ocr, ingestion._ocr_cache, ingestion.OCR_PAGES_PER_REQUEST,
+         ingestion.OCR_MAX_ATTEMPTS, ingestion.OCR_RETRY_DELAY) = saved
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_split_marked_pages()
+    test_triage_windows_and_page_subsets()
+    test_ranges_are_ocrd_in_page_order_and_retried_alone()
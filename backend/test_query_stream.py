@@ -0,0 +1,99 @@
+import json
+import shutil
+import tempfile
+
+from fastapi.testclient import TestClient
+from llama_index.core.schema import NodeWithScore, TextNode
+
+import app.ingestion as ingestion
+import main
+from app.auth import get_current_active_user
+from app.database import User
+from test_shards import _index_text
+from test_streaming_ingest import _use_temp_index
+
+
+def _client(role="lawyer"):
+    main.app.dependency_overrides[get_current_active_user] = lambda: User(id=1, role=role, is_active=True)
+    return TestClient(main.app)  # not entered: no startup hooks (index warm-up, ingestion workers)
+
+
+def _events(body: str):
+    """(event, data) pairs of an SSE body; every event must be a complete 'event:'/'data:' block."""
+    events = []
+    assert body.endswith("\n\n")
+    for block in body[:-2].split("\n\n"):
+        event, data = block.split("\n")
+        assert event.startswith("event: ") and data.startswith("data: ")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def test_sources_then_tokens_then_done():
+    root = tempfile.mkdtemp()
+    versions = ingestion.index_versions
+    try:
+        _use_temp_index(root)
+        _index_text("Lease of the warehouse in Pune.", 1)
+        _index_text("Gift deed of the flat in Mumbai.", 2)
+        response = _client().post("/query/stream", json={"query": "lease", "filters": {"document_ids": [1]}})
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+
+        events = _events(response.text)
+        names = [name for name, _ in events]
+        assert names[0] == "sources" and names[-1] == "done"
+        assert set(names[1:-1]) == {"token"} and len(names) > 2
+        assert [source["file"] for source in events[0][1]["sources"]] == ["Unknown Source"]
+        assert "warehouse" in events[0][1]["sources"][0]["text"]
+        assert events[-1][1] == {}
+    finally:
+        main.app.dependency_overrides.clear()
+        _use_temp_index(versions.root)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+class _FailingStream:
+    """A streaming engine response whose generation breaks after the first token."""
+
+    def __init__(self):
+        node = TextNode(text="Section 6 of the Hindu Succession Act.", metadata={"file_name": "hsa.pdf", "page_label": "3"})
+        self.source_nodes = [NodeWithScore(node=node, score=0.9)]
+        self.metadata = {}
+
+        def tokens():
+            yield "Daughters"
+            raise RuntimeError("connection reset by the LLM")
+
+        self.response_gen = tokens()
+
+
+def test_generation_failure_ends_with_an_error_event():
+    stream_query = main.stream_query
+
+    async def stubbed(query_str, filters=None, shard_keys=None):
+        return _FailingStream()
+
+    try:
+        main.stream_query = stubbed
+        events = _events(_client().post("/query/stream", json={"query": "section 6"}).text)
+        assert events == [
+            ("sources", {"sources": [{"file": "hsa.pdf", "page": "3", "section": "",
+                                      "text": "Section 6 of the Hindu Succession Act.", "score": 0.9}]}),
+            ("token", {"text": "Daughters"}),
+            ("error", {"detail": "Failed to generate the answer"}),
+        ]
+
+        async def no_index(query_str, filters=None, shard_keys=None):
+            return None
+
+        main.stream_query = no_index
+        assert _client().post("/query/stream", json={"query": "section 6"}).status_code == 404
+    finally:
+        main.stream_query = stream_query
+        main.app.dependency_overrides.clear()
+
+
+if __name__ == "__main__":
+    test_sources_then_tokens_then_done()
+    test_generation_failure_ends_with_an_error_event()
@@ -0,0 +1,98 @@
+import asyncio
+import os
+import shutil
+import tempfile
+
+from llama_index.core.embeddings import MockEmbedding
+
+import app.ingestion as ingestion
+import main
+from app.embedding_cache import CachedEmbedding, EmbeddingCache
+from test_query_stream import _client
+from test_shards import _index_text
+from test_streaming_ingest import _use_temp_index
+
+
+class CountingQueries(MockEmbedding):
+    queries: list = []
+
+    def _get_query_embedding(self, query):
+        self.queries.append(query)
+        return super()._get_query_embedding(query)
+
+
+def test_query_embedding_lru():
+    root = tempfile.mkdtemp()
+    try:
+        inner = CountingQueries(embed_dim=4, queries=[])
+        model = CachedEmbedding(inner, EmbeddingCache(os.path.join(root, "embeddings.db")), query_cache_size=2)
+        for query in ["stamp duty", "gift deed", "stamp duty", "lease", "gift deed", "lease"]:
+            model.get_query_embedding(query)
+        # "gift deed" was the least recently used when "lease" came in
+        assert inner.queries == ["stamp duty", "gift deed", "lease", "gift deed"]
+        stats = model.query_cache_stats()
+        assert (stats["entries"], stats["hits"], stats["misses"]) == (2, 2, 4)
+        assert asyncio.run(model.aget_query_embedding("lease")) == model.get_query_embedding("lease")
+        assert inner.queries[4:] == []
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def _texts(response):
+    return sorted(source["text"] for source in response.json()["sources"])
+
+
+def test_search_follows_uploads_and_deletes():
+    root = tempfile.mkdtemp()
+    versions = ingestion.index_versions
+    try:
+        _use_temp_index(root)
+        client = _client()
+        assert client.post("/search", json={"query": "lease"}).status_code == 404  # no index yet
+
+        _index_text("Lease of the warehouse in Pune.", 1)
+        assert _texts(client.post("/search", json={"query": "lease"})) == ["Lease of the warehouse in Pune."]
+        asyncio.run(ingestion.run_query("lease"))
+        asyncio.run(ingestion.run_query("lease"))
+        assert ingestion._answer_cache.stats()["exact_hits"] >= 1
+
+        # An upload and a delete both change what is found, and drop the cached answers
+        _index_text("Lease of the office in Mumbai.", 2)
+        assert ingestion._answer_cache.get("lease", ingestion._index_version) is None
+        assert _texts(client.post("/search", json={"query": "lease"})) == [
+            "Lease of the office in Mumbai.", "Lease of the warehouse in Pune."
+        ]
+        asyncio.run(ingestion.run_query("lease"))
+        assert ingestion.delete_document_vectors(1)
+        assert ingestion._answer_cache.get("lease", ingestion._index_version) is None
+        assert _texts(client.post("/search", json={"query": "lease"})) == ["Lease of the office in Mumbai."]
+    finally:
+        main.app.dependency_overrides.clear()
+        _use_temp_index(versions.root)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_search_clamps_top_k():
+    run_search = main.run_search
+    asked = []
+
+    async def stubbed(query_str, top_k=10, filters=None, shard_keys=None):
+        asked.append(top_k)
+        return []
+
+    try:
+        main.run_search = stubbed
+        client = _client()
+        for top_k in (0, -5, 7, 50, 500):
+            assert client.post("/search", json={"query": "lease", "top_k": top_k}).json() == {"sources": []}
+        client.post("/search", json={"query": "lease"})
+        assert asked == [1, 1, 7, 50, 50, 10]
+    finally:
+        main.run_search = run_search
+        main.app.dependency_overrides.clear()
+
+
+if __name__ == "__main__":
+    test_query_embedding_lru()
+    test_search_follows_uploads_and_deletes()
+    test_search_clamps_top_k()
@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+
+from app.segment_store import SEGMENTS_DIR, SegmentStore
+from app.vector_store import NumpyVectorStore
+from test_vector_store import _nodes, _top
+
+
+def test_append_reload_and_compact():
+    root = tempfile.mkdtemp()
+    try:
+        store = SegmentStore(root)
+        assert not store.exists() and list(store.iter_records()) == []
+        store.append([{"n": 1}, {"n": 2}], rows=2)
+        store.append([{"n": 3}], rows=3)
+
+        reopened = SegmentStore(root)
+        assert reopened.manifest["rows"] == 3 and reopened.segment_count == 2
+        assert [record["n"] for record in reopened.iter_records()] == [1, 2, 3]
+
+        reopened.compact([{"n": 1}, {"n": 3}], rows=2)
+        assert os.listdir(os.path.join(root, SEGMENTS_DIR)) == reopened.manifest["segments"]
+        assert [record["n"] for record in SegmentStore(root).iter_records()] == [1, 3]
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_uncommitted_writes_are_ignored_and_cleaned_up():
+    root = tempfile.mkdtemp()
+    try:
+        store = SegmentStore(root)
+        store.append([{"n": 1}], rows=1)
+        # A crash after writing a segment but before the manifest named it, and one mid-manifest write
+        store._write_segment([{"n": 2}])
+        with open(os.path.join(root, "manifest.json.tmp"), "w") as f:
+            f.write('{"segments": [')
+
+        recovered = SegmentStore(root)
+        assert [record["n"] for record in recovered.iter_records()] == [1]
+        assert recovered.manifest["rows"] == 1
+        recovered.append([{"n": 3}], rows=2)  # reuses the orphan's name: overwritten, not appended to
+        assert [record["n"] for record in SegmentStore(root).iter_records()] == [1, 3]
+        recovered.compact([{"n": 1}, {"n": 3}], rows=2)
+        assert len(os.listdir(os.path.join(root, SEGMENTS_DIR))) == 1
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_vector_store_recovers_from_an_interrupted_append():
+    root = tempfile.mkdtemp()
+    try:
+        committed = _nodes(1, 6, seed=1)
+        vector_store = NumpyVectorStore(root)
+        vector_store.add(committed)
+        vector_store.persist()
+        manifest = SegmentStore(root).manifest
+        # Vectors and ids appended, then a crash before the manifest commit
+        with open(os.path.join(root, manifest["vectors_file"]), "ab") as f:
+            f.write(b"\x00" * 4 * 8 * 3)
+        with open(os.path.join(root, manifest["ids_file"]), "ab") as f:
+            f.write(b"lost-1\nlost-2\nlost-3\n")
+
+        recovered = NumpyVectorStore(root)
+        assert recovered.node_count == 6
+        more = _nodes(2, 4, seed=2)
+        recovered.add(more)
+        recovered.persist()  # truncates the uncommitted bytes before appending
+
+        reloaded = NumpyVectorStore(root)
+        assert reloaded.node_count == 10
+        assert [_top(reloaded, node)[0] for node in committed + more] == [node.node_id for node in committed + more]
+        with open(os.path.join(root, manifest["ids_file"])) as f:
+            assert f.read().split() == [node.node_id for node in committed + more]
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_append_reload_and_compact()
+    test_uncommitted_writes_are_ignored_and_cleaned_up()
+    test_vector_store_recovers_from_an_interrupted_append()
@@ -0,0 +1,132 @@
+import asyncio
+import os
+import shutil
+import tempfile
+
+from llama_index.core import Document
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, TextNode
+
+import app.ingestion as ingestion
+from app.retrieval import FanOutRetriever
+from app.shards import Shard, ShardManager
+from test_streaming_ingest import _use_temp_index
+
+MB = 1024 * 1024
+
+
+class _SizedShard(Shard):
+    def __init__(self, key, size):
+        super().__init__(key, index=None, bm25=None)
+        self.size = size
+
+    def memory_usage(self):
+        return {"heap_bytes": self.size, "mapped_bytes": 0}
+
+
+def _manager(root, budget_bytes, sizes):
+    loaded = []
+
+    def loader(key, path):
+        loaded.append(key)
+        return _SizedShard(key, sizes.get(key, MB))
+
+    for key in sizes:
+        os.makedirs(os.path.join(root, key))
+    return ShardManager(root, loader, budget_bytes=budget_bytes), loaded
+
+
+def test_lru_eviction_under_byte_budget():
+    root = tempfile.mkdtemp()
+    try:
+        shards, loaded = _manager(root, 2 * MB, {"user-1": MB, "user-2": MB, "user-3": MB})
+        assert shards.keys() == ["user-1", "user-2", "user-3"]
+        assert shards.get("user-9") is None
+
+        shards.get("user-1")
+        shards.get("user-2")
+        shards.get("user-1")  # user-2 is now least recently used
+        shards.get("user-3")
+        assert [shard.key for shard in shards.loaded()] == ["user-1", "user-3"]
+        shards.get("user-2")
+        assert loaded == ["user-1", "user-2", "user-3", "user-2"]
+        stats = shards.stats()
+        assert (stats["evictions"], stats["evicted_bytes"], stats["resident_bytes"]) == (2, 2 * MB, 2 * MB)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_oversized_and_pinned_shards_stay():
+    root = tempfile.mkdtemp()
+    try:
+        shards, _ = _manager(root, 2 * MB, {"user-1": MB, "user-2": MB, "user-3": 3 * MB})
+        with shards.pinned("user-1"):
+            writer = shards.get("user-1")
+            shards.get("user-2")
+            big = shards.get("user-3")  # over budget on its own, but it is the one being queried
+            assert shards.loaded() == [writer, big]
+        # Released: the writer's shard goes too
+        assert shards.loaded() == [big]
+
+        # A write grows a shard past the budget: re-measuring evicts the others
+        small = shards.get("user-1")
+        small.size = 3 * MB
+        shards.add(small)
+        assert shards.loaded() == [small]
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+class _FixedRetriever(BaseRetriever):
+    def __init__(self, hits):
+        self._hits = hits
+        super().__init__()
+
+    def _retrieve(self, query_bundle):
+        return [NodeWithScore(node=TextNode(id_=node_id, text=node_id), score=score) for node_id, score in self._hits]
+
+
+def test_fan_out_fuses_by_rank_not_raw_score():
+    # A citation hit (score 1.0) from one shard must not outrank another shard's best hybrid hit (RRF ~0.03)
+    # just because of its scale: each shard's first result ties, second results come after
+    citation_shard = _FixedRetriever([("a1", 1.0), ("a2", 1.0)])
+    hybrid_shard = _FixedRetriever([("b1", 0.033), ("b2", 0.016)])
+    hits = FanOutRetriever([citation_shard, hybrid_shard], similarity_top_k=3).retrieve("q")
+    ids = [hit.node.node_id for hit in hits]
+    assert set(ids[:2]) == {"a1", "b1"} and ids[2] in ("a2", "b2")
+    assert hits[0].score == hits[1].score
+
+
+def _index_text(text, document_id, shard_key=None):
+    nodes = ingestion.build_nodes([Document(text=text)], f"h{document_id}", f"t{document_id}", document_id=document_id)
+    ingestion._embed_nodes(nodes)
+    ingestion._insert_nodes(nodes, shard_key)
+
+
+def test_users_read_own_shared_and_root_chunks():
+    root = tempfile.mkdtemp()
+    versions, shard_mode = ingestion.index_versions, ingestion.INDEX_SHARD_MODE
+    try:
+        _use_temp_index(root)
+        _index_text("Lease of the warehouse indexed before sharding.", 1)  # root index
+        ingestion.INDEX_SHARD_MODE = "user"
+        _index_text("Lease of the office for tenant one.", 2, ingestion.shard_key_for(1))
+        _index_text("Lease of the shop for tenant two.", 3, ingestion.shard_key_for(2))
+        _index_text("Model lease without an uploader.", 4, ingestion.shard_key_for(None))
+
+        assert ingestion.list_shards() == ["shared", "user-1", "user-2", "root"]
+        hits = asyncio.run(ingestion.run_search("lease", shard_keys=ingestion.readable_shards(1)))
+        assert sorted(hit.node.metadata["document_id"] for hit in hits) == [1, 2, 4]
+        hits = asyncio.run(ingestion.run_search("lease", shard_keys=ingestion.list_shards()))
+        assert sorted(hit.node.metadata["document_id"] for hit in hits) == [1, 2, 3, 4]
+    finally:
+        ingestion.INDEX_SHARD_MODE = shard_mode
+        _use_temp_index(versions.root)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_lru_eviction_under_byte_budget()
+    test_oversized_and_pinned_shards_stay()
+    test_fan_out_fuses_by_rank_not_raw_score()
+    test_users_read_own_shared_and_root_chunks()
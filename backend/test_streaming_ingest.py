@@ -0,0 +1,122 @@
+import asyncio
+import os
+import shutil
+import tempfile
+
+import pymupdf
+from llama_index.core import Settings
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.llms import MockLLM
+
+import app.ingestion as ingestion
+from app.hashing import NormalizedTextHash
+from app.index_versions import IndexVersions
+
+PAGES = 12
+
+
+def _write_pdf(path):
+    with pymupdf.open() as pdf:
+        for number in range(PAGES):
+            page = pdf.new_page()
+            page.insert_text((72, 72), f"Page {number}: the lessee shall pay the rent of schedule {number}.")
+            page.insert_text((72, 100), "The lessor may terminate the lease under Section 111(g) of the Act.")
+        pdf.save(path)
+
+
+def _use_temp_index(root):
+    ingestion.index_versions = IndexVersions(root)
+    ingestion._index = ingestion._bm25 = ingestion._shards = ingestion._loaded_version = None
+    ingestion._query_engine = ingestion._streaming_engine = None
+    Settings.llm = MockLLM(max_tokens=4)
+    Settings.embed_model = MockEmbedding(embed_dim=8)
+    ingestion._settings_ready = True
+
+
+def test_incremental_text_hash_matches_whole_text():
+    from llama_index.core import Document
+
+    pages = ["  The Lessee\tshall pay\n", "", "rent   MONTHLY.  ", "\n\nSection 2(j)"]
+    streamed = NormalizedTextHash()
+    for text in pages:
+        streamed.update(text)
+    assert streamed.hexdigest() == ingestion.documents_text_hash([Document(text=text) for text in pages])
+
+
+def test_pdf_is_ingested_in_batches():
+    root = tempfile.mkdtemp()
+    batch_chunks, versions, inserts = ingestion.INGEST_BATCH_CHUNKS, ingestion.index_versions, []
+    insert_nodes = ingestion._insert_nodes
+    try:
+        _use_temp_index(root)
+        pdf_path = os.path.join(root, "bundle.pdf")
+        _write_pdf(pdf_path)
+        expected = len(asyncio.run(ingestion.extract_documents(pdf_path, "h")))
+        assert expected == PAGES
+
+        ingestion.INGEST_BATCH_CHUNKS = 5
+        ingestion._insert_nodes = lambda nodes, shard_key=None: (inserts.append(len(nodes)), insert_nodes(nodes, shard_key))
+        chunks = asyncio.run(ingestion.ingest_file(pdf_path, document_id=1, file_hash="h"))
+        assert chunks == PAGES and sum(inserts) == PAGES
+        assert max(inserts) <= 5 and len(inserts) == 3
+        assert ingestion.get_index().vector_store.node_count == PAGES
+
+        # Fully indexed: a second run is a duplicate
+        assert asyncio.run(ingestion.ingest_file(pdf_path, document_id=2, file_hash="h")) == 0
+
+        # A retry of an interrupted document replaces its partial chunks instead of being skipped
+        ingestion.delete_document_vectors(1)
+        partial = asyncio.run(ingestion.extract_documents(pdf_path, "h"))[:2]
+        nodes = ingestion.build_nodes(partial, "h", "t", document_id=3)
+        ingestion._embed_nodes(nodes)
+        insert_nodes(nodes)
+        assert asyncio.run(ingestion.ingest_file(pdf_path, document_id=3, file_hash="h")) == PAGES
+        assert ingestion.get_index().vector_store.node_count == PAGES
+    finally:
+        ingestion.INGEST_BATCH_CHUNKS = batch_chunks
+        ingestion._insert_nodes = insert_nodes
+        _use_temp_index(versions.root)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_reingest_worker_streams_pages():
+    import reingest
+
+    root = tempfile.mkdtemp()
+    versions, reingest_versions = ingestion.index_versions, reingest.index_versions
+    try:
+        _use_temp_index(root)
+        reingest.index_versions = ingestion.index_versions
+        pdf_path = os.path.join(root, "bundle.pdf")
+        _write_pdf(pdf_path)
+        info = {"document_id": 7, "file_name": "bundle.pdf", "user_id": 1}
+
+        file_hash, text_hash, spool_path, chunks = reingest._extract(pdf_path, info)
+        documents = asyncio.run(ingestion.extract_documents(pdf_path, file_hash))
+        assert text_hash == ingestion.documents_text_hash(documents)
+        node_parser = ingestion.create_node_parser()  # chunked page by page, as ingest_file does
+        expected = [node for document in documents
+                    for node in ingestion.build_nodes([document], file_hash, text_hash, node_parser=node_parser, **info)]
+        spooled = list(reingest._spooled_nodes(spool_path))
+        assert chunks == len(spooled) == len(expected) == PAGES
+        assert [(n.text, n.metadata, n.ref_doc_id) for n in spooled] == [(n.text, n.metadata, n.ref_doc_id) for n in expected]
+        # Each chunk keeps its own page (a whole-file build_nodes call gave them all the last page's label)
+        assert [n.metadata["page_label"] for n in spooled] == [str(n + 1) for n in range(PAGES)]
+
+        # The spooled chunks are embedded in batch_chunks batches, and the file counts once all are in
+        state = reingest._Rebuild(ingestion.index_versions.create(), batch_chunks=5, checkpoint_every=50)
+        state.add(pdf_path, None, file_hash, text_hash, reingest._spooled_nodes(spool_path))
+        assert state.chunks == 10 and state.unsaved_files == [] and state.buffered_files == [pdf_path]
+        state.checkpoint()
+        assert state.node_count == PAGES and state.done == {pdf_path}
+        os.remove(spool_path)
+    finally:
+        reingest.index_versions = reingest_versions
+        _use_temp_index(versions.root)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_incremental_text_hash_matches_whole_text()
+    test_pdf_is_ingested_in_batches()
+    test_reingest_worker_streams_pages()
@@ -0,0 +1,113 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+
+from app.uploads import UploadError, receive_upload
+
+BOUNDARY = "----lexboundary"
+ALLOWED = [".pdf", ".txt"]
+
+
+class FakeRequest:
+    """Just what receive_upload reads from a Starlette request: headers and the body stream."""
+
+    def __init__(self, body: bytes, chunk_size: int = 7, content_length=True, headers=None):
+        self.headers = {"content-type": f"multipart/form-data; boundary={BOUNDARY}"}
+        if content_length:
+            self.headers["content-length"] = str(len(body))
+        self.headers.update(headers or {})
+        self._body = body
+        self._chunk_size = chunk_size
+
+    async def stream(self):
+        for start in range(0, len(self._body), self._chunk_size):
+            yield self._body[start:start + self._chunk_size]
+
+
+def _body(filename: str, data: bytes, field: str = "file", close: bool = True) -> bytes:
+    body = (
+        f"--{BOUNDARY}\r\n"
+        'Content-Disposition: form-data; name="note"\r\n\r\n'
+        "not the file\r\n"
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        "Content-Type: application/octet-stream\r\n\r\n"
+    ).encode() + data + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode() if close else body
+
+
+def _receive(request, data_dir, max_bytes=1024):
+    return asyncio.run(receive_upload(request, data_dir, max_bytes, ALLOWED))
+
+
+def _error(request, data_dir, max_bytes=1024):
+    try:
+        _receive(request, data_dir, max_bytes)
+    except UploadError as e:
+        return e.status_code, e.detail
+    assert False, "expected an UploadError"
+
+
+def _tmp_files(data_dir):
+    tmp_dir = os.path.join(data_dir, "tmp")
+    return os.listdir(tmp_dir) if os.path.isdir(tmp_dir) else []
+
+
+def test_streams_to_content_addressed_storage():
+    data_dir = tempfile.mkdtemp()
+    try:
+        data = b"%PDF-1.4 lease deed\r\n--not a boundary\r\n" * 50
+        upload = _receive(FakeRequest(_body("../../Lease Deed.PDF", data)), data_dir, max_bytes=len(data))
+        assert (upload.filename, upload.size, upload.sha256) == ("Lease Deed.PDF", len(data), hashlib.sha256(data).hexdigest())
+        with open(upload.temp_path, "rb") as f:
+            assert f.read() == data
+
+        path = upload.commit(data_dir)
+        sha256 = hashlib.sha256(data).hexdigest()
+        assert path == os.path.join(data_dir, "objects", sha256[:2], f"{sha256}.pdf")
+        assert _tmp_files(data_dir) == []
+
+        # The same bytes again land on the same path
+        again = _receive(FakeRequest(_body("copy.pdf", data), chunk_size=4096), data_dir, max_bytes=len(data))
+        assert again.commit(data_dir) == path
+        assert os.listdir(os.path.dirname(path)) == [os.path.basename(path)]
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def test_rejects_before_writing():
+    data_dir = tempfile.mkdtemp()
+    try:
+        status, detail = _error(FakeRequest(_body("run.exe", b"MZ")), data_dir)
+        assert status == 400 and "Invalid file type" in detail
+        # Announced too large: rejected from the header
+        assert _error(FakeRequest(_body("big.pdf", b"x" * 10), headers={"content-length": str(10 ** 9)}), data_dir)[0] == 413
+        assert _error(FakeRequest(_body("a.pdf", b"x"), headers={"content-length": "12abc"}), data_dir)[0] == 400
+        assert _error(FakeRequest(b"", headers={"content-type": "application/json"}), data_dir)[0] == 400
+        assert _error(FakeRequest(_body("a.pdf", b"x", field="other")), data_dir)[1] == "No 'file' file in the upload"
+        assert _tmp_files(data_dir) == []
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def test_size_cap_and_incomplete_body_remove_the_partial_file():
+    data_dir = tempfile.mkdtemp()
+    try:
+        # No Content-Length (chunked): the cap is enforced while streaming
+        status, _ = _error(FakeRequest(_body("big.pdf", b"x" * 5000), content_length=False), data_dir, max_bytes=1024)
+        assert status == 413
+        assert _tmp_files(data_dir) == []
+
+        status, detail = _error(FakeRequest(_body("cut.pdf", b"x" * 500, close=False)), data_dir)
+        assert (status, detail) == (400, "Incomplete multipart body")
+        assert _tmp_files(data_dir) == []
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_streams_to_content_addressed_storage()
+    test_rejects_before_writing()
+    test_size_cap_and_incomplete_body_remove_the_partial_file()
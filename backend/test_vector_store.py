@@ -0,0 +1,143 @@
+import asyncio
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from llama_index.core.schema import NodeRelationship, RelatedNodeInfo, TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+import app.ingestion as ingestion
+from app.vector_store import NumpyVectorStore
+from test_shards import _index_text
+from test_streaming_ingest import _use_temp_index
+
+DIM = 8
+
+
+def _nodes(document_id, count, seed):
+    vectors = np.random.default_rng(seed).normal(size=(count, DIM)).astype(np.float32)
+    return [
+        TextNode(
+            id_=f"{document_id}-{number}",
+            text=f"Chunk {number} of document {document_id}",
+            embedding=vector.tolist(),
+            metadata={"document_id": document_id},
+            relationships={NodeRelationship.SOURCE: RelatedNodeInfo(node_id=str(document_id))},
+        )
+        for number, vector in enumerate(vectors)
+    ]
+
+
+def _top(vector_store, node, k=1):
+    return vector_store.query(VectorStoreQuery(query_embedding=node.embedding, similarity_top_k=k)).ids
+
+
+def test_add_persist_reload_query():
+    root = tempfile.mkdtemp()
+    try:
+        first, second = _nodes(1, 20, seed=1), _nodes(2, 5, seed=2)
+        vector_store = NumpyVectorStore(root)
+        vector_store.add(first)
+        persisted = NumpyVectorStore(root)
+        assert persisted.node_count == 0  # nothing is visible on disk before persist()
+
+        vector_store.persist()
+        vector_store.add(second)  # in the unpersisted tail
+        for node in (first[3], second[4]):
+            assert _top(vector_store, node) == [node.node_id]
+
+        vector_store.persist()
+        reloaded = NumpyVectorStore(root)
+        assert reloaded.node_count == 25
+        assert [_top(reloaded, node)[0] for node in first + second] == [node.node_id for node in first + second]
+        result = reloaded.query(VectorStoreQuery(query_embedding=first[0].embedding, similarity_top_k=3))
+        assert len(result.ids) == 3 and abs(result.similarities[0] - 1.0) < 1e-5
+        assert result.similarities == sorted(result.similarities, reverse=True)
+        assert [node.node_id for node in reloaded.lookup_nodes("document_id", 2)] == [node.node_id for node in second]
+        assert np.allclose(reloaded.get_embedding(reloaded.lookup("document_id", 2)[0]),
+                           np.asarray(second[0].embedding) / np.linalg.norm(second[0].embedding), atol=1e-6)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_delete_hides_chunks_and_survives_reload():
+    root = tempfile.mkdtemp()
+    try:
+        first, second = _nodes(1, 10, seed=3), _nodes(2, 10, seed=4)
+        vector_store = NumpyVectorStore(root)
+        vector_store.add(first + second)
+        vector_store.persist()
+        vector_store.delete("1")
+        assert vector_store.node_count == 10
+        assert vector_store.lookup("document_id", 1) == []
+        assert vector_store.get_nodes_by_id([first[0].node_id]) == []
+        assert not set(_top(vector_store, first[0], k=20)) & {node.node_id for node in first}
+
+        reloaded = NumpyVectorStore(root)
+        assert reloaded.node_count == 10
+        assert {node.node_id for node in reloaded.get_nodes()} == {node.node_id for node in second}
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_delete_query_compact_reload():
+    root = tempfile.mkdtemp()
+    try:
+        documents = {document_id: _nodes(document_id, 8, seed=document_id) for document_id in (1, 2, 3)}
+        vector_store = NumpyVectorStore(root)
+        vector_store.add([node for nodes in documents.values() for node in nodes])
+        vector_store.persist()
+        vector_store.delete("2")
+        deleted = {node.node_id for node in documents[2]}
+        before = [_top(vector_store, node, k=5) for node in documents[1] + documents[2]]
+        assert not deleted & {node_id for ids in before for node_id in ids}
+
+        old_files = set(os.listdir(root))
+        vector_store.compact()
+        assert vector_store.dead_ratio == 0 and vector_store.node_count == 16
+        assert [_top(vector_store, node, k=5) for node in documents[1] + documents[2]] == before
+        assert set(os.listdir(root)) != old_files  # rewritten into a new generation
+
+        # Rows were renumbered: lookups and new rows must follow
+        vector_store.add(_nodes(4, 2, seed=4))
+        vector_store.persist()
+        reloaded = NumpyVectorStore(root)
+        assert reloaded.node_count == 18
+        after = [[node_id for node_id in _top(reloaded, node, k=7) if not node_id.startswith("4-")][:5]
+                 for node in documents[1] + documents[2]]
+        assert after == before
+        assert [node.node_id for node in reloaded.lookup_nodes("document_id", 3)] == [node.node_id for node in documents[3]]
+        assert reloaded.lookup("document_id", 2) == []
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def test_ingestion_delete_and_compact():
+    root = tempfile.mkdtemp()
+    versions = ingestion.index_versions
+    try:
+        _use_temp_index(root)
+        for document_id, text in enumerate(["Lease of the warehouse.", "Lease of the office.", "Lease of the shop."], 1):
+            _index_text(text, document_id)
+
+        assert ingestion.delete_document_vectors(2)  # a third of the chunks is dead: compaction is due
+        hits = asyncio.run(ingestion.run_search("lease office", top_k=5))
+        assert sorted(hit.node.metadata["document_id"] for hit in hits) == [1, 3]
+
+        ingestion.compact_index()
+        assert ingestion.get_index().vector_store.dead_ratio == 0 and ingestion._bm25.dead_ratio == 0
+        _use_temp_index(root)  # reopen from disk
+        hits = asyncio.run(ingestion.run_search("lease office", top_k=5))
+        assert sorted(hit.node.metadata["document_id"] for hit in hits) == [1, 3]
+        assert ingestion._bm25.doc_count == ingestion.get_index().vector_store.node_count == 2
+    finally:
+        _use_temp_index(versions.root)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_add_persist_reload_query()
+    test_delete_hides_chunks_and_survives_reload()
+    test_delete_query_compact_reload()
+    test_ingestion_delete_and_compact()
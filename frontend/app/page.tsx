@@ -125,7 +125,27 @@ export default function Home() {
       }
 
       const data = await res.json();
-      setUploadStatus(`Uploaded: ${data.filename} (${data.chunks} chunks)`);
+      if (data.duplicate) {
+        setUploadStatus(`Already uploaded as: ${data.filename}`);
+        return;
+      }
+      setUploadStatus(`Uploaded: ${data.filename}. Processing...`);
+
+      // Ingestion runs in the background; poll the job until it finishes
+      while (true) {
+        await new Promise(resolve => setTimeout(resolve, 2000));
+        const jobRes = await fetch(`http://localhost:8000/jobs/${data.job_id}`, {
+          headers: { 'Authorization': `Bearer ${token}` }
+        });
+        if (!jobRes.ok) throw new Error('Could not check processing status');
+        const job = await jobRes.json();
+        if (job.status === 'done') {
+          setUploadStatus(`Uploaded: ${data.filename} (${job.chunks} chunks)`);
+          break;
+        }
+        if (job.status === 'failed') throw new Error(job.error || 'Processing failed');
+        setUploadStatus(`Uploaded: ${data.filename}. Processing (${job.stage || job.status})...`);
+      }
       fetchDocuments(); // Refresh list
     } catch (error: any) {
       console.error(error);
@@ -148,7 +168,7 @@ export default function Home() {
 
     try {
       const token = localStorage.getItem('token');
-      const res = await fetch('http://localhost:8000/query', {
+      const res = await fetch('http://localhost:8000/query/stream', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -157,7 +177,7 @@ export default function Home() {
         body: JSON.stringify({ query }),
       });
 
-      if (!res.ok) {
+      if (!res.ok || !res.body) {
         if (res.status === 401) {
           alert("Session timed out. Please login again.");
           localStorage.removeItem('token');
@@ -167,8 +187,28 @@ export default function Home() {
         throw new Error('Failed to fetch');
       }
 
-      const data = await res.json();
-      setMessages([...newMessages, { role: 'ai', content: data.response, sources: data.sources }]);
+      // Server-Sent Events: sources first, then answer tokens as they are generated
+      let content = '';
+      let sources: any[] = [];
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop() || '';
+        for (const raw of events) {
+          const event = raw.match(/^event: (.*)$/m)?.[1];
+          const data = JSON.parse(raw.match(/^data: (.*)$/m)?.[1] || '{}');
+          if (event === 'sources') sources = data.sources;
+          if (event === 'token') content += data.text;
+          if (event === 'error') throw new Error(data.detail);
+        }
+        setLoading(false);
+        setMessages([...newMessages, { role: 'ai', content, sources }]);
+      }
     } catch (error) {
       console.error(error);
       setMessages([...newMessages, { role: 'ai', content: 'Sorry, something went wrong.' }]);